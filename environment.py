@@ -12,144 +12,329 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-from pathlib import Path
+import time
 
 from behave import fixture, use_fixture
+from behave.model_core import Status
 from behave.runner import Context
+from behave.step_registry import registry
+
+from steps.utils.constants import (
+    DEFAULT_RENDER_TIMEOUT_SECONDS,
+    DEFAULT_RENDER_RETRIES,
+    DEFAULT_RENDER_RETRY_BACKOFF_SECONDS,
+    DEFAULT_RENDER_WORKERS,
+    DEFAULT_PROFILE_REPEATS,
+    DEFAULT_REAP_CONTAINERS,
+    DEFAULT_PERF_REGRESSION_THRESHOLD_PERCENT,
+    FUNCTION_TIMINGS_PATH,
+    GHERKIN_CACHE_PATH,
+    RENDER_SLOTS_PATH)
+from steps.utils.checkpoints import release_restored_steps, remove_checkpoint, restore_checkpoint, save_checkpoint
+from steps.utils.crds import shared_crd_index
+from steps.utils.gherkin_cache import install_gherkin_cache
+from steps.utils.metrics import Metrics
+from steps.utils.performance import PerformanceBaseline, scenario_key
+from steps.utils.project import shared_project_index
+from steps.utils.render import RenderWatchdog, set_render_scheduler
+from steps.utils.render_cache import RenderCache
+from steps.utils.runtimes import shared_function_runtimes
+from steps.utils.scheduler import RenderScheduler
+from steps.utils.timing_proxy import FunctionTimings, format_calls_table, summarize_calls, write_calls_report
+
+# The feature files are parsed right after this module is loaded and before before_all, and the hooks do not run
+# with --dry-run: the cache of the parsed features and step matches is installed when the module is loaded
+gherkin_cache = (install_gherkin_cache(GHERKIN_CACHE_PATH)
+                 if os.environ.get("COMPOSITION_TESTER_GHERKIN_CACHE", "True").lower() == "true" else None)
+
+
+@fixture
+def setup_project_index(ctx: Context):
+    """Build the index of the project files once for the whole test run and check that the input files
+    referenced by the steps of the selected scenarios exist, before any render runs.
+
+    Arguments:
+        ctx {Context} -- behave context
+    """
+    ctx.on_ci = on_ci()
+    print("Running on CI!" if ctx.on_ci else "Running locally!")
+    ctx.project_index = shared_project_index(ctx.on_ci, os.environ.get("COMPOSITION_TESTER_FUNCTIONS_FILE"))
+
+    step_registry = getattr(ctx._runner, "step_registry", None) or registry
+    ctx.missing_inputs = {}
+    for feature in getattr(ctx._runner, "features", []):
+        missing = ctx.project_index.missing_inputs(feature, step_registry, ctx.config)
+        if missing:
+            ctx.missing_inputs[feature.filename] = missing
+            print(f"Missing input files in {feature.filename}:\n  " + "\n  ".join(missing))
 
 
 @fixture
-def setup_base_path(ctx: Context, feature):
-    """Retrieve the base path for the feature file. The base path is the path to the
-    feature folder containing the feature file.
+def setup_feature_paths(ctx: Context, feature):
+    """Save the paths of the default inputs of the feature in the context, from the project index.
+    See FeatureLayout for the conventions on where the input files are.
 
     Arguments:
         ctx {Context} -- behave context
 
     Raises:
         ValueError: no filename attribute found inside feature in context
+        AssertionError: input files referenced by the feature do not exist
     """
     filename = getattr(feature, "filename", None)
     if filename is None:
         raise ValueError(f"no filename attribute found inside feature in context")
 
-    base_path = Path(filename).parent
-    ctx.base_path = base_path
+    missing = ctx.missing_inputs.get(filename)
+    assert not missing, "missing input files:\n" + "\n".join(missing)
 
+    layout = ctx.project_index.layout(filename)
+    # The base path is the path to the feature folder containing the feature file
+    ctx.base_path = layout.base_path
+    ctx.project_root = layout.project_root
+    if layout.envconfig_filepath:
+        ctx.envconfig_filepath = layout.envconfig_filepath
+    # By default, functions files are stored in the same directory as the features
+    ctx.functions_folder_path = layout.functions_folder_path
+    ctx.functions_filepath = layout.functions_filepath
+    ctx.compositions_directory = layout.compositions_directory
+    ctx.composition_filepath = layout.composition_filepath
+    ctx.definition_filepath = layout.definition_filepath
 
-@fixture
-def setup_envconfig_filepath(ctx: Context):
-    """Setup the environment config filepath and save it in the context. By convention, the environment config file should be at the same
-     level as the directory containing all features folders. Also by convention the file is named "envconfig.yaml"
-
-    Example:
-    ├── features
-        ├── feature 1
-            ├──
-            ├──
-        ├── feature 2
-            ├──
-            ├──
-        ├── envconfig.json       # Environment Configuration File
 
-    Arguments:
-        ctx {Context} -- behave context
+@fixture
+def setup_from_environment(ctx: Context):
+    """Get the environment variables and set them in the context
     """
-    all_features_directory = Path(ctx.base_path).parent
-    envconfig_filepath = all_features_directory / "envconfig.yaml"
     
-    # Check if file exists
-    if envconfig_filepath.exists():
-        ctx.envconfig_filepath = envconfig_filepath
+    ctx.debug_mode = os.environ.get("COMPOSITION_TESTER_DEBUG_MODE", "False").lower() == "true"
+
+    # A render timeout of 0 disables the timeout
+    render_timeout = float(os.environ.get("COMPOSITION_TESTER_RENDER_TIMEOUT", DEFAULT_RENDER_TIMEOUT_SECONDS))
+    ctx.render_timeout = render_timeout if render_timeout > 0 else None
+    ctx.render_retries = int(os.environ.get("COMPOSITION_TESTER_RENDER_RETRIES", DEFAULT_RENDER_RETRIES))
+    ctx.render_retry_backoff = float(
+        os.environ.get("COMPOSITION_TESTER_RENDER_RETRY_BACKOFF", DEFAULT_RENDER_RETRY_BACKOFF_SECONDS))
+    ctx.render_workers = int(os.environ.get("COMPOSITION_TESTER_RENDER_WORKERS", DEFAULT_RENDER_WORKERS))
+    ctx.profile_repeats = int(os.environ.get("COMPOSITION_TESTER_PROFILE_REPEATS", DEFAULT_PROFILE_REPEATS))
+    # Checkpoints of the renders are saved unless disabled, and restored when resuming the failed scenarios
+    ctx.resume_failed = os.environ.get("COMPOSITION_TESTER_RESUME_FAILED", "False").lower() == "true"
+    ctx.checkpoints = (ctx.resume_failed or
+                       os.environ.get("COMPOSITION_TESTER_CHECKPOINTS", "True").lower() == "true")
+    # Renders with the same inputs as a previous one are not run again, e.g. by the mutation tester
+    render_cache_directory = os.environ.get("COMPOSITION_TESTER_RENDER_CACHE")
+    ctx.render_cache = RenderCache(render_cache_directory) if render_cache_directory else None
+    # The claims are validated against the schema of their definition (XRD) before rendering
+    ctx.validate_claims = os.environ.get("COMPOSITION_TESTER_VALIDATE_CLAIMS", "True").lower() == "true"
+    # The desired resources of every render are validated against the CRDs of that directory
+    crds_directory = os.environ.get("COMPOSITION_TESTER_CRDS_DIRECTORY")
+    ctx.crd_index = shared_crd_index(crds_directory) if crds_directory else None
+    # The fields of every render are attributed to the steps of the pipeline
+    ctx.pipeline_bisect = os.environ.get("COMPOSITION_TESTER_PIPELINE_BISECT", "False").lower() == "true"
+    # The snapshot steps rewrite the snapshots instead of checking them
+    ctx.update_snapshots = os.environ.get("COMPOSITION_TESTER_UPDATE_SNAPSHOTS", "False").lower() == "true"
 
 
 @fixture
-def setup_functions_filepath(ctx: Context):
-    """Setup the functions filepath and save it in the context. By convention, the functions file should be at the same
-     level as the directory containing all features folders. Also by convention the file is named "functions.yaml". 
-
-    Example:
-    ├── features
-        ├── feature 1
-            ├──
-            ├──
-        ├── feature 2
-            ├──
-            ├──
-        ├── functions.yaml             # Default functions File
-        |── functions-ci.yaml          # Version of the functions file to run on CI
-        
+def setup_gherkin_cache(ctx: Context):
+    """Load the cached step matches of the current step modules for the test run, and save the new ones at its
+    end, see GherkinCache. The cache is enabled unless disabled with the environment variable
+    COMPOSITION_TESTER_GHERKIN_CACHE.
+    """
+    if gherkin_cache is not None:
+        gherkin_cache.matches()
+    yield gherkin_cache
+    if gherkin_cache is not None:
+        gherkin_cache.save()
 
-    Arguments:
-        ctx {Context} -- behave context
+
+@fixture
+def setup_render_watchdog(ctx: Context):
+    """Create the watchdog of the render subprocesses for the whole test run. Depending on the
+    environment variable COMPOSITION_TESTER_REAP_CONTAINERS, the leftover function containers are
+    removed at the end of each scenario ("scenario"), at the end of the test run ("suite") or never ("off").
     """
-    all_features_directory = Path(ctx.base_path).parent
-    # Save the functions folder path in the context
-    # By default, functions files are stored in the same directory as the features
-    ctx.functions_folder_path = all_features_directory
-    if on_ci():
-        print("Running on CI!")
-        ctx.on_ci = True
-        # If running on CI, the default functions file is specified by the environment variable "COMPOSITION_TESTER_FUNCTIONS_FILE"
-        ci_functions_file = os.environ[
-            "COMPOSITION_TESTER_FUNCTIONS_FILE"
-        ]  # e.g. "functions-ci.yaml"
-        functions_filepath = all_features_directory / ci_functions_file
+    ctx.reap_containers = os.environ.get("COMPOSITION_TESTER_REAP_CONTAINERS", DEFAULT_REAP_CONTAINERS).lower()
+    ctx.render_watchdog = RenderWatchdog()
+    yield ctx.render_watchdog
+    # Always kill the hung renders, even if reaping containers is disabled
+    if ctx.reap_containers == "off":
+        ctx.render_watchdog.kill_all()
     else:
-        print("Running locally!")
-        ctx.on_ci = False
-        # The default functions file used for testing is "functions.yaml"
-        functions_filepath = all_features_directory / "functions.yaml"
+        ctx.render_watchdog.reap()
+
 
-    # Save the functions file path in the context
-    ctx.functions_filepath = functions_filepath
+@fixture
+def setup_render_scheduler(ctx: Context):
+    """Limit the renders running at the same time on the machine, across the test processes, with a limit adjusted
+    from their latency and throughput, if enabled with the environment variable COMPOSITION_TESTER_ADAPTIVE_CONCURRENCY.
+    See RenderScheduler. The limit is printed at the end of the run.
+    """
+    if os.environ.get("COMPOSITION_TESTER_ADAPTIVE_CONCURRENCY", "False").lower() != "true":
+        yield None
+        return
+    max_limit = int(os.environ.get("COMPOSITION_TESTER_MAX_CONCURRENT_RENDERS", os.cpu_count() or 1))
+    ctx.render_scheduler = RenderScheduler(os.environ.get("COMPOSITION_TESTER_RENDER_SLOTS_DIRECTORY",
+                                                          RENDER_SLOTS_PATH),
+                                           max_limit, metrics=ctx.metrics)
+    set_render_scheduler(ctx.render_scheduler)
+    yield ctx.render_scheduler
+    set_render_scheduler(None)
+    print(ctx.render_scheduler.summary())
 
 
 @fixture
-def setup_composition_filepath(ctx: Context):
-    """Setup the composition path of the current feature and save it in the context. By convention, the compositions
-    directory should be in the "pkg" folder at the root of the project. Also by convention the file is named
-    "composition.yaml"
-
-    Example:
-    ├── composition-tests
-        ├── feature 1
-            ├──
-            ├── feature1.feature
-        ├── feature 2
-            ├──
-            ├── feature2.feature
-        ├── functions.yaml
-    ├── pkg         # Compositions directory
-        ├── feature 1
-            ├── composition.yaml
-        ├── feature 2
-            ├── composition.yaml
+def setup_function_timings(ctx: Context):
+    """Route the composition functions through timing proxies for the whole test run, if enabled with the
+    environment variable COMPOSITION_TESTER_FUNCTION_TIMINGS. At the end of the run, the summary of the
+    function calls is printed and written with all the calls to the function timings report.
     """
-    # For example, "feature-1"
-    feature_directory_name = ctx.base_path.name
-    project_root = Path(ctx.base_path).parent.parent
-    ctx.project_root = project_root
-    # For example "/pkg/feature-1"
-    compositions_directory = project_root / "pkg" / feature_directory_name
-    ctx.compositions_directory = compositions_directory
-    # For example "/pkg/feature-1/composition.yaml"
-    ctx.composition_filepath = compositions_directory / "composition.yaml"
+    enabled = os.environ.get("COMPOSITION_TESTER_FUNCTION_TIMINGS", "False").lower() == "true"
+    ctx.function_timings = FunctionTimings() if enabled else None
+    yield ctx.function_timings
+    if not enabled:
+        return
+    ctx.function_timings.close()
+
+    calls = ctx.function_timings.calls
+    if calls:
+        write_calls_report(f"{FUNCTION_TIMINGS_PATH}/function_timings.json", calls)
+        print("Function timings:")
+        print(format_calls_table(summarize_calls(calls)))
+
 
 @fixture
-def setup_from_environment(ctx: Context):
-    """Get the environment variables and set them in the context
+def setup_function_runtimes(ctx: Context):
+    """Keep the composition functions warm, if enabled with the environment variable
+    COMPOSITION_TESTER_WARM_FUNCTIONS: each function is started once as a docker container and used by all the
+    renders. The containers are removed when the process exits, so the tester daemon keeps them across test runs.
     """
-    
-    ctx.debug_mode = os.environ.get("COMPOSITION_TESTER_DEBUG_MODE", "False").lower() == "true"
-    
-    
-def before_feature(context, feature):
-    use_fixture(setup_base_path, context, feature)
-    use_fixture(setup_envconfig_filepath, context)
-    use_fixture(setup_functions_filepath, context)
-    use_fixture(setup_composition_filepath, context)
+    enabled = os.environ.get("COMPOSITION_TESTER_WARM_FUNCTIONS", "False").lower() == "true"
+    ctx.function_runtimes = shared_function_runtimes() if enabled else None
+
+
+@fixture
+def setup_metrics(ctx: Context):
+    """Collect the metrics of the test run (renders, parsing, caches, scenarios, memory), if enabled with the
+    environment variable COMPOSITION_TESTER_METRICS_FILE. The metrics are written to that file in the OpenMetrics
+    text format at the end of the run.
+    """
+    metrics_filepath = os.environ.get("COMPOSITION_TESTER_METRICS_FILE")
+    ctx.metrics = Metrics() if metrics_filepath else None
+    start = time.monotonic()
+    yield ctx.metrics
+    if not metrics_filepath:
+        return
+
+    scenarios_run = 0
+    for feature in getattr(ctx._runner, "features", []):
+        for scenario in feature.walk_scenarios():
+            ctx.metrics.inc("scenarios", status=scenario.status.name)
+            scenarios_run += scenario.status != Status.skipped
+            for step in scenario.all_steps:
+                ctx.metrics.inc("steps", status=step.status.name)
+    duration = time.monotonic() - start
+    ctx.metrics.set("run_duration_seconds", duration)
+    ctx.metrics.set("scenarios_per_minute", scenarios_run * 60 / duration if duration else 0)
+    ctx.metrics.set_peak_rss()
+    ctx.metrics.write(metrics_filepath)
+    print(f"Metrics written to {metrics_filepath}")
+
+
+@fixture
+def setup_performance_baseline(ctx: Context):
+    """Check the render time of every scenario against the performance baseline, if enabled with the environment
+    variable COMPOSITION_TESTER_PERF_BASELINE (path to the baseline file). A scenario fails when its renders are
+    slower than the baseline by more than COMPOSITION_TESTER_PERF_REGRESSION_THRESHOLD percent, see after_scenario.
+    With COMPOSITION_TESTER_UPDATE_PERF_BASELINE, the regressions are only reported and the render times of the
+    passed scenarios are added to the baseline at the end of the run, e.g. to accept a slowdown.
+    """
+    baseline_filepath = os.environ.get("COMPOSITION_TESTER_PERF_BASELINE")
+    ctx.performance_baseline = PerformanceBaseline.load(baseline_filepath) if baseline_filepath else None
+    ctx.perf_regression_threshold = float(os.environ.get("COMPOSITION_TESTER_PERF_REGRESSION_THRESHOLD",
+                                                         DEFAULT_PERF_REGRESSION_THRESHOLD_PERCENT))
+    ctx.update_perf_baseline = os.environ.get("COMPOSITION_TESTER_UPDATE_PERF_BASELINE", "False").lower() == "true"
+    # Render times of the passed scenarios, added to the baseline at the end of the run
+    ctx.perf_samples = {}
+    yield ctx.performance_baseline
+    if not baseline_filepath or not ctx.update_perf_baseline or not ctx.perf_samples:
+        return
+
+    for key, seconds in ctx.perf_samples.items():
+        ctx.performance_baseline.record(key, seconds)
+    ctx.performance_baseline.write(baseline_filepath)
+    print(f"Render times of {len(ctx.perf_samples)} scenarios added to the performance baseline {baseline_filepath}")
+
+
+def before_all(context):
+    use_fixture(setup_metrics, context)
     use_fixture(setup_from_environment, context)
+    use_fixture(setup_gherkin_cache, context)
+    use_fixture(setup_project_index, context)
+    use_fixture(setup_render_watchdog, context)
+    use_fixture(setup_render_scheduler, context)
+    use_fixture(setup_function_runtimes, context)
+    use_fixture(setup_function_timings, context)
+    use_fixture(setup_performance_baseline, context)
+
+
+def before_feature(context, feature):
+    use_fixture(setup_feature_paths, context, feature)
+
+
+def before_scenario(context, scenario):
+    # Render times of the scenario, see the render step
+    context.render_durations = []
+    if context.resume_failed:
+        restored_steps = restore_checkpoint(context, scenario)
+        if restored_steps:
+            print(f"Resuming scenario {scenario.name} after step {restored_steps} from its checkpoint")
+            # The renders before the checkpoint did not run, the render time is not comparable with the baseline
+            context.resumed_from_checkpoint = True
+
+
+def after_step(context, step):
+    # A render step asks for a checkpoint, which is saved once the step passed
+    if not getattr(context, "render_checkpoint_pending", False):
+        return
+    context.render_checkpoint_pending = False
+    if context.checkpoints and step.status == Status.passed:
+        # Steps with the same text are equal, look for this very step
+        step_index = next(i for i, s in enumerate(context.scenario.all_steps) if s is step)
+        save_checkpoint(context, context.scenario, step_index)
+
+
+def after_scenario(context, scenario):
+    release_restored_steps(scenario)
+    try:
+        # A performance regression fails the scenario: its checkpoint is kept, and the containers are still reaped
+        if context.performance_baseline is not None:
+            check_render_time(context, scenario)
+        if context.checkpoints and scenario.status == Status.passed:
+            remove_checkpoint(scenario)
+    finally:
+        watchdog = getattr(context, "render_watchdog", None)
+        if watchdog is not None:
+            if context.reap_containers == "scenario":
+                watchdog.reap()
+            else:
+                watchdog.kill_all()
+
+
+def check_render_time(context, scenario):
+    """Check the render time of a passed scenario against the performance baseline. A regression is raised as an
+    error of the hook, which fails the scenario, unless the baseline is being updated."""
+    if (scenario.status != Status.passed or not context.render_durations or
+            getattr(context, "resumed_from_checkpoint", False) or getattr(context, "render_cache_hit", False)):
+        return
+    key = scenario_key(scenario.filename, context.project_root, scenario.name)
+    seconds = sum(context.render_durations)
+    regression = context.performance_baseline.check(key, seconds, context.perf_regression_threshold)
+    if regression and context.update_perf_baseline:
+        print(f"Accepting the performance regression of scenario {scenario.name}: {regression}")
+    else:
+        assert regression is None, f"performance regression of scenario {scenario.name}: {regression}"
+    context.perf_samples[key] = seconds
 
 
 def on_ci():
@@ -0,0 +1,429 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Mutation tester: measures how good the feature files are at catching composition bugs.
+
+Every composition of the "pkg" folder used by the scenarios is changed systematically (dropped pipeline steps and
+resources, changed values, dropped patches, swapped readiness checks). For each of these mutants, only the scenarios
+using the composition run again, and the mutant is killed if one of them fails. The mutants that survive show the
+behaviours of the compositions that no scenario checks.
+
+Usage:
+    python mutation_tester.py <composition-project-dir> [<tests-dir>] [options]
+
+The mutants run on a pool of workers, each keeping behave, the step definitions and the composition functions warm
+(like the tester daemon) and using its own copy of the project. The renders are cached by content of their inputs
+and shared by the workers, so that a render is never run twice with the same inputs.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from pathlib import Path
+
+REPOSITORY_PATH = Path(__file__).resolve().parent
+# Files of the tester linked in the copies of the project, so that behave finds the step definitions and hooks
+TESTER_FILES = ("steps", "environment.py")
+KILLED = "killed"
+SURVIVED = "survived"
+ERROR = "error"
+# Environment of the test runs of the workers: no side effect on the project, no checkpoint, no measure
+WORKER_ENVIRONMENT = {
+    "COMPOSITION_TESTER_CHECKPOINTS": "false",
+    "COMPOSITION_TESTER_RESUME_FAILED": "false",
+    "COMPOSITION_TESTER_UPDATE_SNAPSHOTS": "false",
+    "COMPOSITION_TESTER_UPDATE_PERF_BASELINE": "false",
+    "COMPOSITION_TESTER_DEBUG_MODE": "false",
+}
+WORKER_REMOVED_ENVIRONMENT = ("COMPOSITION_TESTER_PERF_BASELINE", "COMPOSITION_TESTER_METRICS_FILE")
+
+_worker = None
+
+
+@dataclass
+class MutantResult:
+    """Result of the scenarios of a composition run against one of its mutants (or against the composition itself,
+    without mutant)"""
+    composition: str
+    mutant: str
+    operator: str
+    description: str
+    status: str
+    killed_by: str = None
+    error: str = None
+    duration: float = 0
+
+
+# -----------------------------------------------------------------------------
+# PROJECT
+# -----------------------------------------------------------------------------
+def link_project(project_dir: Path, tests_dir: str, target: Path):
+    """Copy the tests and compositions of a project as symbolic links, so that a composition can be replaced by a
+    mutant in the copy only. The tester files are linked at the root of the copy.
+
+    Arguments:
+        project_dir {Path} -- composition project
+        tests_dir {str} -- directory of the feature files, relative to the project
+        target {Path} -- copy of the project
+    """
+    for directory in (tests_dir, "pkg"):
+        source_root = project_dir / directory
+        for root, _, files in os.walk(source_root, followlinks=True):
+            target_root = target / directory / Path(root).relative_to(source_root)
+            target_root.mkdir(parents=True, exist_ok=True)
+            for filename in files:
+                link = target_root / filename
+                if not link.is_symlink():
+                    link.symlink_to(Path(root, filename).resolve())
+    for filename in TESTER_FILES:
+        link = target / filename
+        if not link.is_symlink():
+            link.symlink_to(REPOSITORY_PATH / filename)
+
+
+def discover_scenarios(project_copy: Path, tests_dir: str, tags):
+    """Find the compositions used by each scenario of the features of a project: the compositions of its input
+    composition steps, or the default composition of its feature folder. The scenarios rendering nested composite
+    resources use all the compositions of the project.
+
+    Arguments:
+        project_copy {Path} -- copy of the project, see link_project
+        tests_dir {str} -- directory of the feature files, relative to the project
+        tags {list} -- tag expressions selecting the scenarios
+
+    Returns:
+        dict -- path to the composition relative to the project -> locations (file:line) of its scenarios
+    """
+    from behave.configuration import Configuration
+    from behave.runner import Runner
+    from behave.runner_util import collect_feature_locations, parse_features
+    from behave.step_registry import registry
+
+    from steps.utils.constants import COMPOSITION
+    from steps.utils.project import ProjectIndex
+
+    config = Configuration([str(project_copy / tests_dir)] + [f"--tags={tag}" for tag in tags], load_config=False)
+    runner = Runner(config)
+    runner.setup_paths()
+    runner.load_step_definitions()
+    project_index = ProjectIndex()
+
+    scenarios = {}
+    for feature in parse_features(collect_feature_locations(config.paths)):
+        layout = project_index.layout(feature.filename)
+        background_steps = list(feature.background.steps) if feature.background else []
+        for scenario in feature.walk_scenarios():
+            if config.tags and not scenario.should_run_with_tags(config.tags):
+                continue
+            steps = background_steps + list(scenario.steps)
+            compositions = {filepath for _, kind, filepath in project_index.step_inputs(feature, steps, registry)
+                            if kind == COMPOSITION}
+            if not compositions:
+                compositions = {layout.composition_filepath}
+            matches = [registry.find_match(step) for step in steps]
+            if any(match and match.func.__name__ == "prepare_nested_render" for match in matches):
+                compositions |= {filepath for candidates in project_index.compositions(project_copy).values()
+                                 for _, filepath in candidates}
+            # The files of the copy are links, their paths are not resolved
+            location = f"{Path(os.path.abspath(feature.filename)).relative_to(project_copy)}:{scenario.line}"
+            for filepath in compositions:
+                try:
+                    composition = Path(os.path.abspath(filepath)).relative_to(project_copy.absolute())
+                except ValueError:
+                    # Compositions outside of the project are not mutated
+                    continue
+                scenarios.setdefault(str(composition), []).append(location)
+    return scenarios
+
+
+# -----------------------------------------------------------------------------
+# WORKERS
+# -----------------------------------------------------------------------------
+class MutationWorker:
+    """Run the scenarios of the compositions against their mutants, in its own copy of the project"""
+
+    def __init__(self, project_dir: Path, tests_dir: str, work_dir: Path, tags):
+        self.directory = work_dir / f"worker-{os.getpid()}"
+        link_project(project_dir, tests_dir, self.directory)
+        # Temporary files of the renders (e.g. the claims) of this worker only
+        tmp_directory = self.directory / "tmp"
+        tmp_directory.mkdir(exist_ok=True)
+        os.environ["TMPDIR"] = str(tmp_directory)
+        tempfile.tempdir = None
+        for name in WORKER_REMOVED_ENVIRONMENT:
+            os.environ.pop(name, None)
+        os.environ.update(WORKER_ENVIRONMENT)
+        os.environ["COMPOSITION_TESTER_RENDER_CACHE"] = str(work_dir / "render-cache")
+        os.environ.setdefault("COMPOSITION_TESTER_WARM_FUNCTIONS", "true")
+        # The other workers may have containers of the same functions
+        os.environ.setdefault("COMPOSITION_TESTER_REAP_CONTAINERS", "off")
+        self.tags = tags
+        self.mtime_ns = time.time_ns()
+
+        sys.path.insert(0, str(REPOSITORY_PATH))
+        from tester_daemon import WarmBehave
+        self.behave = WarmBehave()
+
+    def run(self, composition: str, mutant, locations):
+        """Run the scenarios of a composition against one of its mutants, until one of them fails
+
+        Arguments:
+            composition {str} -- path to the composition, relative to the project
+            mutant {Mutant} -- mutant of the composition, None to run the scenarios against the composition
+            locations {list} -- locations (file:line) of the scenarios, relative to the project
+
+        Returns:
+            MutantResult -- result
+        """
+        start = time.monotonic()
+        composition_filepath = self.directory / composition
+        original = composition_filepath.resolve()
+        if mutant:
+            self._replace(composition_filepath, mutant.content)
+        output = io.StringIO()
+        try:
+            args = ["--format=null", "--stop", "--no-summary", "--no-snippets", "--no-capture"]
+            args += [f"--tags={tag}" for tag in self.tags]
+            args += [str(self.directory / location) for location in locations]
+            exit_code = self.behave.run_behave(args, str(self.directory), {}, output, output)
+        finally:
+            if mutant:
+                self._restore(composition_filepath, original)
+
+        result = MutantResult(composition, mutant.id if mutant else None, mutant.operator if mutant else None,
+                              mutant.description if mutant else "original composition", SURVIVED,
+                              duration=time.monotonic() - start)
+        runner = self.behave.last_runner
+        failed = [scenario for feature in (runner.features if runner else []) for scenario in feature.walk_scenarios()
+                  if scenario.status.name in ("failed", "error")]
+        if failed:
+            scenario = failed[0]
+            # Relative to the working directory of the run
+            location = Path(os.path.normpath(os.path.join(self.directory, scenario.filename))).relative_to(
+                self.directory)
+            result.status = KILLED
+            result.killed_by = f"{location}:{scenario.line} {scenario.name}"
+            error_lines = (scenario.error_message or "").strip().splitlines()
+            result.error = error_lines[0] if error_lines else None
+        elif exit_code != 0:
+            result.status = ERROR
+            result.error = output.getvalue().strip()[-2000:]
+        return result
+
+    def _replace(self, filepath: Path, content: str):
+        tmp_filepath = filepath.with_name(f".{filepath.name}.mutant")
+        tmp_filepath.write_text(content, encoding="utf-8")
+        # A distinct modification time, so that the project index reads the file again
+        self.mtime_ns += 1_000_000
+        os.utime(tmp_filepath, ns=(self.mtime_ns, self.mtime_ns))
+        os.replace(tmp_filepath, filepath)
+
+    def _restore(self, filepath: Path, original: Path):
+        tmp_link = filepath.with_name(f".{filepath.name}.link")
+        if tmp_link.is_symlink():
+            tmp_link.unlink()
+        tmp_link.symlink_to(original)
+        os.replace(tmp_link, filepath)
+
+
+def init_worker(project_dir, tests_dir, work_dir, tags):
+    global _worker
+    _worker = MutationWorker(Path(project_dir), tests_dir, Path(work_dir), tags)
+
+
+def run_in_worker(composition: str, mutant, locations):
+    return _worker.run(composition, mutant, locations)
+
+
+# -----------------------------------------------------------------------------
+# MUTATION TESTING
+# -----------------------------------------------------------------------------
+def order_locations(locations, kills: dict):
+    """Order the scenarios so that the ones that killed the most mutants run first, feature by feature since
+    behave runs the scenarios of a feature in the order of the file"""
+    by_feature = {}
+    for location in locations:
+        by_feature.setdefault(location.rsplit(":", 1)[0], []).append(location)
+    ordered = sorted(by_feature.values(), key=lambda feature_locations: -sum(kills.get(l, 0)
+                                                                              for l in feature_locations))
+    return [location for feature_locations in ordered for location in feature_locations]
+
+
+def run_tasks(executor, tasks, workers: int, kills: dict, on_result):
+    """Run tasks (composition, mutant, locations) on the workers, with at most one queued task per worker so that
+    each task runs the scenarios in the order of the latest kills"""
+    pending = {}
+    tasks = list(tasks)
+    while tasks or pending:
+        while tasks and len(pending) < 2 * workers:
+            composition, mutant, locations = tasks.pop(0)
+            future = executor.submit(run_in_worker, composition, mutant, order_locations(locations, kills))
+            pending[future] = (composition, mutant)
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.pop(future)
+            on_result(future.result())
+
+
+def mutation_score(results):
+    killed = sum(result.status == KILLED for result in results)
+    survived = sum(result.status == SURVIVED for result in results)
+    return 100 * killed / (killed + survived) if killed + survived else None
+
+
+def format_summary(results, baseline_failures, uncovered):
+    lines = []
+    compositions = sorted({result.composition for result in results})
+    for composition in compositions:
+        composition_results = [result for result in results if result.composition == composition]
+        score = mutation_score(composition_results)
+        counts = {status: sum(r.status == status for r in composition_results) for status in (KILLED, SURVIVED, ERROR)}
+        lines.append(f"{composition}: {len(composition_results)} mutants, {counts[KILLED]} killed, "
+                     f"{counts[SURVIVED]} survived, {counts[ERROR]} errors, "
+                     f"score {'n/a' if score is None else f'{score:.0f}%'}")
+        for result in composition_results:
+            if result.status == SURVIVED:
+                lines.append(f"    survived {result.mutant}: {result.description}")
+            elif result.status == ERROR:
+                lines.append(f"    error {result.mutant}: {result.error}")
+    for result in baseline_failures:
+        lines.append(f"{result.composition}: not mutated, its scenarios fail without mutation: {result.killed_by} "
+                     f"{result.error or ''}".rstrip())
+    for composition in uncovered:
+        lines.append(f"{composition}: not covered by any scenario")
+    score = mutation_score(results)
+    lines.append(f"Mutation score: {'n/a' if score is None else f'{score:.1f}%'} "
+                 f"({sum(r.status == KILLED for r in results)} killed of "
+                 f"{sum(r.status in (KILLED, SURVIVED) for r in results)} mutants)")
+    return "\n".join(lines)
+
+
+def parse_args(argv):
+    from steps.utils.mutations import OPERATORS
+
+    parser = argparse.ArgumentParser(description="Mutation testing of crossplane compositions")
+    parser.add_argument("project_dir", help="directory of crossplane compositions project that contains a pkg folder")
+    parser.add_argument("tests_dir", nargs="?", default="composition-tests",
+                        help="directory where the BDD feature files are placed (default: composition-tests)")
+    parser.add_argument("-c", "--composition", action="append", default=[],
+                        help="composition to mutate, relative to the project, glob patterns allowed; multiple "
+                             "compositions can be provided (default: all the compositions used by the scenarios)")
+    parser.add_argument("-o", "--operator", action="append", choices=OPERATORS, default=[],
+                        help="mutation operator to apply; multiple operators can be provided (default: all)")
+    parser.add_argument("-t", "--tags", action="append", default=[],
+                        help="tags to filter the scenarios; multiple tags can be provided and they are combined "
+                             "with 'AND'")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of workers (default: number of CPUs)")
+    parser.add_argument("--max-mutants", type=int, default=None,
+                        help="maximum number of mutants per composition, sampled with the seed (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sample of mutants (default: 0)")
+    parser.add_argument("--work-dir", default=None,
+                        help="directory of the copies of the project and of the render cache, kept to reuse the "
+                             "renders in the next runs (default: a temporary directory, removed at the end)")
+    parser.add_argument("--report", default=None, help="json file where the results of all mutants are written")
+    parser.add_argument("--min-score", type=float, default=None,
+                        help="fail if the mutation score, in percent, is below this value")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    sys.path.insert(0, str(REPOSITORY_PATH))
+    args = parse_args(argv)
+    import yaml
+
+    from steps.utils.mutations import OPERATORS, generate_mutants
+
+    project_dir = Path(args.project_dir).resolve()
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="xplane-mutations-")).resolve()
+    try:
+        project_copy = work_dir / "discovery"
+        link_project(project_dir, args.tests_dir, project_copy)
+        scenarios = discover_scenarios(project_copy, args.tests_dir, args.tags)
+        if args.composition:
+            scenarios = {composition: locations for composition, locations in scenarios.items()
+                         if any(Path(composition).match(pattern) for pattern in args.composition)}
+        uncovered = sorted(str(path.relative_to(project_dir)) for path in (project_dir / "pkg").rglob("*.yaml")
+                           if str(path.relative_to(project_dir)) not in scenarios
+                           and (yaml.safe_load(path.read_text(encoding="utf-8")) or {}).get("kind") == "Composition"
+                           and (not args.composition or any(path.match(p) for p in args.composition)))
+        if not scenarios:
+            print("No scenario uses the compositions to mutate")
+            return 1
+
+        mutants = {}
+        for composition in sorted(scenarios):
+            content = yaml.safe_load((project_dir / composition).read_text(encoding="utf-8"))
+            composition_mutants = list(generate_mutants(content, tuple(args.operator) or OPERATORS))
+            if args.max_mutants is not None and len(composition_mutants) > args.max_mutants:
+                sample = sorted(random.Random(args.seed).sample(range(len(composition_mutants)), args.max_mutants))
+                composition_mutants = [composition_mutants[i] for i in sample]
+            mutants[composition] = composition_mutants
+        total = sum(len(composition_mutants) for composition_mutants in mutants.values())
+        print(f"{total} mutants of {len(mutants)} compositions, {args.workers} workers, work directory {work_dir}")
+
+        start = time.monotonic()
+        results, baseline_failures, kills = [], [], {}
+        context = get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(str(project_dir), args.tests_dir, str(work_dir), args.tags)) as executor:
+            # The scenarios must pass without mutation, this also fills the render cache
+            run_tasks(executor, [(composition, None, scenarios[composition]) for composition in mutants],
+                      args.workers, kills, lambda result: result.status != SURVIVED and baseline_failures.append(result))
+            failed_compositions = {result.composition for result in baseline_failures}
+
+            def on_result(result: MutantResult):
+                results.append(result)
+                if result.status == KILLED:
+                    location = result.killed_by.split(" ", 1)[0]
+                    kills[location] = kills.get(location, 0) + 1
+                by = f" by {result.killed_by}" if result.killed_by else ""
+                print(f"[{len(results)}/{total}] {result.status.upper():8} {result.composition} {result.mutant}: "
+                      f"{result.description}{by} ({result.duration:.1f}s)", flush=True)
+
+            run_tasks(executor, [(composition, mutant, scenarios[composition])
+                                 for composition, composition_mutants in mutants.items()
+                                 if composition not in failed_compositions for mutant in composition_mutants],
+                      args.workers, kills, on_result)
+
+        print(format_summary(results, baseline_failures, uncovered))
+        print(f"Took {time.monotonic() - start:.1f}s")
+        if args.report:
+            with open(args.report, mode="w", encoding="utf-8") as file:
+                json.dump({"score": mutation_score(results), "mutants": [asdict(result) for result in results],
+                           "baseline_failures": [asdict(result) for result in baseline_failures],
+                           "uncovered": uncovered}, file, indent=2)
+        if baseline_failures:
+            return 2
+        score = mutation_score(results)
+        if args.min_score is not None and (score is None or score < args.min_score):
+            print(f"Mutation score below {args.min_score:g}%")
+            return 1
+        return 0
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -14,12 +14,27 @@
 
 # from __future__ import absolute_import, print_function
 import logging
-import subprocess
+import os
+import random
+import time
+from contextlib import contextmanager
 
 from behave import *
 
 from steps.utils.checkers import *
 from steps.utils.constants import *
+from steps.utils.cluster_export import import_cluster_export
+from steps.utils.crds import shared_crd_index
+from steps.utils.exploration import explore_readiness, write_exploration_report
+from steps.utils.fuzzing import generate_claim, load_definition_schema, render_generated_claims
+from steps.utils.nested import render_nested_resources
+from steps.utils.performance import parse_duration
+from steps.utils.provenance import bisect_pipeline, prefix_renders, write_provenance_report
+from steps.utils.profiling import parse_sizes, sweep_claim_parameter, write_profile_report
+from steps.utils.project import functions_filename
+from steps.utils.render import RenderTimeoutError, run_render
+from steps.utils.snapshots import assert_matches_snapshot
+from steps.utils.timing_proxy import format_calls_table, summarize_calls
 from steps.utils.setters import *
 from steps.utils.utils import *
 
@@ -42,6 +57,7 @@ def prepare_compositions_directory(ctx: Context, compositions_directory):
         ctx {Context} -- behave context
     """
     ctx.compositions_directory = compositions_directory
+    ctx.definition_filepath = f"{compositions_directory}/definition.yaml"
     logger.info(
         f"Current working directory with compositions {compositions_directory}")
 
@@ -80,6 +96,29 @@ def claim_with_params(ctx: Context):
     )
 
 
+@given("input claim generated from the definition with seed {seed:d}")
+def prepare_generated_claim(ctx: Context, seed: int):
+    """Generate a claim from the XRD schema with the given seed, e.g. to reproduce a failure of the
+    generated claims. The apiVersion, kind and metadata are taken from the current input claim.
+
+    Arguments:
+        ctx {Context} -- behave context
+        seed {int} -- seed of the generated claim
+
+    Raises:
+        AssertionError: no claim found in context
+        AssertionError: the generated claim is not valid against the definition
+    """
+    claim = get_from_context(ctx, "claim", assert_exists=True)
+    schema = load_definition_schema(ctx.definition_filepath, claim.get("apiVersion"))
+
+    feature_name = ctx.feature.name.replace(" ", "_")
+    filename = f"claim_seed_{seed}.yaml"
+    filepath = f"{TMP_CLAIMS_FILE_PATH}/{feature_name}/{filename}"
+    dump_yaml_to_file(filepath, generate_claim(claim, schema, seed, validate=generated_claim_validator(ctx)))
+    prepare_file(ctx, CLAIM, filepath, load_into_context=True, attach_to_allure=True)
+
+
 @given("input claim {claim_file}")
 def prepare_claim(ctx: Context, claim_file):
     # logger.info(f"get the claim {claim_file}")
@@ -109,6 +148,8 @@ def prepare_composition(ctx: Context, composition_directory, composition_file):
         load_into_context=False,
         attach_to_allure=False,
     )
+    # The definition (XRD) is expected next to the composition
+    ctx.definition_filepath = ctx.project_root / "pkg" / composition_directory / "definition.yaml"
 
 @given("input composition {composition_file}")
 def prepare_composition(ctx: Context, composition_file):
@@ -162,10 +203,8 @@ def prepare_functions(ctx: Context, functions_file):
     """
 
     functions_folder_path = ctx.functions_folder_path
-    if ctx.on_ci:
-        # If running on CI, use the CI version of the functions file
-        functions_file_name = functions_file.split(".yaml")[0]
-        functions_file = f"{functions_file_name}-ci.yaml"
+    # If running on CI, use the CI version of the functions file
+    functions_file = functions_filename(functions_file, ctx.on_ci)
     prepare_file(
         ctx,
         FUNCTIONS,
@@ -194,6 +233,62 @@ def prepare_observed_state(ctx: Context, observed_state_file):
     )
 
 
+@given("observed state of composite {composite_name} imported from {export_file} for next rendering")
+def import_observed_state(ctx: Context, composite_name: str, export_file: str):
+    """Import the resources of a composite resource from a cluster export (e.g. kubectl get -o yaml of the managed
+    resources, possibly gzipped) in the resources folder, or at an absolute path. The resources replace the desired
+    resources of the previous render, so that they can be changed with the change observed resource steps before
+    being observed by the next render.
+
+    Arguments:
+        ctx {Context} -- behave context
+        composite_name {str} -- name of the composite resource in the cluster
+        export_file {str} -- cluster export filepath
+    """
+    filepath = Path(export_file) if os.path.isabs(export_file) else Path(ctx.base_path, "resources", export_file)
+    assert_that(filepath.exists(), f"{OBSERVED} file ({filepath}) does not exist")
+    try:
+        resources, fingerprints, total = import_cluster_export(filepath, composite_name)
+    except (ValueError, yaml.YAMLError) as e:
+        assert False, f"error importing {filepath}: {e}"
+    assert resources, f"no resource of composite {composite_name} among the {total} resources of {filepath}"
+    logger.info(f"imported {len(resources)} of the {total} resources of {filepath}")
+    allure.attach("\n".join(f"{name}: {resource.get('kind')} {resource['metadata'].get('name')}"
+                             for name, resource in resources.items()), name="imported observed resources")
+
+    setattr(ctx, CTX_NESTED_RESOURCES, None)
+    setattr(ctx, CTX_DESIRED_FINGERPRINTS, fingerprints)
+    setattr(ctx, CTX_DESIRED_RESOURCES, resources)
+    setattr(ctx, CTX_DESIRED_RESOURCES_INDEX, DesiredResourcesIndex(resources))
+
+
+@given("the desired fields are attributed to the pipeline steps")
+def prepare_pipeline_bisect(ctx: Context):
+    """Attribute the fields of the next renders of the scenario to the steps of the pipeline, see
+    attribute_fields_to_pipeline_steps. Enabled for all the scenarios with COMPOSITION_TESTER_PIPELINE_BISECT.
+
+    Arguments:
+        ctx {Context} -- behave context
+    """
+    ctx.pipeline_bisect = True
+
+
+@given("nested composite resources are rendered with their compositions")
+@given("nested composite resources are rendered with their compositions up to depth {max_depth:d}")
+def prepare_nested_render(ctx: Context, max_depth: int = DEFAULT_NESTED_RENDER_DEPTH):
+    """Render the composite resources composed by the composition with their own compositions, recursively, in the
+    next renders of the scenario. Their resources are checked with qualified names, e.g. network/subnet for the
+    resource subnet of the nested composite resource network.
+
+    Arguments:
+        ctx {Context} -- behave context
+
+    Keyword Arguments:
+        max_depth {int} -- maximum depth of the nested composite resources (default: {DEFAULT_NESTED_RENDER_DEPTH})
+    """
+    ctx.nested_render_depth = max_depth
+
+
 @step("crossplane renders the composition")
 def render(ctx: Context):
     # get what is needed from the context:
@@ -205,10 +300,48 @@ def render(ctx: Context):
 
 
     # logger.info("rendering composition")
-        
+
+    precheck_render_inputs(ctx)
     args = prepare_render_args(ctx, log_input=ctx.debug_mode)
 
-    out = subprocess.run(args, capture_output=True, text=True)
+    watchdog = getattr(ctx, "render_watchdog", None)
+    if watchdog:
+        watchdog.watch_functions(ctx.functions_filepath)
+
+    render_cache = getattr(ctx, "render_cache", None)
+    # The key of the render is computed before the functions file is rewritten, the warm functions and timing
+    # proxies use other ports in every process
+    cache_key = render_cache.key(args) if render_cache else None
+    functions_filepath = ctx.functions_filepath
+    function_runtimes = getattr(ctx, "function_runtimes", None)
+    if function_runtimes:
+        # Use the warm functions
+        functions_filepath = function_runtimes.functions_filepath(functions_filepath, WARM_FUNCTIONS_PATH)
+    function_timings = getattr(ctx, "function_timings", None)
+    if function_timings:
+        # Route the functions through their timing proxies
+        functions_filepath = function_timings.proxied_functions_filepath(functions_filepath, FUNCTION_TIMINGS_PATH)
+    args[args.index(ctx.functions_filepath)] = functions_filepath
+
+    try:
+        out = run_render(args, timeout=ctx.render_timeout, retries=ctx.render_retries,
+                         backoff=ctx.render_retry_backoff, watchdog=watchdog, metrics=getattr(ctx, "metrics", None),
+                         cache=render_cache, cache_key=cache_key)
+    except RenderTimeoutError as e:
+        assert False, f"error rendering: {e}"
+    finally:
+        if function_timings:
+            calls = function_timings.collect()
+            if calls:
+                allure.attach(format_calls_table(summarize_calls(calls)), name="function timings")
+    # Only the successful attempt is timed, without the retries and the wait for a render slot. A render served by
+    # the render cache did not run, it has no duration.
+    ctx.last_render_duration = getattr(out, "duration", None)
+    if ctx.last_render_duration is None:
+        # The render time of the scenario is not comparable with the performance baseline
+        ctx.render_cache_hit = True
+    elif getattr(ctx, "render_durations", None) is not None:
+        ctx.render_durations.append(ctx.last_render_duration)
     assert out.returncode == 0, f"error rendering: {out.stderr}"
     # logger.info(out.stdout)
 
@@ -220,8 +353,339 @@ def render(ctx: Context):
 
     if ctx.debug_mode:
         save_rendered_output(ctx, out.stdout)
-    
-    read_desired_output_into_context(ctx, out.stdout)
+    metrics = getattr(ctx, "metrics", None)
+    if ctx.debug_mode or metrics:
+        _, peak_memory = measure_peak_memory(read_desired_output_into_context, ctx, out.stdout)
+        if metrics:
+            metrics.observe("render_parse_peak_memory_bytes", peak_memory)
+        if ctx.debug_mode:
+            logger.info(f"render {get_iteration_id(ctx, new_iteration=False)}: parsed {len(out.stdout)} bytes "
+                        f"with a peak memory of {peak_memory / 1024:.1f} KiB")
+    else:
+        read_desired_output_into_context(ctx, out.stdout)
+    if getattr(ctx, "pipeline_bisect", False):
+        attribute_fields_to_pipeline_steps(ctx, args, functions_filepath, out.stdout)
+    # Only the parsed desired state is kept, drop the raw render output
+    del out
+
+    nested_render_depth = getattr(ctx, "nested_render_depth", None)
+    if nested_render_depth:
+        render_nested_resources(ctx, functions_filepath, nested_render_depth)
+    crd_index = getattr(ctx, "crd_index", None)
+    if crd_index:
+        check_desired_resources_crds(ctx, crd_index)
+    # The state after the render is checkpointed once the step passed, see after_step
+    ctx.render_checkpoint_pending = True
+
+
+def attribute_fields_to_pipeline_steps(ctx: Context, args: list, functions_filepath, render_output: str):
+    """Attribute the fields of the render to the steps of the pipeline, see bisect_pipeline. The pipeline prefixes are
+    rendered with the same inputs as the render, in parallel, and cached like the render. The provenance is written to
+    the provenance reports folder, attached to the allure report, and used to explain the failed checks of the
+    resource parameters.
+
+    Arguments:
+        ctx {Context} -- behave context
+        args {list} -- crossplane render command arguments of the render
+        functions_filepath {str} -- functions file of the render
+        render_output {str} -- output of the render
+    """
+    render_cache = getattr(ctx, "render_cache", None) or prefix_renders
+    composition_index, functions_index = args.index(ctx.composition_filepath), args.index(functions_filepath)
+
+    def render_prefix(composition_filepath):
+        prefix_args = list(args)
+        prefix_args[composition_index] = composition_filepath
+        # Cached by the original functions file, see render
+        key_args = list(prefix_args)
+        key_args[functions_index] = ctx.functions_filepath
+        return run_render(prefix_args, timeout=ctx.render_timeout, retries=ctx.render_retries,
+                          backoff=ctx.render_retry_backoff, watchdog=getattr(ctx, "render_watchdog", None),
+                          metrics=getattr(ctx, "metrics", None), cache=render_cache,
+                          cache_key=render_cache.key(key_args))
+
+    provenance = bisect_pipeline(ctx.composition_filepath, render_prefix, render_output, PIPELINE_PREFIXES_PATH,
+                                 ctx.render_workers)
+    setattr(ctx, CTX_PROVENANCE, provenance)
+    for step, error in provenance.errors.items():
+        logger.warning(f"pipeline truncated after step {step} does not render: {error}")
+
+    feature_name = ctx.feature.name.replace(" ", "_")
+    scenario_name = ctx.scenario.name.replace(" ", "_")
+    report_file = write_provenance_report(
+        f"{PROVENANCE_REPORTS_PATH}/{feature_name}/{scenario_name}_{get_iteration_id(ctx, new_iteration=False)}",
+        provenance)
+    allure.attach.file(report_file, name=report_file.name)
+    allure.attach("\n".join(" | ".join(row) for row in provenance.rows()), name="pipeline provenance")
+
+
+@contextmanager
+def pipeline_blame(ctx: Context, resource_name: str, key: str):
+    """Explain a failed check of a field with the pipeline steps that set it, when the pipeline is bisected
+
+    Arguments:
+        ctx {Context} -- behave context
+        resource_name {str} -- resource name, or composite
+        key {str} -- key of the field
+    """
+    try:
+        yield
+    except AssertionError as e:
+        provenance = getattr(ctx, CTX_PROVENANCE, None)
+        if provenance is None or resource_name not in provenance.fields:
+            raise
+        raise AssertionError(f"{e}\n{provenance.blame(resource_name, key)}") from e
+
+
+@when("crossplane renders {claims_count:d} claims generated from the definition")
+@when("crossplane renders {claims_count:d} claims generated from the definition with seed {seed:d}")
+def render_generated_claims_step(ctx: Context, claims_count: int, seed: int = None):
+    """Generate claims from the XRD schema and render them with a bounded pool of workers. The claim with
+    index i is generated with the seed (seed + i). Without a seed, the seed is taken from the
+    COMPOSITION_TESTER_FUZZ_SEED environment variable, or picked at random.
+
+    Arguments:
+        ctx {Context} -- behave context
+        claims_count {int} -- number of claims to generate
+
+    Keyword Arguments:
+        seed {int} -- seed of the first generated claim (default: {None})
+
+    Raises:
+        AssertionError: no claim found in context
+        AssertionError: a generated claim is not valid against the definition
+    """
+    claim = get_from_context(ctx, "claim", assert_exists=True)
+    precheck_render_inputs(ctx)
+    if seed is None:
+        seed = int(os.environ.get("COMPOSITION_TESTER_FUZZ_SEED", random.randrange(2 ** 32)))
+    logger.info(f"rendering {claims_count} generated claims from seed {seed}")
+    allure.attach(str(seed), name="seed")
+
+    feature_name = ctx.feature.name.replace(" ", "_")
+    scenario_name = ctx.scenario.name.replace(" ", "_")
+    ctx.fuzz_results = render_generated_claims(
+        claim,
+        load_definition_schema(ctx.definition_filepath, claim.get("apiVersion")),
+        range(seed, seed + claims_count),
+        f"{TMP_CLAIMS_FILE_PATH}/{feature_name}/{scenario_name}",
+        ctx.composition_filepath,
+        ctx.functions_filepath,
+        ctx.envconfig_filepath,
+        ctx.render_workers,
+        validate=generated_claim_validator(ctx),
+        timeout=ctx.render_timeout,
+        retries=ctx.render_retries,
+        backoff=ctx.render_retry_backoff,
+        watchdog=getattr(ctx, "render_watchdog", None),
+        metrics=getattr(ctx, "metrics", None),
+    )
+
+
+def generated_claim_validator(ctx: Context):
+    """Validator of the generated claims against the definition (XRD), so that an invalid claim is reported as a
+    bug of the generator rather than as a failing seed. None if the claims are not validated
+    (COMPOSITION_TESTER_VALIDATE_CLAIMS).
+
+    Arguments:
+        ctx {Context} -- behave context
+
+    Returns:
+        callable -- returns the violations of the definition schema by a claim
+    """
+    if not getattr(ctx, "validate_claims", True):
+        return None
+    project_index = getattr(ctx, "project_index", None)
+    if project_index is None:
+        project_index = ctx.project_index = ProjectIndex()
+    definition_filepath = ctx.definition_filepath
+    return lambda claim: project_index.validate_claim(definition_filepath, claim)
+
+
+@step("all generated claims render without errors")
+def check_generated_claims_render(ctx: Context):
+    results = get_from_context(ctx, CTX_FUZZ_RESULTS)
+    check_generated_claims(results, lambda result: result.error if result.failed else None, skip_failed=False)
+
+
+@step("all generated claims provision between {min_count:d} and {max_count:d} resources")
+def check_generated_claims_resource_count(ctx: Context, min_count: int, max_count: int):
+    results = get_from_context(ctx, CTX_FUZZ_RESULTS)
+    check_generated_claims(
+        results,
+        lambda result: None if min_count <= len(result.desired_resources) <= max_count
+        else f"{len(result.desired_resources)} resources provisioning: {list(result.desired_resources.keys())}",
+    )
+
+
+@step("all resources of the generated claims have parameters")
+def check_generated_claims_resource_parameters(ctx: Context):
+    results = get_from_context(ctx, CTX_FUZZ_RESULTS)
+    entries = [(row["param name"], row["param value"]) for row in ctx.table]
+
+    def missing_entries(result):
+        errors = []
+        for resource_name, resource in result.desired_resources.items():
+            for key, value in entries:
+                try:
+                    assert_has_resource_entry(resource_name, resource, key, value=value)
+                except AssertionError as e:
+                    errors.append(str(e).strip())
+        return "; ".join(errors) or None
+
+    check_generated_claims(results, missing_entries)
+
+
+@when("crossplane renders the composition with {param} of sizes {sizes}")
+def profile_claim_parameter(ctx: Context, param: str, sizes: str):
+    """Render the composition once per size of a claim parameter (e.g. spec.policiesARN) with the current observed
+    state, and measure the render wall time, output size and resource count. The sizes are either comma
+    separated (e.g. 1,10,100) or a range with a factor (e.g. 1..1000 x10). The measures, fitted growth curves
+    and a chart are written to the profile reports folder and attached to the allure report.
+
+    Arguments:
+        ctx {Context} -- behave context
+        param {str} -- claim parameter to sweep
+        sizes {str} -- sizes of the parameter
+
+    Raises:
+        AssertionError: no claim found in context
+        AssertionError: a render failed
+    """
+    claim = get_from_context(ctx, "claim", assert_exists=True)
+    precheck_render_inputs(ctx)
+    # The observed state given by a step is left for the next render of the scenario
+    args = prepare_render_args(ctx, log_input=ctx.debug_mode, keep_observed_file=True)
+
+    feature_name = ctx.feature.name.replace(" ", "_")
+    scenario_name = ctx.scenario.name.replace(" ", "_")
+    profile = sweep_claim_parameter(
+        claim,
+        param,
+        parse_sizes(sizes),
+        f"{TMP_CLAIMS_FILE_PATH}/{feature_name}/{scenario_name}",
+        args,
+        args.index(ctx.claim_filepath),
+        repeats=ctx.profile_repeats,
+        timeout=ctx.render_timeout,
+        retries=ctx.render_retries,
+        backoff=ctx.render_retry_backoff,
+        watchdog=getattr(ctx, "render_watchdog", None),
+        metrics=getattr(ctx, "metrics", None),
+    )
+
+    profiles = get_from_context(ctx, CTX_PROFILES, assert_exists=False) or {}
+    profiles[param] = profile
+    ctx.profiles = profiles
+
+    report_files = write_profile_report(
+        f"{PROFILE_REPORTS_PATH}/{feature_name}/{scenario_name}_{param}", profile)
+    for report_file in report_files:
+        allure.attach.file(report_file, name=report_file.name)
+
+
+@step("render scales at most linearly in {param}")
+def check_render_scales_linearly(ctx: Context, param: str):
+    profiles = get_from_context(ctx, CTX_PROFILES)
+    assert_that(param in profiles, f"no profile found for {param}, profiled parameters are {list(profiles.keys())}")
+    check_render_growth(profiles[param], max_exponent=1)
+
+
+@when("crossplane renders every readiness ordering of the desired resources")
+@when("crossplane renders every readiness ordering of the desired resources up to {max_states:d} states")
+def explore_readiness_orderings(ctx: Context, max_states: int = DEFAULT_EXPLORATION_MAX_STATES):
+    """Render the composition for every ordering in which the desired resources become ready, starting from the
+    desired resources of the last render and the changes of the steps. The states reached by several orderings are
+    rendered once, see explore_readiness. The state graph is written to the exploration reports folder and attached
+    to the allure report. The resources of the nested composite resources are not explored.
+
+    Arguments:
+        ctx {Context} -- behave context
+
+    Keyword Arguments:
+        max_states {int} -- maximum number of states to explore (default: {DEFAULT_EXPLORATION_MAX_STATES})
+
+    Raises:
+        AssertionError: no desired resources found in context
+    """
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES, assert_exists=True)
+    precheck_render_inputs(ctx)
+    nested_resources = getattr(ctx, CTX_NESTED_RESOURCES, None) or {}
+    resources = {name: resource for name, resource in desired_resources.items() if name not in nested_resources}
+
+    functions_filepath = ctx.functions_filepath
+    function_runtimes = getattr(ctx, "function_runtimes", None)
+    if function_runtimes:
+        functions_filepath = function_runtimes.functions_filepath(functions_filepath, WARM_FUNCTIONS_PATH)
+    render_cache = getattr(ctx, "render_cache", None)
+
+    def render_observed_state(observed_filepath):
+        args = build_render_args(ctx.claim_filepath, ctx.composition_filepath, functions_filepath,
+                                 ctx.envconfig_filepath, observed_filepath=observed_filepath)
+        # Cached by the original functions file, see render
+        cache_key = render_cache.key(build_render_args(ctx.claim_filepath, ctx.composition_filepath,
+                                                       ctx.functions_filepath, ctx.envconfig_filepath,
+                                                       observed_filepath=observed_filepath)
+                                     ) if render_cache else None
+        return run_render(args, timeout=ctx.render_timeout, retries=ctx.render_retries,
+                          backoff=ctx.render_retry_backoff, watchdog=getattr(ctx, "render_watchdog", None),
+                          metrics=getattr(ctx, "metrics", None), cache=render_cache, cache_key=cache_key)
+
+    feature_name = ctx.feature.name.replace(" ", "_")
+    scenario_name = ctx.scenario.name.replace(" ", "_")
+    exploration = explore_readiness(
+        resources,
+        getattr(ctx, "updates", None),
+        render_observed_state,
+        f"{TMP_CLAIMS_FILE_PATH}/exploration/{feature_name}/{scenario_name}",
+        ctx.render_workers,
+        max_states,
+    )
+    ctx.exploration = exploration
+    logger.info(exploration.summary())
+
+    report_files = write_exploration_report(f"{EXPLORATION_REPORTS_PATH}/{feature_name}/{scenario_name}",
+                                            exploration)
+    for report_file in report_files:
+        allure.attach.file(report_file, name=report_file.name)
+
+
+@step("all readiness orderings converge")
+def check_readiness_orderings_converge(ctx: Context):
+    exploration = get_from_context(ctx, CTX_EXPLORATION)
+    problems = exploration.problems()
+    assert not problems, f"{exploration.summary()}:\n" + "\n".join(problems)
+
+
+@then("the last render took less than {budget}")
+def check_last_render_duration(ctx: Context, budget: str):
+    """Check the wall time of the last render (of the "crossplane renders the composition" step) against a budget,
+    e.g. 500ms or 2s
+
+    Arguments:
+        ctx {Context} -- behave context
+        budget {str} -- latency budget
+    """
+    assert hasattr(ctx, "last_render_duration"), "no render found in context"
+    duration = ctx.last_render_duration
+    if duration is None:
+        logger.info("the last render was served by the render cache, its duration is not checked")
+        return
+    assert duration < parse_duration(budget), f"the last render took {duration:.3f}s, more than {budget}"
+
+
+@then("all renders took less than {budget}")
+def check_renders_duration(ctx: Context, budget: str):
+    """Check the wall time of every render of the scenario against a budget, e.g. 500ms or 2s
+
+    Arguments:
+        ctx {Context} -- behave context
+        budget {str} -- latency budget
+    """
+    durations = get_from_context(ctx, "render_durations", assert_exists=True)
+    slow = [f"render {i + 1} took {duration:.3f}s" for i, duration in enumerate(durations)
+            if duration >= parse_duration(budget)]
+    assert not slow, f"renders took more than {budget}: " + ", ".join(slow)
 
 
 @then("check that no resources are provisioning")
@@ -258,6 +722,60 @@ def check_resource_count_and_names(ctx: Context, resource_count: int):
     )
 
 
+@step("check that {resource_count:d} resource of kind {kind} is provisioning")
+@step("check that {resource_count:d} resources of kind {kind} are provisioning")
+def check_resource_count_of_kind(ctx: Context, resource_count: int, kind: str):
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES)
+    index = get_from_context(ctx, CTX_DESIRED_RESOURCES_INDEX)
+    check_resources(
+        {name: desired_resources[name] for name in index.with_kind(kind)},
+        resource_count,
+    )
+
+
+@step("check that {resource_count:d} resource of kind {kind} is provisioning and it is")
+@step("check that {resource_count:d} resources of kind {kind} are provisioning and they are")
+def check_resource_count_and_names_of_kind(ctx: Context, resource_count: int, kind: str):
+    expected_resources_names = [row["resource-name"] for row in ctx.table]
+
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES)
+    index = get_from_context(ctx, CTX_DESIRED_RESOURCES_INDEX)
+    check_resources(
+        {name: desired_resources[name] for name in index.with_kind(kind)},
+        resource_count,
+        expected_resource_names=expected_resources_names,
+    )
+
+
+@step("check that {resource_count:d} resource with apiVersion {api_version} is provisioning")
+@step("check that {resource_count:d} resources with apiVersion {api_version} are provisioning")
+def check_resource_count_with_api_version(ctx: Context, resource_count: int, api_version: str):
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES)
+    index = get_from_context(ctx, CTX_DESIRED_RESOURCES_INDEX)
+    check_resources(
+        {name: desired_resources[name] for name in index.with_api_version(api_version)},
+        resource_count,
+    )
+
+
+@step("check that all resources with label {label} have parameters")
+def check_labelled_resources_parameters(ctx: Context, label: str):
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES)
+    index = get_from_context(ctx, CTX_DESIRED_RESOURCES_INDEX)
+    entries = [(row["param name"], row["param value"]) for row in ctx.table]
+    check_selected_resources_have_entries(
+        desired_resources, index.with_label(label), f"label {label}", entries)
+
+
+@step("check that all resources with annotation {annotation} have parameters")
+def check_annotated_resources_parameters(ctx: Context, annotation: str):
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES)
+    index = get_from_context(ctx, CTX_DESIRED_RESOURCES_INDEX)
+    entries = [(row["param name"], row["param value"]) for row in ctx.table]
+    check_selected_resources_have_entries(
+        desired_resources, index.with_annotation(annotation), f"annotation {annotation}", entries)
+
+
 @step("check that resource {resource_name} has parameters with key prefix {key}")
 def check_resource_parameters_with_key_prefix(ctx, resource_name, key):
     # logger.info(f"check the resource {resource_name} parameters under key {key}:")
@@ -271,9 +789,10 @@ def check_resource_parameters_with_key_prefix(ctx, resource_name, key):
         if key:
             param_name = f"{key}.{param_name}"
 
-        assert_has_resource_entry(
-            resource_name, resource, param_name, value=param_value
-        )
+        with pipeline_blame(ctx, resource_name, param_name):
+            assert_has_resource_entry(
+                resource_name, resource, param_name, value=param_value
+            )
 
 
 @step("check that resource {resource_name} has parameters")
@@ -297,7 +816,8 @@ def check_resource_missing_parameters_with_key_prefix(ctx, resource_name, key):
         if key:
             param_name = f"{key}.{param_name}"
 
-        assert_has_not_resource_entry(resource_name, resource, param_name)
+        with pipeline_blame(ctx, resource_name, param_name):
+            assert_has_not_resource_entry(resource_name, resource, param_name)
 
 
 @step("check that resource {resource_name} does not have parameters")
@@ -331,9 +851,70 @@ def check_composite_status_parameters(ctx):
         param_name, param_value = row["param name"], row["param value"]
         param_name = f"status.{param_name}"
 
-        assert_has_resource_entry(
-            "composite", desired_xr, param_name, value=param_value
-        )
+        with pipeline_blame(ctx, "composite", param_name):
+            assert_has_resource_entry(
+                "composite", desired_xr, param_name, value=param_value
+            )
+
+
+@step("check that desired resources match snapshot {snapshot}")
+def check_desired_resources_snapshot(ctx: Context, snapshot: str):
+    """Check the desired resources against the snapshot {snapshot}.yaml in the snapshots folder of the feature.
+    The snapshots are created or rewritten instead when running with COMPOSITION_TESTER_UPDATE_SNAPSHOTS.
+
+    Arguments:
+        ctx {Context} -- behave context
+        snapshot {str} -- name of the snapshot
+    """
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES, assert_exists=True)
+    check_snapshot(ctx, "desired resources", desired_resources, snapshot)
+
+
+@step("check that desired resources are valid against the CRDs")
+def check_desired_resources_valid(ctx: Context):
+    """Check the desired resources against the CRDs of their providers, in the directory set with
+    COMPOSITION_TESTER_CRDS_DIRECTORY or the crds folder of the project. The resources of a group without CRD in the
+    directory are not checked.
+
+    Arguments:
+        ctx {Context} -- behave context
+    """
+    crd_index = getattr(ctx, "crd_index", None) or shared_crd_index(ctx.project_root / CRDS_DIRECTORY)
+    validated = check_desired_resources_crds(ctx, crd_index)
+    assert validated, f"no desired resource has a CRD in {crd_index.directory}"
+
+
+def check_desired_resources_crds(ctx: Context, crd_index):
+    desired_resources = get_from_context(ctx, CTX_DESIRED_RESOURCES, assert_exists=True)
+    fingerprints = {**(getattr(ctx, CTX_DESIRED_FINGERPRINTS, None) or {}),
+                    **(getattr(ctx, CTX_NESTED_FINGERPRINTS, None) or {})}
+    start = time.monotonic()
+    violations, validated = crd_index.validate(desired_resources, fingerprints)
+    metrics = getattr(ctx, "metrics", None)
+    if metrics:
+        metrics.observe("crd_validation_duration_seconds", time.monotonic() - start)
+    if violations:
+        allure.attach("\n".join(violations), name="CRD violations")
+    assert not violations, (f"{len(violations)} violation(s) of the CRDs in the desired resources:\n" +
+                            "\n".join(violations))
+    return validated
+
+
+@step("check that resource {resource_name} matches snapshot {snapshot}")
+def check_resource_snapshot(ctx: Context, resource_name, snapshot: str):
+    resource = get_resource_from_context(ctx, resource_name, assert_exists=True)
+    check_snapshot(ctx, f"resource {resource_name}", resource, snapshot)
+
+
+def check_snapshot(ctx: Context, name: str, value, snapshot: str):
+    filepath = Path(ctx.base_path, SNAPSHOTS_DIRECTORY, f"{snapshot}.yaml")
+    try:
+        differences = assert_matches_snapshot(name, value, filepath, update=ctx.update_snapshots)
+    except AssertionError as e:
+        allure.attach(str(e), name=f"snapshot {snapshot} differences")
+        raise
+    if differences:
+        logger.info(f"Snapshot {filepath} updated:\n" + "\n".join(differences))
 
 
 @step(
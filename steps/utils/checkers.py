@@ -14,6 +14,8 @@
 
 from hamcrest import assert_that, equal_to, none, is_not, has_item, any_of, empty, has_length
 
+from steps.utils.constants import PROFILE_EXPONENT_TOLERANCE, PROFILE_MIN_GROWTH_SHARE
+from steps.utils.matchers import parse_matcher
 from steps.utils.utils import get_resource_entry
 
 
@@ -40,6 +42,9 @@ def assert_resource_has_key_and_return_value(resource_name, resource, key: str):
 def assert_has_resource_entry(resource_name, resource, key: str, value: str = None):
     """Check that a resource has an entry
 
+    The value can be prefixed with a matcher (e.g. {regexp}, {glob}, {>=}, {subset}) or be \\absent to check
+    that the entry does not exist, see ValueMatcher.
+
     Arguments:
         resource_name {str} -- resource name
         resource {dict} -- resource
@@ -51,11 +56,18 @@ def assert_has_resource_entry(resource_name, resource, key: str, value: str = No
     Raises:
         AssertionError: resource does not have the entry
     """
-    result = str(assert_resource_has_key_and_return_value(
-        resource_name, resource, key))
-    if value:
-        assert_that(result, equal_to(
-            value), f"expected resource {resource_name} to have {key} with value {value}, but found value {result} instead")
+    if not value:
+        assert_resource_has_key_and_return_value(resource_name, resource, key)
+        return
+
+    matcher = parse_matcher(value)
+    if matcher is None:
+        assert_has_not_resource_entry(resource_name, resource, key)
+        return
+
+    result = assert_resource_has_key_and_return_value(resource_name, resource, key)
+    assert_that(matcher.matches(result),
+                f"expected resource {resource_name} to have {key} with {matcher.description}, but found value {result} instead")
 
 
 def assert_has_not_resource_entry(resource_name, resource, key: str):
@@ -152,3 +164,71 @@ def check_resources_are_empty(resources):
 #     if str.lower(status) == "not ready":
 #         assert ready_condition[
 #                    "status"] == "False", f"expected xr status to be {status}, but found Ready"
+
+
+def check_selected_resources_have_entries(desired_resources, resource_names, selector: str, entries):
+    """Check that the selected resources all have the given entries
+
+    Arguments:
+        desired_resources {dict} -- desired resources
+        resource_names {list[str]} -- names of the selected resources
+        selector {str} -- description of the selection, used in the error messages
+        entries {list[tuple]} -- expected (key, value) entries
+
+    Raises:
+        AssertionError: no resource selected
+        AssertionError: a selected resource does not have one of the entries
+    """
+    assert_that(resource_names, is_not(empty()),
+                f"no desired resources with {selector}. Got desired resources {list(desired_resources.keys())}")
+    for resource_name in resource_names:
+        resource = desired_resources[resource_name]
+        for key, value in entries:
+            assert_has_resource_entry(resource_name, resource, key, value=value)
+
+
+def check_generated_claims(results, check, skip_failed: bool = True):
+    """Check an invariant on the renders of all the generated claims, and report all the claims breaking it at once.
+
+    Arguments:
+        results {list[FuzzResult]} -- results of the renders of the generated claims
+        check {callable} -- returns an error message if the render of a claim breaks the invariant, None otherwise
+
+    Keyword Arguments:
+        skip_failed {bool} -- do not check the failed renders, they are reported by the render errors check (default: {True})
+
+    Raises:
+        AssertionError: the render of one or more claims breaks the invariant
+    """
+    failures = []
+    for result in results:
+        if skip_failed and result.failed:
+            continue
+        error = check(result)
+        if error:
+            failures.append(f"seed {result.seed} ({result.claim_filepath}): {error}")
+
+    assert_that(not failures,
+                f"{len(failures)} of {len(results)} generated claims failed. Reproduce a failure with the step "
+                f"'Given input claim generated from the definition with seed <SEED>':\n" + "\n".join(failures))
+
+
+def check_render_growth(profile, max_exponent: float):
+    """Check that the render time grows at most with the given exponent of the size of the swept parameter.
+    The growth is ignored when it is only a small share of the render time at the largest size.
+
+    Arguments:
+        profile {ProfileResult} -- profile of the swept parameter
+        max_exponent {float} -- maximum exponent (e.g. 1 for linear)
+
+    Raises:
+        AssertionError: render time grows faster than expected
+    """
+    fit = profile.fits["wall_time"]
+    max_size = max(point.size for point in profile.points)
+    growth = fit.coefficient * max_size ** fit.exponent
+    growth_share = growth / ((fit.overhead + growth) or 1)
+    measures = ", ".join(f"{point.size}: {point.wall_time:.3f}s" for point in profile.points)
+    assert_that(growth_share < PROFILE_MIN_GROWTH_SHARE or fit.exponent <= max_exponent + PROFILE_EXPONENT_TOLERANCE,
+                f"expected render time to grow at most with exponent {max_exponent} in {profile.param}, "
+                f"but fitted exponent is {fit.exponent} (render times by size: {measures})")
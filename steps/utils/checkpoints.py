@@ -0,0 +1,233 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import yaml
+from behave.model_core import Status
+from behave.runner import Context
+from benedict import benedict
+
+from steps.utils.constants import (
+    CHECKPOINTS_PATH,
+    CTX_DESIRED_COMPOSITE,
+    CTX_DESIRED_RESOURCES,
+    CTX_NESTED_RESOURCES,
+    CTX_PROVENANCE,
+    DICT_BENEDICT_SEPARATOR)
+from steps.utils.nested import set_nested_resources
+from steps.utils.provenance import read_provenance_report, write_provenance_report
+from steps.utils.utils import CompactLoader, dump_yaml_to_file, read_desired_output_into_context
+
+# Paths of the inputs in context, restored as they were at the checkpoint
+CHECKPOINT_PATHS = (
+    "claim_filepath",
+    "composition_filepath",
+    "functions_filepath",
+    "envconfig_filepath",
+    "definition_filepath",
+    "compositions_directory",
+)
+
+
+def checkpoint_directory(scenario):
+    """Get the directory of the checkpoint of a scenario, e.g.
+    checkpoints/composition-tests.service-account.service-account-27 for the scenario at line 27
+
+    Arguments:
+        scenario {behave.model.Scenario} -- scenario
+
+    Returns:
+        Path -- checkpoint directory
+    """
+    feature_path = Path(scenario.feature.filename).with_suffix("").as_posix().strip("./").replace("/", ".")
+    return Path(CHECKPOINTS_PATH) / f"{feature_path}-{scenario.line}"
+
+
+def inputs_hash(ctx: Context, scenario, steps_count: int):
+    """Hash the inputs of the first steps of a scenario: the text of the steps and the content of the files they
+    reference, as well as the default composition, definition, functions and environment config of the feature
+
+    Arguments:
+        ctx {Context} -- behave context
+        scenario {behave.model.Scenario} -- scenario
+        steps_count {int} -- number of steps to hash
+
+    Returns:
+        str -- sha256 of the inputs
+    """
+    steps = scenario.all_steps if isinstance(scenario.all_steps, list) else list(scenario.all_steps)
+    steps = steps[:steps_count]
+    project_index = ctx.project_index
+    layout = project_index.layout(scenario.feature.filename)
+
+    digest = hashlib.sha256()
+    for step in steps:
+        digest.update(f"{step.keyword} {step.name}\n{step.text or ''}\n".encode())
+        if step.table:
+            for row in [step.table.headings] + [row.cells for row in step.table.rows]:
+                digest.update(("|".join(row) + "\n").encode())
+
+    filepaths = [layout.composition_filepath, layout.definition_filepath, layout.functions_filepath,
+                 layout.envconfig_filepath]
+    filepaths += [filepath for _, _, filepath in project_index.step_inputs(scenario.feature, steps,
+                                                                          ctx._runner.step_registry)]
+    for filepath in filepaths:
+        if filepath is None:
+            continue
+        digest.update(f"{filepath}\n".encode())
+        if project_index.exists(filepath):
+            digest.update(project_index.file(filepath).text.encode())
+    return digest.hexdigest()
+
+
+def save_checkpoint(ctx: Context, scenario, step_index: int):
+    """Save the state of the context after a successful render, so that a failed scenario can be resumed from it.
+    The checkpoint replaces the previous one of the scenario.
+
+    Arguments:
+        ctx {Context} -- behave context
+        scenario {behave.model.Scenario} -- scenario
+        step_index {int} -- index of the render step in all the steps of the scenario (including the background)
+    """
+    directory = checkpoint_directory(scenario)
+    desired_xr = getattr(ctx, CTX_DESIRED_COMPOSITE)
+    desired_resources = getattr(ctx, CTX_DESIRED_RESOURCES)
+    # The resources of nested composite resources are saved apart, their qualified names are not in the resources
+    nested_resources = getattr(ctx, CTX_NESTED_RESOURCES, None) or {}
+    dump_yaml_to_file(directory / "desired.yaml",
+                      [plain(desired_xr)] + [plain(r) for name, r in desired_resources.items()
+                                             if name not in nested_resources],
+                      dump_multiple_resources=True)
+    dump_yaml_to_file(directory / "nested.yaml", [plain(r) for r in nested_resources.values()],
+                      dump_multiple_resources=True)
+    # The provenance of the fields of the render, used by the checks of the next steps
+    provenance = getattr(ctx, CTX_PROVENANCE, None)
+    if provenance is not None:
+        write_provenance_report(directory / "provenance", provenance)
+    else:
+        (directory / "provenance.json").unlink(missing_ok=True)
+
+    updates = getattr(ctx, "updates", None)
+    state = {
+        "step_index": step_index,
+        "inputs_hash": inputs_hash(ctx, scenario, step_index + 1),
+        "iteration_id": getattr(ctx, "iteration_id", None),
+        "claim": plain(getattr(ctx, "claim", None)),
+        "updates": plain(updates) if updates else None,
+        "nested_render_depth": getattr(ctx, "nested_render_depth", None),
+        "pipeline_bisect": getattr(ctx, "pipeline_bisect", False),
+        "provenance": provenance is not None,
+        "nested_resources": list(nested_resources),
+        # The render times of the scenario so far, for the latency budgets of the next steps
+        "last_render_duration": getattr(ctx, "last_render_duration", None),
+        "render_durations": list(getattr(ctx, "render_durations", None) or []),
+        "paths": {attr: str(getattr(ctx, attr)) for attr in CHECKPOINT_PATHS if getattr(ctx, attr, None)},
+    }
+    # The state is written last: a checkpoint without state is ignored
+    dump_yaml_to_file(directory / "state.yaml", state)
+
+
+def restore_checkpoint(ctx: Context, scenario):
+    """Restore the context from the checkpoint of a scenario, if its inputs did not change since it was saved.
+    The steps up to the checkpoint are then not run again, they are reported as passed.
+
+    Arguments:
+        ctx {Context} -- behave context
+        scenario {behave.model.Scenario} -- scenario
+
+    Returns:
+        int -- number of restored steps, 0 if there is no usable checkpoint
+    """
+    directory = checkpoint_directory(scenario)
+    state_filepath = directory / "state.yaml"
+    if not state_filepath.exists():
+        return 0
+
+    with open(state_filepath, mode="r", encoding="utf-8") as file:
+        state = yaml.safe_load(file)
+    step_index = state["step_index"]
+    if state["inputs_hash"] != inputs_hash(ctx, scenario, step_index + 1):
+        print(f"Checkpoint of scenario {scenario.name} is outdated, running it from the start")
+        return 0
+
+    for attr, value in state["paths"].items():
+        setattr(ctx, attr, Path(value))
+    ctx.iteration_id = state["iteration_id"]
+    if state["claim"] is not None:
+        ctx.claim = benedict(state["claim"], keypath_separator=DICT_BENEDICT_SEPARATOR)
+        # The claim may have been changed by a step and dumped to a temporary file
+        if not os.path.exists(ctx.claim_filepath):
+            dump_yaml_to_file(ctx.claim_filepath, state["claim"])
+    if state["updates"]:
+        ctx.updates = benedict(state["updates"], keypath_separator=DICT_BENEDICT_SEPARATOR)
+    with open(directory / "desired.yaml", mode="r", encoding="utf-8") as file:
+        read_desired_output_into_context(ctx, file.read())
+    ctx.nested_render_depth = state.get("nested_render_depth")
+    ctx.pipeline_bisect = state.get("pipeline_bisect", False)
+    if state.get("provenance"):
+        setattr(ctx, CTX_PROVENANCE, read_provenance_report(directory / "provenance.json"))
+    if "last_render_duration" in state:
+        ctx.last_render_duration = state["last_render_duration"]
+    ctx.render_durations = list(state.get("render_durations") or [])
+    if state.get("nested_resources"):
+        with open(directory / "nested.yaml", mode="r", encoding="utf-8") as file:
+            nested = [benedict(r, keypath_separator=DICT_BENEDICT_SEPARATOR)
+                      for r in yaml.load_all(file, Loader=CompactLoader) if r is not None]
+        set_nested_resources(ctx, dict(zip(state["nested_resources"], nested)))
+
+    steps = list(scenario.all_steps)[:step_index + 1]
+    for step in steps:
+        step.run = restored_step_run(step)
+    return len(steps)
+
+
+def restored_step_run(step):
+    """Replace the run of a step restored from a checkpoint: the step is reported as passed without running it"""
+    def run(runner, quiet=False, capture=True):
+        step.reset()
+        match = runner.step_registry.find_match(step)
+        if match is None:
+            return type(step).run(step, runner, quiet, capture)
+        step.status = Status.passed
+        if not quiet:
+            for formatter in runner.formatters:
+                formatter.match(match)
+                formatter.result(step)
+        return True
+    return run
+
+
+def release_restored_steps(scenario):
+    """Put back the run of the steps restored from a checkpoint. The background steps are shared by the scenarios
+    of a feature, they must run again in the next scenario."""
+    for step in scenario.all_steps:
+        step.__dict__.pop("run", None)
+
+
+def remove_checkpoint(scenario):
+    """Remove the checkpoint of a scenario, e.g. once it passed"""
+    shutil.rmtree(checkpoint_directory(scenario), ignore_errors=True)
+
+
+def plain(value):
+    """Convert benedict dictionaries to plain dictionaries, recursively, so that they can be dumped"""
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
@@ -0,0 +1,173 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import re
+
+import yaml
+from benedict import benedict
+
+from steps.utils.constants import (
+    COMPOSITE_LABEL,
+    COMPOSITION_RESOURCE_NAME_ANNOTATION,
+    DICT_BENEDICT_SEPARATOR,
+    EXPORT_DROPPED_ANNOTATIONS,
+)
+from steps.utils.observed import fingerprint
+from steps.utils.utils import CompactLoader
+
+# Start (---) or end (...) of a document of a multi-document export
+DOCUMENT_MARKER = re.compile(r"^(---|\.\.\.)(\s|$)")
+# Sequence of the resources of a List object, e.g. kubectl get -o yaml of several resources
+ITEMS_KEY = "items:"
+LIST_KIND = re.compile(r"\bkind:[ \t]*[\"']?\w*List\b")
+
+
+def export_documents(lines):
+    """Split a cluster export into the text of its resources, line by line, so that only one resource is held in
+    memory at a time. The export is a stream of YAML documents (e.g. kubectl get -o yaml of one resource, or
+    several of them separated by ---), where each document can be a List object, whose items are split as well.
+
+    Arguments:
+        lines {iterable} -- lines of the export, e.g. an open file
+
+    Returns:
+        generator -- text of the resources, dedented out of the List objects
+    """
+    # Lines of the current document outside of its items, i.e. a resource or the envelope of a List
+    document = []
+    # Lines of the current item of the List, and the indentation of its dash
+    item, item_indent = None, None
+    # The document is a List, and its items are being read
+    is_list, in_items = False, False
+    for line in lines:
+        if DOCUMENT_MARKER.match(line):
+            if item:
+                yield "".join(item)
+            if not is_list:
+                yield from _document_resources("".join(document))
+            document, item, item_indent, is_list, in_items = [], None, None, False, False
+            continue
+
+        if in_items:
+            stripped = line.lstrip(" ")
+            indent = len(line) - len(stripped)
+            if not stripped.strip() or stripped.startswith("#"):
+                if item is not None:
+                    item.append("\n")
+                continue
+            is_item_start = stripped.startswith("- ") or stripped.rstrip() == "-"
+            if item_indent is None and is_item_start:
+                item_indent = indent
+            if item_indent is not None and indent == item_indent and is_item_start:
+                if item:
+                    yield "".join(item)
+                item = [line[indent + 2:] or "\n"]
+                continue
+            if item is not None and indent > item_indent:
+                item.append(line[item_indent + 2:] if indent >= item_indent + 2 else stripped)
+                continue
+            # End of the items
+            in_items = False
+            if item:
+                yield "".join(item)
+            item = None
+
+        if line.rstrip() == ITEMS_KEY:
+            is_list, in_items = True, True
+            continue
+        document.append(line)
+
+    if item:
+        yield "".join(item)
+    if not is_list:
+        yield from _document_resources("".join(document))
+
+
+def _document_resources(text):
+    """A document is a resource, unless it is a List whose items are not in block style, e.g. items: []"""
+    if not text.strip():
+        return
+    if not LIST_KIND.search(text):
+        yield text
+        return
+    for document in yaml.load_all(text, Loader=CompactLoader):
+        items = document.get("items") if isinstance(document, dict) else None
+        for resource in items if isinstance(items, list) else [document]:
+            if resource:
+                yield yaml.safe_dump(resource)
+
+
+def belongs_to(resource: dict, composite_name: str):
+    """Check if a resource of a cluster export is composed by a composite resource
+
+    Arguments:
+        resource {dict} -- resource
+        composite_name {str} -- name of the composite resource
+
+    Returns:
+        bool -- the resource is composed by the composite resource
+    """
+    metadata = resource.get("metadata") or {}
+    if COMPOSITION_RESOURCE_NAME_ANNOTATION not in (metadata.get("annotations") or {}):
+        return False
+    if (metadata.get("labels") or {}).get(COMPOSITE_LABEL) == composite_name:
+        return True
+    return any(owner.get("name") == composite_name for owner in metadata.get("ownerReferences") or []
+               if isinstance(owner, dict))
+
+
+def import_cluster_export(filepath, composite_name: str):
+    """Import the resources of a composite resource from a cluster export (e.g. kubectl get -o yaml), possibly
+    gzipped, as observed state. The export is streamed: the resources are split one by one, and only the ones
+    mentioning the composite resource are parsed, so that the memory used does not depend on the size of the export.
+    The managed fields and the last applied configuration, which are not observed by the compositions, are dropped.
+
+    Arguments:
+        filepath {Path} -- cluster export
+        composite_name {str} -- name of the composite resource
+
+    Raises:
+        ValueError: two resources of the composite resource have the same composition resource name
+
+    Returns:
+        tuple -- (resources by composition resource name, fingerprints of the resources by name (see fingerprint),
+            number of resources in the export)
+    """
+    resources = {}
+    fingerprints = {}
+    total = 0
+    opener = gzip.open if str(filepath).endswith(".gz") else open
+    with opener(filepath, mode="rt", encoding="utf-8") as file:
+        for text in export_documents(file):
+            total += 1
+            # Most resources of a cluster export belong to other composite resources, or to none
+            if COMPOSITION_RESOURCE_NAME_ANNOTATION not in text or composite_name not in text:
+                continue
+            resource = yaml.load(text, Loader=CompactLoader)
+            if not isinstance(resource, dict) or not belongs_to(resource, composite_name):
+                continue
+
+            metadata = resource["metadata"]
+            metadata.pop("managedFields", None)
+            for annotation in EXPORT_DROPPED_ANNOTATIONS:
+                metadata["annotations"].pop(annotation, None)
+            name = metadata["annotations"][COMPOSITION_RESOURCE_NAME_ANNOTATION]
+            if name in resources:
+                raise ValueError(f"resources {resources[name].get('kind')}/{resources[name]['metadata'].get('name')} "
+                                 f"and {resource.get('kind')}/{metadata.get('name')} of {composite_name} are both "
+                                 f"named {name}")
+            resources[name] = benedict(resource, keypath_separator=DICT_BENEDICT_SEPARATOR)
+            fingerprints[name] = fingerprint(text)
+    return resources, fingerprints, total
@@ -12,13 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+
 BASE_PATH = f"features"
 
-TMP_OBSERVED_FILE_PATH = "/tmp/observed.yaml"
-TMP_CLAIMS_FILE_PATH = "/tmp/claims"
+# Prefix of the observed state file of each scenario, in the temporary directory
+TMP_OBSERVED_FILE_PREFIX = "xplane-observed-"
+# In the temporary directory (TMPDIR), so that concurrent test runs (e.g. the workers of the mutation tester) can
+# use their own
+TMP_CLAIMS_FILE_PATH = os.path.join(tempfile.gettempdir(), "claims")
 
 CTX_DESIRED_RESOURCES = "desired_resources"
 CTX_DESIRED_COMPOSITE = "desired_xr"
+CTX_DESIRED_RESOURCES_INDEX = "desired_resources_index"
+CTX_DESIRED_FINGERPRINTS = "desired_fingerprints"
+CTX_NESTED_RESOURCES = "nested_resources"
+CTX_NESTED_FINGERPRINTS = "nested_fingerprints"
+
+# Separator of the qualified names of the resources of nested composite resources, e.g. network/subnet
+NESTED_NAME_SEPARATOR = "/"
+# Maximum depth of the nested composite resources rendered with their compositions
+DEFAULT_NESTED_RENDER_DEPTH = 5
+
+# Annotations of the desired resources that are indexed and can be used to select resources in the steps
+INDEXED_ANNOTATIONS = (
+    "crossplane.io/external-name",
+    "crossplane.io/paused",
+    "gotemplating.fn.crossplane.io/ready",
+    "krm.kcl.dev/ready",
+)
+
+# Annotation naming the resources in the composition, and label naming their composite resource
+COMPOSITION_RESOURCE_NAME_ANNOTATION = "crossplane.io/composition-resource-name"
+COMPOSITE_LABEL = "crossplane.io/composite"
+# Annotations of the resources of a cluster export dropped when importing them as observed state
+EXPORT_DROPPED_ANNOTATIONS = ("kubectl.kubernetes.io/last-applied-configuration",)
 
 CLAIM = "claim"
 COMPOSITION = "composition"
@@ -26,7 +55,160 @@ FUNCTIONS = "functions"
 ENVCONFIG = "envconfig"
 OBSERVED = "observed"
 
+# Strings from the render output up to this length (keys, kinds, annotation names, ...) are interned
+# so that a single copy of each is kept in memory.
+INTERN_MAX_LENGTH = 64
+
 # The separator that benedict will use for keypaths.
 # By default, it should be the dot "." however some keys in the manifests already have dots in their keynames and
 # so will raise an error if we use dots. So we choose a special separator that is unlikely to be used in the keynames.
 DICT_BENEDICT_SEPARATOR = "->"
+
+# Render subprocess settings. They can be overridden with the environment variables
+# COMPOSITION_TESTER_RENDER_TIMEOUT, COMPOSITION_TESTER_RENDER_RETRIES and COMPOSITION_TESTER_RENDER_RETRY_BACKOFF
+DEFAULT_RENDER_TIMEOUT_SECONDS = 300
+DEFAULT_RENDER_RETRIES = 2
+DEFAULT_RENDER_RETRY_BACKOFF_SECONDS = 2
+
+# Maximum number of renders running at the same time when rendering many claims at once (e.g. fuzzing).
+# It can be overridden with the environment variable COMPOSITION_TESTER_RENDER_WORKERS
+DEFAULT_RENDER_WORKERS = 4
+
+# Adaptive limit of the renders running at the same time on the machine, across the processes, enabled with the
+# environment variable COMPOSITION_TESTER_ADAPTIVE_CONCURRENCY. The limit is at most
+# COMPOSITION_TESTER_MAX_CONCURRENT_RENDERS (default: number of CPUs)
+RENDER_SLOTS_PATH = os.path.join(tempfile.gettempdir(), "render_slots")
+ADAPTIVE_CONCURRENCY_INITIAL_LIMIT = 2
+# The limit is adjusted after each window of at least this many renders
+ADAPTIVE_CONCURRENCY_MIN_WINDOW = 4
+# The limit is decreased when the median render latency of a window is this much above the baseline (ratio)
+ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE = 0.5
+# ... or when the throughput of a window drops by this much (ratio) while the limit did not decrease
+ADAPTIVE_CONCURRENCY_THROUGHPUT_TOLERANCE = 0.25
+ADAPTIVE_CONCURRENCY_DECREASE_FACTOR = 0.5
+# Increase of the baseline latency allowed per minute (ratio), so that it follows slower compositions
+ADAPTIVE_CONCURRENCY_BASELINE_DRIFT = 0.1
+# A window of renders left by a previous run older than this is discarded
+ADAPTIVE_CONCURRENCY_STALE_WINDOW_SECONDS = 600
+# Delays between the attempts to take a render slot
+RENDER_SLOT_POLL_MIN_SECONDS = 0.02
+RENDER_SLOT_POLL_MAX_SECONDS = 0.5
+RENDER_SLOTS_LIMIT_REFRESH_SECONDS = 0.5
+
+# Fragments of (lowercase) render errors caused by the function runtime rather than by the composition.
+# Renders failing with one of these errors are retried.
+RENDER_TRANSIENT_ERRORS = (
+    "cannot connect to the docker daemon",
+    "connection refused",
+    "connection reset by peer",
+    "context deadline exceeded",
+    "i/o timeout",
+    "tls handshake timeout",
+    "too many requests",
+    "code = unavailable",
+)
+
+# When to remove the function containers left behind by the renders: "scenario", "suite" or "off".
+# It can be overridden with the environment variable COMPOSITION_TESTER_REAP_CONTAINERS
+DEFAULT_REAP_CONTAINERS = "scenario"
+
+# Generated claims (fuzzing) settings
+CTX_FUZZ_RESULTS = "fuzz_results"
+# Maximum number of items added to arrays without maxItems
+FUZZ_MAX_ARRAY_ITEMS = 5
+# Maximum depth of the optional fields generated in nested objects
+FUZZ_MAX_DEPTH = 5
+
+# Scaling profiles settings
+CTX_PROFILES = "profiles"
+PROFILE_REPORTS_PATH = "profile_reports"
+# Number of renders per size of the swept parameter, the fastest one is kept.
+# It can be overridden with the environment variable COMPOSITION_TESTER_PROFILE_REPEATS
+DEFAULT_PROFILE_REPEATS = 1
+# Tolerance on the fitted exponent of the render time, to absorb the measurement noise
+PROFILE_EXPONENT_TOLERANCE = 0.25
+# Below this share of the render time at the largest size, the growth is considered as noise
+PROFILE_MIN_GROWTH_SHARE = 0.1
+
+# Fields added by crossplane to the spec of the claims and composite resources, not in the schema of their
+# definition (XRD). Crossplane v2 moved them under spec.crossplane.
+CROSSPLANE_SPEC_FIELDS = (
+    "compositionRef",
+    "compositionSelector",
+    "compositionRevisionRef",
+    "compositionRevisionSelector",
+    "compositionUpdatePolicy",
+    "compositeDeletePolicy",
+    "claimRef",
+    "resourceRef",
+    "resourceRefs",
+    "environmentConfigRefs",
+    "writeConnectionSecretToRef",
+    "publishConnectionDetailsTo",
+    "crossplane",
+)
+
+# Validation of the desired resources against the CRDs of the providers, for every render with the environment
+# variable COMPOSITION_TESTER_CRDS_DIRECTORY. Directory of the CRDs in the project, used by the step otherwise
+CRDS_DIRECTORY = "crds"
+# Validation results kept by resource fingerprint, cleared when full
+CRD_VALIDATION_CACHE_SIZE = 10000
+
+# Readiness exploration settings
+CTX_EXPLORATION = "exploration"
+EXPLORATION_REPORTS_PATH = "exploration_reports"
+# Maximum number of readiness states explored, when the step does not give one
+DEFAULT_EXPLORATION_MAX_STATES = 1000
+
+# Pipeline bisect settings, enabled with the environment variable COMPOSITION_TESTER_PIPELINE_BISECT
+CTX_PROVENANCE = "provenance"
+PROVENANCE_REPORTS_PATH = "provenance_reports"
+# In the temporary directory, named by content and shared by the scenarios and the test runs
+PIPELINE_PREFIXES_PATH = os.path.join(tempfile.gettempdir(), "pipeline_prefixes")
+# Renders of the pipeline prefixes kept in memory when there is no render cache on disk
+PIPELINE_PREFIX_RENDERS_CACHE_SIZE = 256
+
+# Function timings settings, enabled with the environment variable COMPOSITION_TESTER_FUNCTION_TIMINGS
+FUNCTION_RUNTIME_ANNOTATION = "render.crossplane.io/runtime"
+FUNCTION_DEVELOPMENT_TARGET_ANNOTATION = "render.crossplane.io/runtime-development-target"
+# Port of the gRPC server of the composition functions
+FUNCTION_PORT = 9443
+FUNCTION_STARTUP_TIMEOUT_SECONDS = 60
+FUNCTION_TIMINGS_PATH = "function_timings"
+
+# Checkpoints of the render iterations, used to resume failed scenarios
+CHECKPOINTS_PATH = "checkpoints"
+# Parsed feature files and step matches, reused by the next test runs
+GHERKIN_CACHE_PATH = "gherkin_cache"
+
+# Label of the function containers kept for the whole test run (or the whole life of the tester daemon),
+# which must not be reaped after each scenario
+KEEP_CONTAINER_LABEL = "xplane-composition-tester.keep"
+# Functions files rewritten to use the warm function containers
+WARM_FUNCTIONS_PATH = "warm_functions"
+
+
+# Golden snapshots of the desired resources, stored in the feature folder.
+# The snapshots are rewritten instead of checked with the environment variable COMPOSITION_TESTER_UPDATE_SNAPSHOTS
+SNAPSHOTS_DIRECTORY = "snapshots"
+# Fields of the resources that change from one render to the other, not stored in the snapshots
+# (key paths relative to a resource, * matches any list item or key)
+SNAPSHOT_VOLATILE_FIELDS = (
+    "metadata.uid",
+    "metadata.creationTimestamp",
+    "metadata.resourceVersion",
+    "metadata.generation",
+    "metadata.managedFields",
+    "status.conditions.*.lastTransitionTime",
+)
+
+# Performance baseline of the render times of the scenarios, enabled with the environment variable
+# COMPOSITION_TESTER_PERF_BASELINE. Accepted slowdown of a scenario, in percent of its baseline median.
+# It can be overridden with the environment variable COMPOSITION_TESTER_PERF_REGRESSION_THRESHOLD
+DEFAULT_PERF_REGRESSION_THRESHOLD_PERCENT = 20
+# Number of runs kept per scenario in the baseline
+PERF_BASELINE_MAX_SAMPLES = 10
+# A slowdown within this many (scaled) median absolute deviations of the baseline is considered as noise
+PERF_REGRESSION_MAD_FACTOR = 3
+# A slowdown below this duration is considered as noise, e.g. for scenarios with very fast renders
+PERF_MIN_REGRESSION_SECONDS = 0.05
@@ -0,0 +1,218 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import CRD_VALIDATION_CACHE_SIZE
+from steps.utils.schema import compile_schema
+
+_shared_crd_indexes = {}
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+CRD_FILE_SUFFIXES = (".yaml", ".yml")
+DOCUMENT_SEPARATOR = re.compile(r"^---[ \t]*$", re.MULTILINE)
+# Group and kind of a CRD, as laid out by the CRD generators (e.g. controller-gen): read from the text so that the
+# schemas of the CRDs that are not used are never parsed
+CRD_KIND_PATTERN = re.compile(r"^kind:[ \t]*[\"']?CustomResourceDefinition\b", re.MULTILINE)
+CRD_GROUP_PATTERN = re.compile(r"^spec:[ \t]*\n(?:(?:[ \t]+.*)?\n)*?  group:[ \t]*[\"']?([\w.-]+)", re.MULTILINE)
+CRD_NAMES_KIND_PATTERN = re.compile(r"^  names:[ \t]*\n(?:    .*\n|\n)*?    kind:[ \t]*[\"']?(\w+)", re.MULTILINE)
+
+
+class CrdIndex:
+    """Index of the custom resource definitions (CRDs) of a directory, e.g. the CRDs of the providers, by group and
+    kind. The files are only scanned as text to build the index, a CRD is parsed and its schema compiled only when a
+    resource of its kind is validated, once per run. The results of the validation of the resources that did not
+    change since a previous render are reused.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.signature = directory_signature(self.directory)
+        # (group, kind) -> files defining it
+        self._files = None
+        # (group, kind) -> CRD
+        self._definitions = {}
+        # (apiVersion, kind) -> validator, or message when the resources of that kind cannot be validated
+        self._validators = {}
+        # fingerprint of a resource -> violations
+        self._results = {}
+
+    def groups(self):
+        return {group for group, _ in self._index()}
+
+    def _index(self):
+        if self._files is not None:
+            return self._files
+        self._files = {}
+        for filepath in sorted(self.directory.rglob("*")):
+            if filepath.suffix not in CRD_FILE_SUFFIXES or not filepath.is_file():
+                continue
+            with open(filepath, mode="r", encoding="utf-8") as file:
+                text = file.read()
+            for document in DOCUMENT_SEPARATOR.split(text):
+                if not CRD_KIND_PATTERN.search(document):
+                    continue
+                group, kind = CRD_GROUP_PATTERN.search(document), CRD_NAMES_KIND_PATTERN.search(document)
+                if group and kind:
+                    self._files.setdefault((group.group(1), kind.group(1)), []).append(filepath)
+                else:
+                    # Not laid out as expected, the document is parsed
+                    for crd in yaml.load_all(document, Loader=Loader):
+                        key = crd_key(crd)
+                        if key:
+                            self._files.setdefault(key, []).append(filepath)
+                            self._definitions[key] = crd
+        return self._files
+
+    def definition(self, group: str, kind: str):
+        """Get the CRD of a group and kind, parsed on first use
+
+        Arguments:
+            group {str} -- API group, e.g. iam.aws.crossplane.io
+            kind {str} -- kind, e.g. Role
+
+        Returns:
+            dict -- CRD, None if the directory has none for that group and kind
+        """
+        key = (group, kind)
+        if key in self._definitions:
+            return self._definitions[key]
+        definition = None
+        for filepath in self._index().get(key, []):
+            with open(filepath, mode="r", encoding="utf-8") as file:
+                for crd in yaml.load_all(file, Loader=Loader):
+                    crd_definition_key = crd_key(crd)
+                    if crd_definition_key:
+                        self._definitions.setdefault(crd_definition_key, crd)
+                    if crd_definition_key == key:
+                        definition = crd
+        self._definitions[key] = definition
+        return definition
+
+    def validator(self, api_version: str, kind: str):
+        """Get the validator of the resources of an apiVersion and kind, compiled once
+
+        Arguments:
+            api_version {str} -- apiVersion, e.g. iam.aws.crossplane.io/v1beta1
+            kind {str} -- kind, e.g. Role
+
+        Returns:
+            callable -- validator (see compile_schema), or str describing why the resources cannot be validated,
+                None if the group has no CRD in the directory
+        """
+        key = (api_version, kind)
+        if key in self._validators:
+            return self._validators[key]
+
+        group, _, version = api_version.rpartition("/")
+        definition = self.definition(group, kind)
+        if definition is None:
+            known_kinds = sorted(k for g, k in self._index() if g == group)
+            validator = (f"no CRD of kind {kind} in group {group} (known: {', '.join(known_kinds)})"
+                         if known_kinds else None)
+        else:
+            versions = {v.get("name"): v for v in (definition.get("spec") or {}).get("versions") or []}
+            selected = versions.get(version)
+            if selected is None:
+                validator = f"version {version} is not defined by the CRD (defined: {', '.join(versions)})"
+            elif not selected.get("served", True):
+                validator = f"version {version} is not served by the CRD"
+            else:
+                validator = compile_schema((selected.get("schema") or {}).get("openAPIV3Schema") or {})
+        self._validators[key] = validator
+        return validator
+
+    def validate(self, resources: dict, fingerprints: dict = None):
+        """Validate resources against their CRDs, in one batch. The resources are grouped by apiVersion and kind,
+        so that the validator of each is looked up once. The resources of a group without CRD in the directory
+        (e.g. composite resources, or a provider whose CRDs are not in the directory) are not validated.
+
+        Arguments:
+            resources {dict} -- resources by name
+
+        Keyword Arguments:
+            fingerprints {dict} -- fingerprints of the resources by name, the violations of a resource are reused
+                when its fingerprint did not change (default: {None})
+
+        Returns:
+            tuple -- (violations: list[str] with the name of the resource, number of validated resources)
+        """
+        fingerprints = fingerprints or {}
+        by_kind = {}
+        for name, resource in resources.items():
+            by_kind.setdefault((str(resource.get("apiVersion")), str(resource.get("kind"))), []).append(name)
+
+        violations = []
+        validated = 0
+        for (api_version, kind), names in by_kind.items():
+            validator = self.validator(api_version, kind)
+            if validator is None:
+                continue
+            for name in names:
+                validated += 1
+                if isinstance(validator, str):
+                    violations.append(f"{name} ({api_version} {kind}): {validator}")
+                    continue
+                fingerprint = fingerprints.get(name)
+                resource_violations = self._results.get(fingerprint) if fingerprint is not None else None
+                if resource_violations is None:
+                    resource_violations = []
+                    resource = resources[name]
+                    validator({key: value for key, value in resource.items() if key not in ("apiVersion", "kind",
+                                                                                            "metadata")},
+                              "", resource_violations)
+                    if fingerprint is not None:
+                        if len(self._results) >= CRD_VALIDATION_CACHE_SIZE:
+                            self._results.clear()
+                        self._results[fingerprint] = resource_violations
+                violations += [f"{name} ({kind}): {violation}" for violation in resource_violations]
+        return violations, validated
+
+
+def crd_key(crd):
+    if not isinstance(crd, dict) or crd.get("kind") != "CustomResourceDefinition":
+        return None
+    spec = crd.get("spec") or {}
+    return spec.get("group"), (spec.get("names") or {}).get("kind")
+
+
+def directory_signature(directory: Path):
+    signature = []
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.endswith(CRD_FILE_SUFFIXES):
+                stat = os.stat(os.path.join(root, filename))
+                signature.append((root, filename, stat.st_mtime, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def shared_crd_index(directory):
+    """Get the CRD index of a directory for the process. In a long running process (e.g. the tester daemon), the
+    index, the parsed CRDs and the compiled validators are kept until a file of the directory changes.
+
+    Arguments:
+        directory {str} -- directory of the CRDs
+
+    Returns:
+        CrdIndex -- CRD index
+    """
+    key = os.path.abspath(directory)
+    crd_index = _shared_crd_indexes.get(key)
+    if crd_index is None or crd_index.signature != directory_signature(Path(directory)):
+        crd_index = _shared_crd_indexes[key] = CrdIndex(directory)
+    return crd_index
@@ -0,0 +1,371 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+
+from steps.utils.observed import Dumper, deep_update
+from steps.utils.render import RenderTimeoutError
+from steps.utils.snapshots import canonical, content_hash
+from steps.utils.utils import create_fake_status_conditions, parse_desired_output
+
+# Label of the transition rendering again without any new ready resource
+RENDER_AGAIN = "render again"
+# Maximum number of states reported per kind of problem
+MAX_REPORTED_STATES = 10
+
+
+@dataclass
+class ExplorationState:
+    """Observed state of a render reached by the exploration: the desired resources of the previous render, with
+    the resources that are ready"""
+    key: str
+    ready: frozenset
+    depth: int
+    # (key of the previous state, label of the transition) on the first path found to this state
+    parent: tuple = None
+    # Names of the desired resources of its render, None if it was not rendered
+    desired: tuple = None
+    # Hash of the desired resources of its render, see steps.utils.snapshots.content_hash
+    outcome: str = None
+    error: str = None
+    # label of the transition -> key of the next state
+    successors: dict = field(default_factory=dict)
+
+
+@dataclass
+class ExplorationResult:
+    """Reachable state graph of the readiness of the desired resources, with its problems"""
+    states: dict = field(default_factory=dict)
+    initial: str = None
+    renders: int = 0
+    # False when the exploration stopped at the maximum number of states
+    complete: bool = True
+    converged: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+    non_converging: list = field(default_factory=list)
+    unreachable: list = field(default_factory=list)
+    # outcome -> keys of the converged states with that outcome
+    outcomes: dict = field(default_factory=dict)
+
+    def path(self, key: str):
+        """Get the transitions of the first path found from the initial state to a state
+
+        Arguments:
+            key {str} -- key of the state
+
+        Returns:
+            list[str] -- labels of the transitions
+        """
+        labels = []
+        state = self.states[key]
+        while state.parent is not None:
+            key, label = state.parent
+            labels.append(label)
+            state = self.states[key]
+        return labels[::-1]
+
+    def summary(self):
+        return (f"{len(self.states)} readiness states explored with {self.renders} renders"
+                f"{'' if self.complete else ' (incomplete)'}: {len(self.converged)} converged states with "
+                f"{len(self.outcomes)} outcomes, {len(self.failed)} failed, {len(self.non_converging)} "
+                f"non-converging, {len(self.unreachable)} that cannot converge")
+
+    def problems(self):
+        """Describe the problems found by the exploration: failed renders, states on a cycle, states from which no
+        converged state is reachable, several converged outcomes, or an incomplete exploration
+
+        Returns:
+            list[str] -- one message per problem, with the path to the state
+        """
+        problems = []
+        if not self.complete:
+            problems.append(f"the exploration stopped after {len(self.states)} states, raise the maximum number "
+                            f"of states to explore all the readiness orderings")
+        for keys, description in ((self.failed, "render failed"),
+                                  (self.non_converging, "desired resources change in a cycle"),
+                                  (self.unreachable, "no readiness ordering converges from this state")):
+            for key in keys[:MAX_REPORTED_STATES]:
+                state = self.states[key]
+                # The last line of the error is the most specific one, e.g. the exception of a traceback
+                detail = f": {state.error.strip().splitlines()[-1]}" if state.error and state.error.strip() else ""
+                problems.append(f"{description} after {self._format_path(key)}{detail}")
+            if len(keys) > MAX_REPORTED_STATES:
+                problems.append(f"... and {len(keys) - MAX_REPORTED_STATES} more states where {description}")
+        if len(self.outcomes) > 1:
+            for outcome, keys in self.outcomes.items():
+                state = self.states[keys[0]]
+                problems.append(f"divergent outcome with resources {sorted(state.desired)} ({len(keys)} converged "
+                                f"states) after {self._format_path(keys[0])}")
+        return problems
+
+    def _format_path(self, key: str):
+        return " -> ".join(["first render"] + self.path(key))
+
+
+def explore_readiness(resources: dict, updates, render, observed_directory, workers: int, max_states: int):
+    """Explore the orderings in which the desired resources become ready, breadth first from the desired resources
+    of a render. A state is the observed state of a render: the desired resources of the previous render, with the
+    changes of the steps (e.g. status.atProvider fields) and the ready resources. From each state, the next states
+    are the one where the render runs again, and one per desired resource that is not ready yet and becomes ready.
+    Resources stay ready once they are.
+
+    The states are identified by the hash of their observed state, so that a state reached by several orderings is
+    rendered once and its successors are not explored again. The states of a level are rendered concurrently with a
+    bounded pool of workers.
+
+    Arguments:
+        resources {dict} -- desired resources of the first render, by resource name
+        updates {dict} -- changes of the steps to overlay on the observed resources, by resource name
+        render {callable} -- render(observed_filepath) -> subprocess.CompletedProcess of the render with the observed
+            state, may raise RenderTimeoutError
+        observed_directory {str} -- directory where the observed states are written while they are rendered
+        workers {int} -- maximum number of renders running at the same time
+        max_states {int} -- maximum number of states to explore
+
+    Returns:
+        ExplorationResult -- state graph and its problems
+    """
+    directory = Path(observed_directory)
+    directory.mkdir(exist_ok=True, parents=True)
+    updates = updates or {}
+    result = ExplorationResult()
+
+    def add_state(desired: dict, ready: frozenset, depth: int, parent: tuple = None):
+        content = observed_state(desired, updates, ready)
+        key = hashlib.blake2b(content, digest_size=16).hexdigest()
+        if key in result.states:
+            return key, None
+        if len(result.states) >= max_states:
+            result.complete = False
+            return key, None
+        with open(directory / f"{key}.yaml", mode="wb") as file:
+            file.write(content)
+        result.states[key] = ExplorationState(key, ready, depth, parent)
+        return key, result.states[key]
+
+    def render_state(state: ExplorationState):
+        observed_filepath = directory / f"{state.key}.yaml"
+        try:
+            return render(str(observed_filepath))
+        except RenderTimeoutError as e:
+            return e
+        finally:
+            observed_filepath.unlink()
+
+    overlaid = {name: deep_update(copy.deepcopy(resource), updates[name]) if name in updates else resource
+                for name, resource in resources.items()}
+    result.initial, initial = add_state(resources, frozenset(name for name, resource in overlaid.items()
+                                                             if is_ready(resource)), 0)
+    frontier = [initial]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while frontier:
+            next_frontier = []
+            for state, out in zip(frontier, executor.map(render_state, frontier)):
+                result.renders += 1
+                if isinstance(out, RenderTimeoutError) or out.returncode != 0:
+                    state.error = str(out) if isinstance(out, RenderTimeoutError) else out.stderr or "render failed"
+                    continue
+                try:
+                    _, desired = parse_desired_output(out.stdout)
+                except AssertionError as e:
+                    state.error = str(e)
+                    continue
+                state.desired = tuple(sorted(desired))
+                state.outcome = content_hash(canonical(desired))
+
+                ready = state.ready & desired.keys()
+                transitions = [(RENDER_AGAIN, ready)] + [(f"{name} ready", ready | {name})
+                                                         for name in state.desired if name not in ready]
+                for label, next_ready in transitions:
+                    key, next_state = add_state(desired, frozenset(next_ready), state.depth + 1, (state.key, label))
+                    state.successors[label] = key
+                    if next_state is not None:
+                        next_frontier.append(next_state)
+            frontier = next_frontier
+
+    analyze(result)
+    return result
+
+
+def observed_state(resources: dict, updates, ready: frozenset):
+    """Serialize an observed state: the resources with the changes of the steps, and the status conditions of the
+    ready and not ready resources
+
+    Arguments:
+        resources {dict} -- desired resources, by resource name
+        updates {dict} -- changes of the steps, by resource name
+        ready {frozenset} -- names of the ready resources
+
+    Returns:
+        bytes -- content of the observed file
+    """
+    chunks = []
+    for name in sorted(resources):
+        resource = copy.deepcopy(resources[name])
+        if name in updates:
+            resource = deep_update(resource, updates[name])
+        status = dict(resource.get("status") or {})
+        status["conditions"] = create_fake_status_conditions(ready=name in ready, synced=name in ready)
+        resource["status"] = status
+        chunks.append(yaml.dump(resource, Dumper=Dumper, encoding="utf-8"))
+    return b"---\n".join(chunks)
+
+
+def is_ready(resource):
+    conditions = (resource.get("status") or {}).get("conditions") or []
+    return any(isinstance(condition, dict) and condition.get("type") == "Ready" and condition.get("status") == "True"
+               for condition in conditions)
+
+
+def analyze(result: ExplorationResult):
+    """Find the converged states, the failed ones, the ones on a cycle and the ones from which no converged state is
+    reachable. A state is converged when all its desired resources are ready and rendering again does not change
+    its observed state.
+
+    Arguments:
+        result {ExplorationResult} -- result of the exploration, updated
+    """
+    states = result.states
+    result.failed = [key for key, state in states.items() if state.error is not None]
+    result.converged = [key for key, state in states.items()
+                        if state.desired is not None and state.successors.get(RENDER_AGAIN) == key
+                        and state.ready >= set(state.desired)]
+    result.outcomes = {}
+    for key in result.converged:
+        result.outcomes.setdefault(states[key].outcome, []).append(key)
+
+    # The states not explored (beyond the maximum number of states) may converge
+    predecessors = {}
+    reached = list(result.converged)
+    for key, state in states.items():
+        for successor in state.successors.values():
+            if successor not in states:
+                reached.append(key)
+            elif successor != key:
+                predecessors.setdefault(successor, []).append(key)
+    reached = set(reached)
+    pending = list(reached)
+    while pending:
+        for predecessor in predecessors.get(pending.pop(), []):
+            if predecessor not in reached:
+                reached.add(predecessor)
+                pending.append(predecessor)
+    result.unreachable = [key for key, state in states.items() if key not in reached and state.error is None]
+    result.non_converging = [key for component in strongly_connected_components(states) if len(component) > 1
+                             for key in component]
+
+
+def strongly_connected_components(states: dict):
+    """Find the strongly connected components of the state graph, with an iterative Tarjan algorithm
+
+    Arguments:
+        states {dict} -- states by key
+
+    Returns:
+        list[list[str]] -- keys of the states of each component
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in states:
+        if root in index:
+            continue
+        work = [(root, iter(states[root].successors.values()))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            key, successors = work[-1]
+            for successor in successors:
+                if successor not in states:
+                    continue
+                if successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(states[successor].successors.values())))
+                    break
+                if successor in on_stack:
+                    low[key] = min(low[key], index[successor])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[key])
+                if low[key] == index[key]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == key:
+                            break
+                    components.append(component)
+    return components
+
+
+def write_exploration_report(filepath_prefix, result: ExplorationResult):
+    """Write the state graph as JSON and as a Graphviz DOT graph
+
+    Arguments:
+        filepath_prefix {str} -- path of the report files, without extension
+        result {ExplorationResult} -- result of the exploration
+
+    Returns:
+        list -- paths of the written files
+    """
+    filepath_prefix = Path(filepath_prefix)
+    filepath_prefix.parent.mkdir(exist_ok=True, parents=True)
+    kinds = {}
+    for kind in ("converged", "non_converging", "unreachable", "failed"):
+        for key in getattr(result, kind):
+            kinds[key] = kind
+
+    json_filepath = filepath_prefix.with_suffix(".json")
+    with open(json_filepath, mode="w", encoding="utf-8") as file:
+        json.dump({
+            "summary": result.summary(),
+            "complete": result.complete,
+            "initial": result.initial,
+            "problems": result.problems(),
+            "states": [{"key": key, "kind": kinds.get(key), "depth": state.depth, "ready": sorted(state.ready),
+                        "desired": list(state.desired or []), "outcome": state.outcome, "error": state.error,
+                        "path": result.path(key)}
+                       for key, state in result.states.items()],
+            "transitions": [{"from": key, "to": successor, "label": label}
+                            for key, state in result.states.items() for label, successor in state.successors.items()],
+        }, file, indent=2)
+
+    colors = {"converged": "palegreen", "non_converging": "orange", "unreachable": "lightgrey", "failed": "salmon"}
+    dot_filepath = filepath_prefix.with_suffix(".dot")
+    with open(dot_filepath, mode="w", encoding="utf-8") as file:
+        file.write("digraph readiness {\n  node [shape=box, style=filled, fillcolor=white];\n")
+        for key, state in result.states.items():
+            label = "\\n".join(sorted(state.ready)) or "nothing ready"
+            file.write(f'  "{key}" [label="{label}", fillcolor={colors.get(kinds.get(key), "white")}];\n')
+        for key, state in result.states.items():
+            for label, successor in state.successors.items():
+                if successor in result.states and successor != key:
+                    file.write(f'  "{key}" -> "{successor}" [label="{label}"];\n')
+        file.write("}\n")
+
+    return [json_filepath, dot_filepath]
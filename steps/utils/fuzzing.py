@@ -0,0 +1,318 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import math
+import random
+import re
+import string
+from dataclasses import dataclass, field
+
+import yaml
+
+from steps.utils.constants import FUZZ_MAX_ARRAY_ITEMS, FUZZ_MAX_DEPTH
+from steps.utils.render import run_renders
+from steps.utils.utils import build_render_args, dump_yaml_to_file, parse_desired_output
+
+# Characters used to generate strings: valid in most kubernetes names and label values
+NAME_CHARACTERS = string.ascii_lowercase + string.digits
+# Number of attempts to generate a string matching a pattern before falling back to the default or example value
+PATTERN_ATTEMPTS = 20
+# Number of attempts to generate an item not yet in an array with unique items
+UNIQUE_ITEM_ATTEMPTS = 20
+# Range of the generated numbers when a bound is not set in the schema
+NUMBER_RANGE = 100
+# Decimal digits of the generated numbers, and the smallest step above or below an exclusive bound
+NUMBER_DIGITS = 3
+
+
+@dataclass
+class FuzzResult:
+    """Result of the render of a generated claim"""
+    seed: int
+    claim_filepath: str
+    returncode: int
+    error: str = ""
+    desired_xr: dict = None
+    desired_resources: dict = field(default_factory=dict)
+
+    @property
+    def failed(self):
+        return self.returncode != 0
+
+
+def load_definition_schema(definition_filepath, api_version: str = None):
+    """Load the openAPIV3Schema of a composite resource definition (XRD)
+
+    Arguments:
+        definition_filepath {str} -- path to the XRD
+
+    Keyword Arguments:
+        api_version {str} -- apiVersion of the claim, used to select the XRD version. If None or not found,
+            the referenceable version is used (default: {None})
+
+    Raises:
+        AssertionError: no schema found in the XRD
+
+    Returns:
+        dict -- openAPIV3Schema
+    """
+    with open(definition_filepath, mode="r", encoding="utf-8") as file:
+        definition = yaml.safe_load(file)
+
+    versions = definition.get("spec", {}).get("versions", [])
+    version_name = api_version.split("/")[-1] if api_version else None
+    selected = next((v for v in versions if v.get("name") == version_name), None)
+    if selected is None:
+        selected = next((v for v in versions if v.get("referenceable")), versions[0] if versions else None)
+
+    schema = (selected or {}).get("schema", {}).get("openAPIV3Schema")
+    assert schema is not None, f"no openAPIV3Schema found in definition {definition_filepath}"
+    return schema
+
+
+def render_generated_claims(base_claim: dict, schema: dict, seeds, claims_directory, composition_filepath,
+                            functions_filepath, envconfig_filepath, workers: int, validate=None, **render_kwargs):
+    """Generate one claim per seed and render them all with a bounded pool of workers
+
+    Arguments:
+        base_claim {dict} -- claim to take the apiVersion, kind and metadata from
+        schema {dict} -- openAPIV3Schema of the XRD
+        seeds {list[int]} -- seeds of the claims to generate
+        claims_directory {str} -- directory where the generated claims are dumped
+        composition_filepath {str} -- path to the composition
+        functions_filepath {str} -- path to the functions
+        envconfig_filepath {str} -- path to the environment config
+        workers {int} -- maximum number of renders running at the same time
+
+    Keyword Arguments:
+        validate {callable} -- validates a generated claim against the XRD, see generate_claim (default: {None})
+        render_kwargs -- keyword arguments passed to run_render (timeout, retries, backoff, watchdog, metrics)
+
+    Raises:
+        AssertionError: a generated claim is not valid against the XRD
+
+    Returns:
+        list[FuzzResult] -- results of the renders, in the same order as the seeds
+    """
+    claims_filepaths = []
+    for seed in seeds:
+        claim_filepath = f"{claims_directory}/claim_seed_{seed}.yaml"
+        dump_yaml_to_file(claim_filepath, generate_claim(base_claim, schema, seed, validate=validate))
+        claims_filepaths.append(claim_filepath)
+
+    outputs = run_renders(
+        [build_render_args(claim_filepath, composition_filepath, functions_filepath, envconfig_filepath)
+         for claim_filepath in claims_filepaths],
+        workers,
+        **render_kwargs,
+    )
+
+    results = []
+    for seed, claim_filepath, out in zip(seeds, claims_filepaths, outputs):
+        result = FuzzResult(seed, claim_filepath, out.returncode, error=out.stderr)
+        if out.returncode == 0:
+            try:
+                result.desired_xr, result.desired_resources = parse_desired_output(out.stdout)
+            except AssertionError as e:
+                result.returncode, result.error = -1, str(e)
+        results.append(result)
+    return results
+
+
+def generate_claim(base_claim: dict, schema: dict, seed: int, validate=None):
+    """Generate a claim that is valid against the XRD schema. The apiVersion, kind and metadata are taken from the
+    base claim, the spec is generated from the schema. The same seed always generates the same claim.
+
+    Arguments:
+        base_claim {dict} -- claim to take the apiVersion, kind and metadata from
+        schema {dict} -- openAPIV3Schema of the XRD
+        seed {int} -- seed of the generator
+
+    Keyword Arguments:
+        validate {callable} -- returns the violations of the XRD schema by a claim (see ProjectIndex.validate_claim).
+            An invalid claim is a bug of the generator, not a failure of the composition (default: {None})
+
+    Raises:
+        AssertionError: no valid value can be generated for a field, or the generated claim is not valid
+
+    Returns:
+        dict -- generated claim
+    """
+    rng = random.Random(seed)
+    claim = {key: copy.deepcopy(base_claim[key]) for key in ("apiVersion", "kind", "metadata") if key in base_claim}
+    spec_schema = schema.get("properties", {}).get("spec")
+    if spec_schema is not None:
+        claim["spec"] = generate_value(spec_schema, rng)
+    if validate is not None:
+        violations = validate(claim)
+        assert not violations, (f"bug in the claim generator: the claim generated with seed {seed} is not valid "
+                                f"against the definition:\n" + "\n".join(violations))
+    return claim
+
+
+def generate_value(schema: dict, rng: random.Random, depth: int = 0):
+    """Generate a random value that is valid against an OpenAPI v3 schema. The required properties are always
+    generated, the optional ones are generated half of the time.
+
+    Arguments:
+        schema {dict} -- OpenAPI v3 schema
+        rng {random.Random} -- random generator
+
+    Keyword Arguments:
+        depth {int} -- depth of the value in the generated object (default: {0})
+
+    Returns:
+        object -- generated value
+    """
+    if "enum" in schema:
+        return copy.deepcopy(rng.choice(schema["enum"]))
+
+    value_type = schema.get("type")
+    if value_type is None:
+        if "properties" in schema or "additionalProperties" in schema:
+            value_type = "object"
+        elif "items" in schema:
+            value_type = "array"
+        elif schema.get("x-kubernetes-int-or-string"):
+            value_type = rng.choice(["integer", "string"])
+        else:
+            value_type = "string"
+
+    if value_type == "object":
+        return generate_object(schema, rng, depth)
+    if value_type == "array":
+        return generate_array(schema, rng, depth)
+    if value_type == "integer":
+        return generate_integer(schema, rng)
+    if value_type == "number":
+        return generate_number(schema, rng)
+    if value_type == "boolean":
+        return rng.random() < 0.5
+    return generate_string(schema, rng)
+
+
+def generate_object(schema: dict, rng: random.Random, depth: int):
+    properties = schema.get("properties")
+    if properties is None:
+        # Free-form object (map): generate a few entries if their schema is known
+        additional = schema.get("additionalProperties")
+        if not isinstance(additional, dict) or depth >= FUZZ_MAX_DEPTH:
+            return {}
+        return {generate_string({"minLength": 1}, rng): generate_value(additional, rng, depth + 1)
+                for _ in range(rng.randint(0, 3))}
+
+    required = set(schema.get("required", []))
+    result = {}
+    for name, property_schema in properties.items():
+        if name in required or (depth < FUZZ_MAX_DEPTH and rng.random() < 0.5):
+            result[name] = generate_value(property_schema, rng, depth + 1)
+    return result
+
+
+def generate_array(schema: dict, rng: random.Random, depth: int):
+    min_items = schema.get("minItems", 0)
+    max_items = schema.get("maxItems", min_items + FUZZ_MAX_ARRAY_ITEMS)
+    items_schema = schema.get("items", {})
+    length = rng.randint(min_items, max_items)
+    items = []
+    attempts = 0
+    while len(items) < length:
+        item = generate_value(items_schema, rng, depth + 1)
+        if schema.get("uniqueItems") and item in items:
+            # More unique items may not exist (e.g. small enum): give up once the minimum is reached
+            attempts += 1
+            if attempts >= UNIQUE_ITEM_ATTEMPTS:
+                assert len(items) >= min_items, (f"no {min_items} unique items generated after {attempts} "
+                                                 f"attempts for schema {schema}")
+                break
+            continue
+        items.append(item)
+    return items
+
+
+def generate_integer(schema: dict, rng: random.Random):
+    minimum, maximum = number_bounds(schema, 1)
+    # Favor the boundaries, where most bugs are
+    value = rng.choice([minimum, maximum, rng.randint(minimum, maximum)])
+    return int(closest_multiple(schema, value, minimum, maximum))
+
+
+def generate_number(schema: dict, rng: random.Random):
+    minimum, maximum = number_bounds(schema, 10 ** -NUMBER_DIGITS)
+    value = rng.choice([minimum, maximum, rng.uniform(minimum, maximum)])
+    if schema.get("multipleOf"):
+        return closest_multiple(schema, value, minimum, maximum)
+    # Rounding may cross a bound, e.g. a maximum with more digits
+    return min(max(round(value, NUMBER_DIGITS), minimum), maximum)
+
+
+def number_bounds(schema: dict, step):
+    """Range of the values allowed by the schema of an integer or a number. A missing bound is derived from the
+    other one, or the range starts at 0 if none is set.
+
+    Arguments:
+        schema {dict} -- openAPIV3Schema of the value
+        step {int|float} -- step above or below an exclusive bound
+
+    Raises:
+        AssertionError: the range is empty
+
+    Returns:
+        tuple -- minimum and maximum, included
+    """
+    minimum = schema.get("minimum")
+    maximum = schema.get("maximum")
+    if minimum is None:
+        minimum = 0 if maximum is None else maximum - NUMBER_RANGE
+    if maximum is None:
+        maximum = minimum + NUMBER_RANGE
+    if schema.get("exclusiveMinimum"):
+        minimum += step
+    if schema.get("exclusiveMaximum"):
+        maximum -= step
+    assert minimum <= maximum, f"no value between {minimum} and {maximum} in schema {schema}"
+    return minimum, maximum
+
+
+def closest_multiple(schema: dict, value, minimum, maximum):
+    multiple_of = schema.get("multipleOf")
+    if not multiple_of:
+        return value
+    # The closest multiple at or above the value, or at or below the maximum
+    value = math.ceil(value / multiple_of) * multiple_of
+    if value > maximum:
+        value = math.floor(maximum / multiple_of) * multiple_of
+    assert minimum <= value <= maximum, (f"no multiple of {multiple_of} between {minimum} and {maximum} "
+                                         f"in schema {schema}")
+    return value
+
+
+def generate_string(schema: dict, rng: random.Random):
+    min_length = schema.get("minLength", 0)
+    max_length = max(min_length, schema.get("maxLength", min_length + 20))
+    pattern = schema.get("pattern")
+
+    for _ in range(PATTERN_ATTEMPTS if pattern else 1):
+        length = rng.choice([min_length, max_length, rng.randint(min_length, max_length)])
+        value = "".join(rng.choice(NAME_CHARACTERS) for _ in range(length))
+        if not pattern or re.search(pattern, value):
+            return value
+
+    # The pattern is too specific to be matched by chance: use the default or example value if any
+    for key in ("default", "example"):
+        if key in schema:
+            return schema[key]
+    raise AssertionError(f"no string matching pattern {pattern} generated after {PATTERN_ATTEMPTS} attempts, "
+                         f"add a default or an example to the schema")
@@ -0,0 +1,204 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import copyreg
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import behave
+from behave import parser
+from behave.matchers import Match
+from behave.model import Tag
+from behave.step_registry import StepRegistry
+
+CACHE_VERSION = f"gherkin-cache-v1-behave-{behave.__version__}"
+# Directory of the step modules, whose content is part of the key of the step matches
+STEPS_DIRECTORY = Path(__file__).resolve().parents[1]
+# Cached step match of an undefined step
+UNDEFINED = None
+_MISSING = object()
+
+# Tags are strings with a line number, which pickle cannot rebuild by default
+_dispatch_table = copyreg.dispatch_table.copy()
+_dispatch_table[Tag] = lambda tag: (Tag, (str(tag), tag.line))
+
+
+class GherkinCache:
+    """Parsed feature files and step matches on disk. A feature file is only parsed again when its content changed,
+    and a step text is only matched against the step definitions again when a step module changed, so that a test run
+    does not parse and match the whole project again, e.g. with --dry-run or when the tags select a few scenarios.
+    The cache can be shared by several processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.steps_digest = steps_digest()
+        # (step type, step text) -> (location of the step definition, arguments), UNDEFINED if no definition matches
+        self._matches = None
+        self._new_matches = False
+        # registry, and its step definitions by location once the step modules are loaded
+        self._step_definitions = (None, None)
+
+    def parse_file(self, filename, language=None, parse=None):
+        """Get a parsed feature file from the cache, or parse it and store it in the cache
+
+        Arguments:
+            filename {str} -- path to the feature file
+
+        Keyword Arguments:
+            language {str} -- language of the feature file (default: {None})
+            parse {callable} -- parser of the feature files (default: {behave.parser.parse_file})
+
+        Returns:
+            behave.model.Feature -- feature, None if the file is empty
+        """
+        with open(filename, mode="rb") as file:
+            content = file.read()
+        digest = hashlib.blake2b(CACHE_VERSION.encode(), digest_size=20)
+        for part in (str(filename).encode(), str(language).encode(), content):
+            digest.update(b"\0" + part)
+        filepath = self.directory / "features" / f"{digest.hexdigest()}.pickle"
+
+        try:
+            with open(filepath, mode="rb") as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass
+        feature = (parse or parser.parse_file)(filename, language=language)
+        self._write(filepath, feature)
+        return feature
+
+    def find_match(self, step_registry, step, find_match):
+        """Get the match of a step from the cache, or match it and store it in the cache. The arguments of the match
+        are cached, the step definition is looked up by location in the registry.
+
+        Arguments:
+            step_registry {behave.step_registry.StepRegistry} -- registry of the steps
+            step {behave.model.Step} -- step
+            find_match {callable} -- matcher of the steps of the registry
+
+        Returns:
+            behave.matchers.Match -- match of the step, None if the step is undefined
+        """
+        matches = self.matches()
+        key = (step.step_type, step.name)
+        cached = matches.get(key, _MISSING)
+        if cached is UNDEFINED:
+            return None
+        if cached is not _MISSING:
+            step_definition = self.step_definitions(step_registry).get(cached[0])
+            if step_definition is not None:
+                return Match(step_definition.func, cached[1])
+
+        match = find_match(step)
+        matches[key] = UNDEFINED if match is None else (str(match.location), match.arguments)
+        self._new_matches = True
+        return match
+
+    def step_definitions(self, step_registry):
+        if self._step_definitions[0] is not step_registry:
+            self._step_definitions = (step_registry, {str(step_definition.location): step_definition
+                                                      for step_definitions in step_registry.steps.values()
+                                                      for step_definition in step_definitions})
+        return self._step_definitions[1]
+
+    def matches(self):
+        """Load the step matches of the current step modules
+
+        Returns:
+            dict -- matches by step type and text
+        """
+        if self._matches is None:
+            try:
+                with open(self._matches_filepath(), mode="rb") as file:
+                    self._matches = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                self._matches = {}
+        return self._matches
+
+    def save(self):
+        """Write the step matches found since they were loaded, merged with the ones written by other processes"""
+        if not self._new_matches:
+            return
+        self._new_matches = False
+        matches = self._matches
+        self._matches = None
+        self._matches = {**self.matches(), **matches}
+        self._write(self._matches_filepath(), self._matches)
+
+    def _matches_filepath(self):
+        return self.directory / f"matches-{self.steps_digest}.pickle"
+
+    @staticmethod
+    def _write(filepath, value):
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.dispatch_table = _dispatch_table
+        try:
+            pickler.dump(value)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+        with os.fdopen(fd, mode="wb") as file:
+            file.write(buffer.getvalue())
+        os.replace(tmp_filepath, filepath)
+
+
+def steps_digest():
+    """Hash the step modules, so that the step matches are matched again when a step definition changes
+
+    Returns:
+        str -- hash of the step modules
+    """
+    digest = hashlib.blake2b(CACHE_VERSION.encode(), digest_size=20)
+    for filepath in sorted(STEPS_DIRECTORY.rglob("*.py")):
+        digest.update(b"\0" + str(filepath.relative_to(STEPS_DIRECTORY)).encode() + b"\0")
+        digest.update(filepath.read_bytes())
+    return digest.hexdigest()
+
+
+_installed_cache = None
+
+
+def install_gherkin_cache(directory):
+    """Route the parsing of the feature files and the matching of the steps through a cache, once per process,
+    e.g. the tester daemon keeps it across test runs. The step registries are patched by class, since behave
+    replaces the module registry at each run. The step matches are saved when the process exits, see also
+    GherkinCache.save.
+
+    Arguments:
+        directory {str} -- directory of the cache
+
+    Returns:
+        GherkinCache -- cache
+    """
+    global _installed_cache
+    if _installed_cache is not None:
+        return _installed_cache
+    cache = GherkinCache(directory)
+
+    parse_file = parser.parse_file
+    parser.parse_file = lambda filename, language=None: cache.parse_file(filename, language, parse_file)
+    find_match = StepRegistry.find_match
+    StepRegistry.find_match = lambda self, step: cache.find_match(self, step, find_match.__get__(self))
+    atexit.register(cache.save)
+
+    _installed_cache = cache
+    return cache
@@ -0,0 +1,115 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from steps.utils.constants import INDEXED_ANNOTATIONS
+
+
+class DesiredResourcesIndex:
+    """Secondary indexes of the desired resources, built once per render.
+
+    The desired resources are keyed by their composition resource name. This class indexes these names
+    by kind, apiVersion, labels and a selection of annotations, so that selecting resources costs a dict
+    lookup instead of a scan of all the desired resources.
+    """
+
+    def __init__(self, desired_resources: dict, annotations=INDEXED_ANNOTATIONS):
+        self.by_kind = {}
+        self.by_api_version = {}
+        # label key -> names and (label key, label value) -> names
+        self.by_label = {}
+        # annotation key -> names and (annotation key, annotation value) -> names
+        self.by_annotation = {}
+
+        indexed_annotations = set(annotations)
+        for name, resource in desired_resources.items():
+            self.by_kind.setdefault(resource.get("kind"), []).append(name)
+            self.by_api_version.setdefault(resource.get("apiVersion"), []).append(name)
+
+            metadata = resource.get("metadata") or {}
+            for key, value in (metadata.get("labels") or {}).items():
+                self.by_label.setdefault(key, []).append(name)
+                self.by_label.setdefault((key, value), []).append(name)
+
+            for key, value in (metadata.get("annotations") or {}).items():
+                if key in indexed_annotations:
+                    self.by_annotation.setdefault(key, []).append(name)
+                    self.by_annotation.setdefault((key, value), []).append(name)
+
+    def with_kind(self, kind: str):
+        """Get the names of the resources of the given kind
+
+        Arguments:
+            kind {str} -- resource kind
+
+        Returns:
+            list -- resource names
+        """
+        return self.by_kind.get(kind, [])
+
+    def with_api_version(self, api_version: str):
+        """Get the names of the resources with the given apiVersion
+
+        Arguments:
+            api_version {str} -- resource apiVersion
+
+        Returns:
+            list -- resource names
+        """
+        return self.by_api_version.get(api_version, [])
+
+    def with_label(self, selector: str):
+        """Get the names of the resources matching a label selector
+
+        Arguments:
+            selector {str} -- label selector, either "key" or "key=value"
+
+        Returns:
+            list -- resource names
+        """
+        return self.by_label.get(parse_selector(selector), [])
+
+    def with_annotation(self, selector: str):
+        """Get the names of the resources matching an annotation selector.
+        Only the annotations in INDEXED_ANNOTATIONS can be selected.
+
+        Arguments:
+            selector {str} -- annotation selector, either "key" or "key=value"
+
+        Raises:
+            KeyError: annotation is not indexed
+
+        Returns:
+            list -- resource names
+        """
+        key = parse_selector(selector)
+        annotation = key[0] if isinstance(key, tuple) else key
+        if annotation not in INDEXED_ANNOTATIONS:
+            raise KeyError(f"annotation {annotation} is not indexed, indexed annotations are {INDEXED_ANNOTATIONS}")
+        return self.by_annotation.get(key, [])
+
+
+def parse_selector(selector: str):
+    """Parse a label or annotation selector
+
+    Arguments:
+        selector {str} -- selector, either "key" or "key=value"
+
+    Returns:
+        str|tuple -- key if no value is given, else tuple of key and value
+    """
+    selector = selector.strip()
+    if "=" not in selector:
+        return selector
+    key, value = selector.split("=", 1)
+    return key.strip(), value.strip()
@@ -0,0 +1,138 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import json
+import operator
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+import yaml
+
+# Value of the param value column asserting that the entry is absent
+ABSENT = "\\absent"
+# Prefix of a matcher in the param value column, e.g. {regexp}arn:aws:iam::\d+:policy/.*
+MATCHER_PREFIX = re.compile(r"^\{(regexp|glob|subset|>=|<=|>|<|==|!=)\}(.*)$", re.DOTALL)
+NUMERIC_OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+@dataclass(frozen=True)
+class ValueMatcher:
+    """Matcher of a value of the param value column. Matchers are immutable and shared, see parse_matcher.
+
+    Supported values:
+    - {regexp}<pattern>: the value fully matches the regular expression
+    - {glob}<pattern>: the value matches the shell-style pattern (e.g. *, ?, [abc])
+    - {>}<number>, {>=}, {<}, {<=}, {==}, {!=}: numeric comparison of the value
+    - {subset}<json or yaml>: the value contains the given object (dict items, list items) recursively, the scalars
+      being compared as written (e.g. 3 and "3", true and "true" are equal)
+    - \\absent: the entry does not exist
+    - anything else: the value is equal to the given string
+    """
+    kind: str
+    expected: object
+    description: str
+
+    def matches(self, actual):
+        """Check if an actual value matches
+
+        Arguments:
+            actual {object} -- actual value of the entry
+
+        Returns:
+            bool -- True if the value matches
+        """
+        if self.kind in ("regexp", "glob"):
+            return self.expected.fullmatch(str(actual)) is not None
+        if self.kind in NUMERIC_OPERATORS:
+            try:
+                return NUMERIC_OPERATORS[self.kind](float(actual), self.expected)
+            except (TypeError, ValueError):
+                return False
+        if self.kind == "subset":
+            return is_subset(self.expected, actual)
+        return str(actual) == self.expected
+
+
+@lru_cache(maxsize=None)
+def parse_matcher(value: str):
+    """Parse a value of the param value column into a matcher. The matchers are cached, so that the patterns
+    are compiled only once across rows, scenarios and features.
+
+    Arguments:
+        value {str} -- value of the param value column
+
+    Raises:
+        AssertionError: the pattern or the expected value of the matcher is invalid
+
+    Returns:
+        ValueMatcher -- matcher, None for \\absent
+    """
+    if value == ABSENT:
+        return None
+
+    prefix = MATCHER_PREFIX.match(value)
+    if prefix is None:
+        return ValueMatcher("equal", value, f"value {value}")
+
+    kind, argument = prefix.groups()
+    if kind == "regexp":
+        try:
+            return ValueMatcher(kind, re.compile(argument), f"value matching regexp {argument}")
+        except re.error as e:
+            raise AssertionError(f"invalid regexp {argument}: {e}")
+    if kind == "glob":
+        return ValueMatcher(kind, re.compile(fnmatch.translate(argument)), f"value matching glob {argument}")
+    if kind == "subset":
+        try:
+            # Parsed like the render output (see CompactLoader): all the scalars are strings
+            expected = yaml.load(argument, Loader=yaml.BaseLoader)
+        except yaml.YAMLError as e:
+            raise AssertionError(f"invalid subset {argument}: {e}")
+        return ValueMatcher(kind, expected, f"value containing {argument}")
+    try:
+        return ValueMatcher(kind, float(argument), f"numeric value {kind} {argument}")
+    except ValueError:
+        raise AssertionError(f"invalid number {argument} in {value}")
+
+
+def is_subset(expected, actual):
+    """Check that the actual value contains the expected one: dicts contain the expected items, lists contain an
+    item matching each expected item, scalars are equal
+
+    Arguments:
+        expected {object} -- expected value, with string scalars
+        actual {object} -- actual value, with string scalars (render output) or typed ones (e.g. the claim)
+
+    Returns:
+        bool -- True if the actual value contains the expected one
+    """
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and is_subset(value, actual[key]) for key, value in expected.items())
+    if isinstance(expected, list):
+        return isinstance(actual, list) and all(
+            any(is_subset(item, actual_item) for actual_item in actual) for item in expected)
+    if isinstance(actual, str) or not isinstance(expected, str):
+        return expected == actual
+    # Typed scalars are compared as written in JSON, e.g. true, null or 1.0: "yes" does not match true
+    return expected == json.dumps(actual)
@@ -0,0 +1,165 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import resource
+import threading
+from pathlib import Path
+
+METRICS_PREFIX = "composition_tester_"
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+# name -> (type, unit, help) of the metrics of a test run
+METRICS = {
+    "renders": ("counter", None, "Render attempts, by result (success, failure, timeout)"),
+    "render_retries": ("counter", None, "Render attempts retried after a timeout or a transient failure"),
+    "render_duration_seconds": ("summary", "seconds", "Wall time of the render attempts"),
+    "render_output_bytes": ("counter", "bytes", "Size of the render outputs parsed"),
+    "render_parse_duration_seconds": ("summary", "seconds", "Time spent parsing the render outputs"),
+    "render_parse_peak_memory_bytes": ("summary", "bytes", "Peak memory allocated while parsing a render output"),
+    "desired_resources": ("counter", None, "Desired resources parsed from the render outputs"),
+    "crd_validation_duration_seconds": ("summary", "seconds", "Time spent validating the desired resources "
+                                                              "against the CRDs"),
+    "render_slot_wait_seconds": ("summary", "seconds", "Time the renders waited for a render slot"),
+    "render_concurrency_limit": ("gauge", None, "Limit of the renders running at the same time at the end of the run"),
+    "cache_lookups": ("counter", None, "Lookups in the caches of the tester, by cache and result (hit, miss)"),
+    "scenarios": ("counter", None, "Scenarios of the test run, by status"),
+    "steps": ("counter", None, "Steps of the test run, by status"),
+    "run_duration_seconds": ("gauge", "seconds", "Wall time of the test run"),
+    "scenarios_per_minute": ("gauge", None, "Scenarios run (i.e. not skipped) per minute"),
+    "peak_rss_bytes": ("gauge", "bytes", "Peak resident set size, of the tester or of its largest render"),
+}
+
+
+class Metrics:
+    """Counters, gauges and summaries of a test run, written in the OpenMetrics text format at the end of the run,
+    e.g. for the textfile collector of the Prometheus node exporter. The metrics can be updated from the render
+    workers at the same time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> value
+        self._values = {}
+        # name -> observed values
+        self._samples = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increment a counter
+
+        Arguments:
+            name {str} -- counter name, see METRICS
+
+        Keyword Arguments:
+            value {float} -- increment (default: {1})
+            labels -- labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge
+
+        Arguments:
+            name {str} -- gauge name, see METRICS
+            value {float} -- value
+            labels -- labels of the gauge
+        """
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float):
+        """Observe a value of a summary
+
+        Arguments:
+            name {str} -- summary name, see METRICS
+            value {float} -- observed value
+        """
+        with self._lock:
+            self._samples.setdefault(name, []).append(value)
+
+    def set_peak_rss(self):
+        """Set the peak resident set size of the tester process and of its largest child process (the renders)"""
+        # ru_maxrss is in kilobytes on linux
+        self.set("peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, process="tester")
+        self.set("peak_rss_bytes", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024, process="render")
+
+    def exposition(self):
+        """Format the metrics in the OpenMetrics text format
+
+        Returns:
+            str -- metrics
+        """
+        with self._lock:
+            values = dict(self._values)
+            samples = {name: sorted(observed) for name, observed in self._samples.items()}
+
+        lines = []
+        for name, (metric_type, unit, description) in METRICS.items():
+            family = f"{METRICS_PREFIX}{name}"
+            lines.append(f"# TYPE {family} {metric_type}")
+            if unit:
+                lines.append(f"# UNIT {family} {unit}")
+            lines.append(f"# HELP {family} {description}")
+            if metric_type == "summary":
+                observed = samples.get(name, [])
+                for q in SUMMARY_QUANTILES:
+                    if observed:
+                        lines.append(f'{family}{{quantile="{q}"}} {format_value(nearest_rank(observed, q))}')
+                lines.append(f"{family}_sum {format_value(sum(observed))}")
+                lines.append(f"{family}_count {len(observed)}")
+                continue
+            suffix = "_total" if metric_type == "counter" else ""
+            metric_values = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            for labels, value in metric_values or [((), 0)]:
+                lines.append(f"{family}{suffix}{format_labels(labels)} {format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath):
+        """Write the metrics atomically, so that a collector never reads a partial file
+
+        Arguments:
+            filepath {str} -- path to the metrics file
+        """
+        filepath = Path(filepath)
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+        tmp_filepath = filepath.with_name(f".{filepath.name}.tmp")
+        with open(tmp_filepath, mode="w", encoding="utf-8") as file:
+            file.write(self.exposition())
+        os.replace(tmp_filepath, filepath)
+
+
+def nearest_rank(values, q: float):
+    """Get a quantile of sorted values, with the nearest rank method
+
+    Arguments:
+        values {list} -- sorted values, not empty
+        q {float} -- quantile, between 0 and 1
+
+    Returns:
+        float -- quantile
+    """
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,231 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import hashlib
+import re
+from dataclasses import dataclass
+
+import yaml
+
+# Mutation operators, in the order the mutants are generated
+DROP_STEP = "drop-step"
+DROP_RESOURCE = "drop-resource"
+CHANGE_VALUE = "change-value"
+DROP_PATCH = "drop-patch"
+SWAP_READINESS = "swap-readiness"
+OPERATORS = (DROP_STEP, DROP_RESOURCE, CHANGE_VALUE, DROP_PATCH, SWAP_READINESS)
+
+MUTATED_SUFFIX = "-mutant"
+TEMPLATE_DOCUMENT_SEPARATOR = re.compile(r"^---[ \t]*$", re.MULTILINE)
+# Line of a template that is only a template action, e.g. {{ range ... }} or {{ end }}
+TEMPLATE_ACTION_LINE = re.compile(r"^\s*\{\{.*\}\}\s*$")
+# Line of a template with a literal value, e.g. "  name: providerconfig-aws"
+TEMPLATE_VALUE_LINE = re.compile(r"^(\s*-?\s*[A-Za-z_][\w./-]*:[ \t]+)([^\s{|>&*!#'\"][^{}#]*?)[ \t]*$")
+# Readiness of the resources of a template: ready annotation, or check of the Ready condition of a resource
+TEMPLATE_READINESS = re.compile(
+    r'(gotemplating\.fn\.crossplane\.io/ready:\s*"?|getResourceCondition "Ready"\)\.Status\s+")(True|False)')
+
+
+@dataclass(frozen=True)
+class Mutant:
+    """Composition with one systematic change"""
+    id: str
+    operator: str
+    description: str
+    content: str
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.content.encode("utf-8")).hexdigest()
+
+
+def generate_mutants(composition: dict, operators=OPERATORS):
+    """Generate the mutants of a composition: dropped pipeline steps, dropped resources (of patch-and-transform
+    inputs, legacy resources and go templates), changed literal values, dropped patches and swapped readiness checks.
+    Mutants identical to the composition or to a previous mutant are skipped.
+
+    Arguments:
+        composition {dict} -- composition
+
+    Keyword Arguments:
+        operators {tuple} -- mutation operators to apply (default: {OPERATORS})
+
+    Returns:
+        generator -- mutants
+    """
+    original = dump(composition)
+    seen = {original}
+    counts = {}
+    for operator, description, mutated in _mutations(composition, operators):
+        content = dump(mutated)
+        if content in seen:
+            continue
+        seen.add(content)
+        counts[operator] = counts.get(operator, 0) + 1
+        yield Mutant(f"{operator}-{counts[operator]}", operator, description, content)
+
+
+def dump(composition: dict):
+    return yaml.safe_dump(composition, sort_keys=False, default_flow_style=False, allow_unicode=True, width=1 << 16)
+
+
+def _mutations(composition: dict, operators):
+    spec = composition.get("spec") or {}
+    pipeline = spec.get("pipeline") or []
+
+    if DROP_STEP in operators and len(pipeline) > 1:
+        for i, step in enumerate(pipeline):
+            mutated = copy.deepcopy(composition)
+            del mutated["spec"]["pipeline"][i]
+            yield DROP_STEP, f"drop pipeline step {step.get('step')}", mutated
+
+    # Resources of the patch-and-transform functions, or of the legacy mode
+    resource_lists = [(f"pipeline step {step.get('step')}", ("spec", "pipeline", i, "input", "resources"))
+                      for i, step in enumerate(pipeline)
+                      if isinstance((step.get("input") or {}).get("resources"), list)]
+    if isinstance(spec.get("resources"), list):
+        resource_lists.append(("resources", ("spec", "resources")))
+    for location, path in resource_lists:
+        for j, resource in enumerate(_get(composition, path)):
+            name = f"{location} resource {resource.get('name', j)}"
+            yield from _resource_mutations(composition, path + (j,), resource, name, operators)
+
+    # Go templates
+    for i, step in enumerate(pipeline):
+        template = ((step.get("input") or {}).get("inline") or {}).get("template")
+        if isinstance(template, str):
+            path = ("spec", "pipeline", i, "input", "inline", "template")
+            for operator, description, mutated_template in _template_mutations(template, operators):
+                mutated = copy.deepcopy(composition)
+                _set(mutated, path, mutated_template)
+                yield operator, f"pipeline step {step.get('step')} template: {description}", mutated
+
+
+def _resource_mutations(composition, path, resource, name, operators):
+    if DROP_RESOURCE in operators:
+        mutated = copy.deepcopy(composition)
+        del _get(mutated, path[:-1])[path[-1]]
+        yield DROP_RESOURCE, f"drop {name}", mutated
+
+    if CHANGE_VALUE in operators:
+        for key_path, value in _leaves(resource.get("base") or {}):
+            mutated_value = mutate_value(value)
+            if mutated_value is None:
+                continue
+            mutated = copy.deepcopy(composition)
+            _set(mutated, path + ("base",) + key_path, mutated_value)
+            yield CHANGE_VALUE, f"change {name} base.{_format_path(key_path)} to {mutated_value!r}", mutated
+
+    if DROP_PATCH in operators:
+        for k, patch in enumerate(resource.get("patches") or []):
+            mutated = copy.deepcopy(composition)
+            del _get(mutated, path + ("patches",))[k]
+            source = patch.get("fromFieldPath") or patch.get("patchSetName") or patch.get("type")
+            yield DROP_PATCH, f"drop patch {k} ({source}) of {name}", mutated
+
+    if SWAP_READINESS in operators:
+        checks = resource.get("readinessChecks")
+        if checks and all(check.get("type") == "None" for check in checks):
+            swapped = [{"type": "MatchCondition", "matchCondition": {"type": "Ready", "status": "True"}}]
+        else:
+            swapped = [{"type": "None"}]
+        mutated = copy.deepcopy(composition)
+        _get(mutated, path)["readinessChecks"] = swapped
+        yield SWAP_READINESS, f"set the readiness checks of {name} to {swapped[0]['type']}", mutated
+
+
+def _template_mutations(template: str, operators):
+    separators = [0] + [m.end() for m in TEMPLATE_DOCUMENT_SEPARATOR.finditer(template)]
+    bounds = list(zip(separators, separators[1:] + [len(template)]))
+
+    if DROP_RESOURCE in operators:
+        for start, end in bounds:
+            document = template[start:end]
+            kind = re.search(r"^\s*kind:\s*(\S+)", document, re.MULTILINE)
+            if not kind or not re.search(r"^\s*apiVersion:", document, re.MULTILINE):
+                continue
+            # The template actions are kept, so that the blocks stay balanced
+            kept = "".join(line for line in document.splitlines(keepends=True) if TEMPLATE_ACTION_LINE.match(line))
+            name = re.search(r"composition-resource-name:\s*(\S+)", document)
+            line_number = template.count("\n", 0, start) + 1
+            description = f"line {line_number}: drop {kind.group(1)} {name.group(1) if name else ''}".rstrip()
+            yield DROP_RESOURCE, description, template[:start] + kept + template[end:]
+
+    if CHANGE_VALUE in operators:
+        offset = 0
+        in_block_scalar = None
+        for line_number, line in enumerate(template.splitlines(keepends=True), start=1):
+            indent = len(line) - len(line.lstrip())
+            if in_block_scalar is not None and (indent > in_block_scalar or not line.strip()):
+                offset += len(line)
+                continue
+            in_block_scalar = indent if re.search(r":\s*[|>][-+]?\s*$", line) else None
+            match = TEMPLATE_VALUE_LINE.match(line.rstrip("\n"))
+            if match and not match.group(1).strip().startswith(("apiVersion:", "kind:")):
+                value = match.group(2)
+                mutated_line = line.replace(match.group(0), match.group(1) + value + MUTATED_SUFFIX, 1)
+                description = f"line {line_number}: change {match.group(1).strip()} {value} to {value}{MUTATED_SUFFIX}"
+                yield CHANGE_VALUE, description, template[:offset] + mutated_line + template[offset + len(line):]
+            offset += len(line)
+
+    if SWAP_READINESS in operators:
+        for match in TEMPLATE_READINESS.finditer(template):
+            swapped = "False" if match.group(2) == "True" else "True"
+            line_number = template.count("\n", 0, match.start()) + 1
+            description = f"line {line_number}: swap readiness check {match.group(2)} to {swapped}"
+            yield SWAP_READINESS, description, template[:match.start(2)] + swapped + template[match.end(2):]
+
+
+def mutate_value(value):
+    """Mutate a literal value: strings get a suffix, booleans are negated and numbers are incremented
+
+    Arguments:
+        value {object} -- value
+
+    Returns:
+        object -- mutated value, None if the value cannot be mutated
+    """
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, (int, float)):
+        return value + 1
+    if isinstance(value, str) and value:
+        return value + MUTATED_SUFFIX
+    return None
+
+
+def _leaves(value, path=()):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _leaves(item, path + (key,))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from _leaves(item, path + (i,))
+    else:
+        yield path, value
+
+
+def _get(value, path):
+    for key in path:
+        value = value[key]
+    return value
+
+
+def _set(value, path, new_value):
+    _get(value, path[:-1])[path[-1]] = new_value
+
+
+def _format_path(path):
+    return "".join(f"[{key}]" if isinstance(key, int) else f".{key}" for key in path).lstrip(".")
@@ -0,0 +1,235 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import allure
+from behave.runner import Context
+
+from steps.utils.constants import (
+    CTX_DESIRED_COMPOSITE,
+    CTX_DESIRED_RESOURCES,
+    CTX_DESIRED_RESOURCES_INDEX,
+    CTX_NESTED_FINGERPRINTS,
+    CTX_NESTED_RESOURCES,
+    NESTED_NAME_SEPARATOR,
+    TMP_CLAIMS_FILE_PATH)
+from steps.utils.indexes import DesiredResourcesIndex
+from steps.utils.observed import ObservedState, deep_update
+from steps.utils.render import RenderTimeoutError, run_render
+from steps.utils.utils import (
+    build_render_args,
+    dump_string_to_file,
+    dump_yaml_to_file,
+    get_iteration_id,
+    parse_desired_output)
+
+
+def find_composition(resource, compositions: dict):
+    """Find the composition of a nested composite resource, by its composite type. When several compositions have
+    the same composite type, the composition is selected like crossplane does: by the compositionRef, then by the
+    compositionSelector of the composite resource.
+
+    Arguments:
+        resource {dict} -- desired resource
+        compositions {dict} -- compositions by composite type, see ProjectIndex.compositions
+
+    Raises:
+        AssertionError: the composition of the composite resource cannot be selected
+
+    Returns:
+        Path -- path to the composition file, None if the resource is not a composite resource of the project
+    """
+    candidates = compositions.get((resource.get("apiVersion"), resource.get("kind")))
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0][1]
+
+    spec = resource.get("spec") or {}
+    # Crossplane v2 moved the composition fields under spec.crossplane
+    spec = {**spec, **(spec.get("crossplane") or {})}
+    reference = (spec.get("compositionRef") or {}).get("name")
+    selector = (spec.get("compositionSelector") or {}).get("matchLabels") or {}
+    if reference:
+        selected = [c for c in candidates if (c[0].get("metadata") or {}).get("name") == reference]
+    else:
+        selected = [c for c in candidates
+                    if selector and selector.items() <= ((c[0].get("metadata") or {}).get("labels") or {}).items()]
+    assert len(selected) == 1, (
+        f"cannot select the composition of {resource.get('kind')} {(resource.get('metadata') or {}).get('name')}: "
+        f"{len(selected)} of the compositions {[str(c[1]) for c in candidates]} match its compositionRef "
+        f"({reference}) or compositionSelector ({selector})")
+    return selected[0][1]
+
+
+def walk_nested(resources: dict, find, render, workers: int, max_depth: int):
+    """Render the nested composite resources of desired resources, recursively. The subtrees are rendered
+    concurrently with a bounded pool of workers: a nested composite resource is rendered as soon as its parent is,
+    so that a tree renders in about the time of its longest branch.
+
+    Arguments:
+        resources {dict} -- desired resources of the composite resource, by resource name
+        find {callable} -- find(resource) -> path to the composition of a nested composite resource, None if the
+            resource is not a composite resource
+        render {callable} -- render(path, resource, composition_filepath) -> result of the render (see
+            render_nested_resources), with its desired resources by name in result["resources"]
+        workers {int} -- maximum number of renders running at the same time
+        max_depth {int} -- maximum depth of the nested composite resources
+
+    Raises:
+        AssertionError: a render failed, or the composite resources are nested deeper than max_depth
+
+    Returns:
+        generator -- (path, result) of each render, as they complete
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {}
+
+        def submit(parent_path, parent_resources, depth):
+            for name, resource in parent_resources.items():
+                composition_filepath = find(resource)
+                if composition_filepath is None:
+                    continue
+                path = f"{parent_path}{NESTED_NAME_SEPARATOR}{name}" if parent_path else name
+                assert depth <= max_depth, (f"composite resource {path} is nested deeper than {max_depth} levels, "
+                                            f"do its compositions compose each other?")
+                pending[executor.submit(render, path, resource, composition_filepath)] = (path, depth)
+
+        try:
+            submit(None, resources, 1)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    result = future.result()
+                    submit(path, result["resources"], depth + 1)
+                    yield path, result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def render_nested_resources(ctx: Context, functions_filepath, max_depth: int):
+    """Render the nested composite resources of the desired resources in context, with their own compositions
+    found in the "pkg" folder of the project. The resources of the whole tree are then added to the desired
+    resources in context with qualified names, e.g. network/subnet for the resource subnet of the composite resource
+    network, so that the steps checking the desired resources can check any level of the tree.
+
+    Like the composite resource, the nested ones get as observed state their desired resources of the previous
+    render with the changes of the steps (e.g. change observed resource network/subnet with status READY).
+
+    Arguments:
+        ctx {Context} -- behave context
+        functions_filepath {str} -- functions file of the renders
+        max_depth {int} -- maximum depth of the nested composite resources
+
+    Raises:
+        AssertionError: a nested composite resource failed to render
+    """
+    compositions = ctx.project_index.compositions(ctx.project_root)
+    previous_resources = getattr(ctx, CTX_NESTED_RESOURCES, None) or {}
+    previous_fingerprints = getattr(ctx, CTX_NESTED_FINGERPRINTS, None) or {}
+    updates = getattr(ctx, "updates", None) or {}
+    observed_states = getattr(ctx, "nested_observed_states", None)
+    if observed_states is None:
+        observed_states = ctx.nested_observed_states = {}
+        ctx.add_cleanup(lambda: [state.close() for state in observed_states.values()])
+    lock = threading.Lock()
+    xr_name = (getattr(ctx, CTX_DESIRED_COMPOSITE).get("metadata") or {}).get("name")
+    xr_directory = f"{TMP_CLAIMS_FILE_PATH}/nested/{ctx.feature.name}/{ctx.scenario.name}".replace(" ", "_")
+    iteration_id = get_iteration_id(ctx, new_iteration=False)
+    render_cache = getattr(ctx, "render_cache", None)
+
+    def render(path, resource, composition_filepath):
+        problems = ctx.project_index.precheck(composition_filepath, ctx.functions_filepath)
+        assert not problems, (f"composition {composition_filepath} of {path} will not render with functions "
+                              f"{ctx.functions_filepath}:\n" + "\n".join(problems))
+
+        # The nested composite resource as observed, with the changes of the steps
+        xr = deep_update(copy.deepcopy(resource), updates[path]) if path in updates else copy.deepcopy(resource)
+        metadata = xr.setdefault("metadata", {})
+        metadata.setdefault("name", metadata.get("generateName") or f"{xr_name}-{path}".replace("/", "-"))
+        xr_filepath = f"{xr_directory}/{path.replace(NESTED_NAME_SEPARATOR, '.')}.yaml"
+        dump_yaml_to_file(xr_filepath, xr)
+
+        # Its observed resources are its desired resources of the previous render
+        prefix = f"{path}{NESTED_NAME_SEPARATOR}"
+        observed = {name[len(prefix):]: observed_resource for name, observed_resource in previous_resources.items()
+                    if name.startswith(prefix) and NESTED_NAME_SEPARATOR not in name[len(prefix):]}
+        observed_filepath = None
+        if observed:
+            with lock:
+                observed_state = observed_states.get(path)
+                if observed_state is None:
+                    observed_state = observed_states[path] = ObservedState(metrics=getattr(ctx, "metrics", None))
+            observed_state.write(observed, {name: previous_fingerprints.get(prefix + name) for name in observed},
+                                 {name: updates[prefix + name] for name in observed if prefix + name in updates})
+            observed_filepath = observed_state.filepath
+
+        args = build_render_args(xr_filepath, composition_filepath, functions_filepath, ctx.envconfig_filepath,
+                                 observed_filepath=observed_filepath)
+        # Cached by the original functions file, see render
+        cache_key = render_cache.key(build_render_args(xr_filepath, composition_filepath, ctx.functions_filepath,
+                                                       ctx.envconfig_filepath, observed_filepath=observed_filepath)
+                                     ) if render_cache else None
+        try:
+            out = run_render(args, timeout=ctx.render_timeout, retries=ctx.render_retries,
+                             backoff=ctx.render_retry_backoff, watchdog=getattr(ctx, "render_watchdog", None),
+                             metrics=getattr(ctx, "metrics", None), cache=render_cache, cache_key=cache_key)
+        except RenderTimeoutError as e:
+            assert False, f"error rendering {path}: {e}"
+        assert out.returncode == 0, f"error rendering {path} with composition {composition_filepath}: {out.stderr}"
+
+        fingerprints = {}
+        _, resources = parse_desired_output(out.stdout, fingerprints=fingerprints)
+        return {"resources": resources, "fingerprints": fingerprints, "output": out.stdout}
+
+    nested_resources = {}
+    nested_fingerprints = {}
+    for path, result in walk_nested(getattr(ctx, CTX_DESIRED_RESOURCES),
+                                    lambda resource: find_composition(resource, compositions),
+                                    render, ctx.render_workers, max_depth):
+        # Attached from the main thread, where the allure step is
+        allure.attach(result["output"], name=f"render output of {path}")
+        if ctx.debug_mode:
+            dump_string_to_file(f"dump/{iteration_id}-out-desired-{path.replace(NESTED_NAME_SEPARATOR, '.')}.yaml",
+                                result["output"])
+        for name, resource in result["resources"].items():
+            nested_resources[f"{path}{NESTED_NAME_SEPARATOR}{name}"] = resource
+        for name, fingerprint in result["fingerprints"].items():
+            nested_fingerprints[f"{path}{NESTED_NAME_SEPARATOR}{name}"] = fingerprint
+
+    set_nested_resources(ctx, nested_resources, nested_fingerprints)
+
+
+def set_nested_resources(ctx: Context, nested_resources: dict, nested_fingerprints: dict = None):
+    """Add the resources of the nested composite resources to the desired resources in context
+
+    Arguments:
+        ctx {Context} -- behave context
+        nested_resources {dict} -- resources of the nested composite resources, by qualified name
+
+    Keyword Arguments:
+        nested_fingerprints {dict} -- fingerprints of the nested resources, by qualified name (default: {None})
+    """
+    desired_resources = {name: resource for name, resource in getattr(ctx, CTX_DESIRED_RESOURCES).items()
+                         if name not in (getattr(ctx, CTX_NESTED_RESOURCES, None) or {})}
+    desired_resources.update(nested_resources)
+    setattr(ctx, CTX_NESTED_RESOURCES, nested_resources)
+    setattr(ctx, CTX_NESTED_FINGERPRINTS, nested_fingerprints or {})
+    setattr(ctx, CTX_DESIRED_RESOURCES, desired_resources)
+    setattr(ctx, CTX_DESIRED_RESOURCES_INDEX, DesiredResourcesIndex(desired_resources))
@@ -0,0 +1,136 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections.abc
+import copy
+import hashlib
+import os
+import re
+import tempfile
+
+import yaml
+
+from steps.utils.constants import TMP_OBSERVED_FILE_PREFIX
+
+# Document separator of the render output
+DOCUMENT_SEPARATOR = re.compile(r"^---[ \t]*$\n?", re.MULTILINE)
+# The C emitter is used when libyaml is available
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def split_documents(render_output: str):
+    """Split the render output into the text of its documents
+
+    Arguments:
+        render_output {str} -- render output
+
+    Returns:
+        list -- text of the documents
+    """
+    return [document for document in DOCUMENT_SEPARATOR.split(render_output) if document.strip()]
+
+
+def fingerprint(source: str):
+    """Fingerprint of the text of a document of the render output, identifying the resource it was parsed from
+    across renders without keeping the text in memory
+
+    Arguments:
+        source {str} -- text of the document
+
+    Returns:
+        bytes -- fingerprint
+    """
+    return hashlib.blake2b(source.encode("utf-8"), digest_size=16).digest()
+
+
+class ObservedState:
+    """Observed state of the next render of a scenario: the desired resources of the previous render, overlaid with
+    the changes made by the steps (e.g. change observed resource ... with status ...).
+
+    The resources are serialized one by one. A resource rendered with the same content and overlaid with the same
+    changes as in the previous render reuses its serialized bytes, so that preparing the observed state costs as
+    much as the changes, not as much as the whole state. The resources of the context are never changed.
+    """
+
+    def __init__(self, metrics=None):
+        # Metrics of the test run, counting the reused resources
+        self.metrics = metrics
+        fd, self.filepath = tempfile.mkstemp(prefix=TMP_OBSERVED_FILE_PREFIX, suffix=".yaml")
+        os.close(fd)
+        # fingerprint of the rendered resource -> serialized resource, of the last write
+        self._serialized = {}
+
+    def write(self, resources: dict, fingerprints: dict, updates=None):
+        """Write the observed state, atomically, to the observed file of the scenario
+
+        Arguments:
+            resources {dict} -- desired resources of the previous render, by resource name
+            fingerprints {dict} -- fingerprints of the desired resources, by resource name (see fingerprint)
+
+        Keyword Arguments:
+            updates {dict} -- changes of the steps to overlay on the resources, by resource name (default: {None})
+
+        Returns:
+            bytes -- content of the observed file
+        """
+        serialized = {}
+        chunks = []
+        for name, resource in resources.items():
+            overlay = updates.get(name) if updates else None
+            key = fingerprints.get(name)
+            if key is not None and overlay:
+                key += fingerprint(yaml.dump(overlay, Dumper=Dumper))
+            chunk = self._serialized.get(key) if key is not None else None
+            if self.metrics and key is not None:
+                self.metrics.inc("cache_lookups", cache="observed_state", result="miss" if chunk is None else "hit")
+            if chunk is None:
+                if overlay:
+                    resource = deep_update(copy.deepcopy(resource), overlay)
+                chunk = yaml.dump(resource, Dumper=Dumper, encoding="utf-8")
+            if key is not None:
+                serialized[key] = chunk
+            chunks.append(chunk)
+        self._serialized = serialized
+
+        content = b"---\n".join(chunks)
+        tmp_filepath = f"{self.filepath}.tmp"
+        with open(tmp_filepath, mode="wb") as file:
+            file.write(content)
+        os.replace(tmp_filepath, self.filepath)
+        return content
+
+    def close(self):
+        """Remove the observed file"""
+        self._serialized.clear()
+        for filepath in (self.filepath, f"{self.filepath}.tmp"):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+
+def deep_update(d, u):
+    """Deep update dictionaries
+
+    Arguments:
+        d {dict} -- dictionary to update
+        u {dict} -- dictionary to update from
+
+    Returns:
+        dict -- updated dictionary
+    """
+    for k, v in u.items():
+        if isinstance(v, collections.abc.Mapping):
+            d[k] = deep_update(d.get(k, {}), v)
+        else:
+            d[k] = v
+    return d
@@ -0,0 +1,146 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+import statistics
+from pathlib import Path
+
+from steps.utils.constants import (
+    PERF_BASELINE_MAX_SAMPLES,
+    PERF_MIN_REGRESSION_SECONDS,
+    PERF_REGRESSION_MAD_FACTOR)
+
+DURATION_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*$")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, None: 1}
+# Scale of the median absolute deviation to estimate the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+BASELINE_VERSION = 1
+
+
+def parse_duration(duration: str):
+    """Parse a duration, in milliseconds, seconds or minutes (e.g. "500ms", "2s", "1.5 m"). Seconds by default.
+
+    Arguments:
+        duration {str} -- duration
+
+    Raises:
+        ValueError: the duration cannot be parsed
+
+    Returns:
+        float -- duration in seconds
+    """
+    match = DURATION_PATTERN.match(duration)
+    if not match:
+        raise ValueError(f"invalid duration {duration}, expected e.g. 500ms, 2s or 1m")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def scenario_key(feature_filename, project_root, scenario_name: str):
+    """Get the key of a scenario in the baseline, independent of the directory the tests run from
+
+    Arguments:
+        feature_filename {str} -- path to the feature file of the scenario
+        project_root {str} -- root of the project
+        scenario_name {str} -- name of the scenario
+
+    Returns:
+        str -- key of the scenario
+    """
+    try:
+        feature_filename = Path(feature_filename).relative_to(project_root)
+    except ValueError:
+        pass
+    return f"{Path(feature_filename).as_posix()}: {scenario_name}"
+
+
+class PerformanceBaseline:
+    """Render times of the scenarios measured by the previous test runs, used to detect the scenarios that got
+    slower. Only the last samples of each scenario are kept, so that the baseline follows the accepted changes.
+
+    The baseline is a json file: {"version": 1, "scenarios": {"<feature file>: <scenario>": [seconds, ...]}}
+    """
+
+    def __init__(self, scenarios: dict = None, max_samples: int = PERF_BASELINE_MAX_SAMPLES):
+        self.scenarios = scenarios or {}
+        self.max_samples = max_samples
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a baseline, empty if the file does not exist yet
+
+        Arguments:
+            filepath {str} -- path to the baseline file
+
+        Returns:
+            PerformanceBaseline -- baseline
+        """
+        try:
+            with open(filepath, mode="r", encoding="utf-8") as file:
+                content = json.load(file)
+        except FileNotFoundError:
+            return cls()
+        return cls(content.get("scenarios") or {})
+
+    def record(self, key: str, seconds: float):
+        """Add the render time of a scenario to its samples
+
+        Arguments:
+            key {str} -- key of the scenario, see scenario_key
+            seconds {float} -- render time of the scenario
+        """
+        samples = self.scenarios.setdefault(key, [])
+        samples.append(round(seconds, 6))
+        del samples[:-self.max_samples]
+
+    def check(self, key: str, seconds: float, threshold_percent: float):
+        """Check the render time of a scenario against its samples. The render time is a regression only if it is
+        above the median of the samples by more than the threshold, by more than the noise of the samples
+        (PERF_REGRESSION_MAD_FACTOR scaled median absolute deviations) and by more than PERF_MIN_REGRESSION_SECONDS.
+
+        Arguments:
+            key {str} -- key of the scenario, see scenario_key
+            seconds {float} -- render time of the scenario
+            threshold_percent {float} -- accepted slowdown, in percent of the median of the samples
+
+        Returns:
+            str -- description of the regression, None if the render time is not a regression or the scenario has
+                no samples
+        """
+        samples = self.scenarios.get(key)
+        if not samples:
+            return None
+        median = statistics.median(samples)
+        noise = PERF_REGRESSION_MAD_FACTOR * MAD_SCALE * statistics.median(abs(s - median) for s in samples)
+        limit = max(median * (1 + threshold_percent / 100), median + noise, median + PERF_MIN_REGRESSION_SECONDS)
+        if seconds <= limit:
+            return None
+        return (f"renders took {seconds:.3f}s, {(seconds / median - 1) * 100:.0f}% more than the baseline median "
+                f"{median:.3f}s of {len(samples)} runs (limit {limit:.3f}s: +{threshold_percent:g}%, noise "
+                f"{noise:.3f}s)")
+
+    def write(self, filepath):
+        """Write the baseline atomically, with sorted keys so that its changes can be reviewed
+
+        Arguments:
+            filepath {str} -- path to the baseline file
+        """
+        filepath = Path(filepath)
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+        tmp_filepath = filepath.with_name(f".{filepath.name}.tmp")
+        with open(tmp_filepath, mode="w", encoding="utf-8") as file:
+            json.dump({"version": BASELINE_VERSION, "scenarios": self.scenarios}, file, indent=2, sort_keys=True)
+            file.write("\n")
+        os.replace(tmp_filepath, filepath)
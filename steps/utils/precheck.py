@@ -0,0 +1,219 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+# Go template actions opening a block closed by {{ end }}
+TEMPLATE_BLOCK_ACTIONS = ("if", "range", "with", "define", "block")
+# Go template blocks in which {{ else }} is allowed
+TEMPLATE_ELSE_BLOCKS = ("if", "range", "with")
+TEMPLATE_ACTION_KEYWORD = re.compile(r"^([a-z]+)\b")
+
+
+def precheck_composition(composition: dict, functions: list, definition: dict = None):
+    """Statically check a composition before rendering it, so that broken references are reported before
+    the crossplane CLI starts any function container. All the problems are reported at once.
+
+    The following is checked:
+    - the function of each pipeline step is defined in the functions file
+    - the names of the pipeline steps are unique
+    - the compositeTypeRef matches the composite resource definition (XRD), if any
+    - the syntax of the inline go templates
+
+    Arguments:
+        composition {dict} -- composition
+        functions {list} -- functions defined in the functions file
+
+    Keyword Arguments:
+        definition {dict} -- composite resource definition (XRD) of the composition (default: {None})
+
+    Returns:
+        list[str] -- problems found, empty if none
+    """
+    if not isinstance(composition, dict) or composition.get("kind") != "Composition":
+        return [f"not a composition (kind {composition.get('kind') if isinstance(composition, dict) else None})"]
+
+    spec = composition.get("spec") or {}
+    problems = []
+    if definition:
+        problems += check_composite_type_ref(spec.get("compositeTypeRef") or {}, definition)
+
+    if spec.get("mode", "Resources") != "Pipeline":
+        return problems
+
+    function_names = {f.get("metadata", {}).get("name") for f in functions
+                      if isinstance(f, dict) and f.get("kind") == "Function"}
+    step_names = set()
+    for index, step in enumerate(spec.get("pipeline") or []):
+        step_name = step.get("step")
+        label = f"pipeline step {step_name or index}"
+        if not step_name:
+            problems.append(f"{label}: missing step name")
+        elif step_name in step_names:
+            problems.append(f"{label}: duplicated step name")
+        step_names.add(step_name)
+
+        function_name = (step.get("functionRef") or {}).get("name")
+        if not function_name:
+            problems.append(f"{label}: missing functionRef name")
+        elif function_name not in function_names:
+            problems.append(f"{label}: function {function_name} is not defined in the functions file "
+                            f"(defined: {', '.join(sorted(filter(None, function_names))) or 'none'})")
+
+        step_input = step.get("input") or {}
+        if step_input.get("kind") == "GoTemplate" and step_input.get("source") == "Inline":
+            template = (step_input.get("inline") or {}).get("template")
+            if template is None:
+                problems.append(f"{label}: missing inline template")
+            else:
+                problems += [f"{label}: {problem}" for problem in check_go_template(template)]
+    return problems
+
+
+def check_composite_type_ref(composite_type_ref: dict, definition: dict):
+    """Check that the compositeTypeRef of a composition matches a version of the XRD
+
+    Arguments:
+        composite_type_ref {dict} -- compositeTypeRef of the composition
+        definition {dict} -- composite resource definition (XRD)
+
+    Returns:
+        list[str] -- problems found, empty if none
+    """
+    spec = definition.get("spec") or {}
+    group = spec.get("group")
+    kind = (spec.get("names") or {}).get("kind")
+    versions = [version.get("name") for version in spec.get("versions") or []]
+    expected = [f"{group}/{version}" for version in versions]
+
+    problems = []
+    api_version = composite_type_ref.get("apiVersion")
+    if api_version not in expected:
+        problems.append(f"compositeTypeRef apiVersion {api_version} does not match the definition "
+                        f"(expected one of: {', '.join(expected) or 'none'})")
+    if composite_type_ref.get("kind") != kind:
+        problems.append(f"compositeTypeRef kind {composite_type_ref.get('kind')} does not match the definition "
+                        f"(expected: {kind})")
+    return problems
+
+
+def check_go_template(template: str):
+    """Cheap syntax check of a go template: the actions are closed, their quotes and parentheses are balanced
+    and the blocks ({{ if }}, {{ range }}, etc) are closed by an {{ end }}. The template is not executed and
+    the functions it calls are not checked.
+
+    Arguments:
+        template {str} -- go template
+
+    Returns:
+        list[str] -- problems found with their line number, empty if none
+    """
+    problems = []
+    blocks = []
+    position = 0
+    while True:
+        start = template.find("{{", position)
+        if start == -1:
+            break
+        line = template.count("\n", 0, start) + 1
+        end = find_action_end(template, start + 2)
+        if end == -1:
+            problems.append(f"line {line}: unclosed action")
+            break
+        position = end + 2
+
+        action = template[start + 2:end]
+        # Remove the whitespace trim markers
+        action = action[1:] if action.startswith("-") else action
+        action = action[:-1] if action.endswith("-") else action
+        action = action.strip()
+        if action.startswith("/*"):
+            if not action.endswith("*/"):
+                problems.append(f"line {line}: unclosed comment")
+            continue
+
+        problems += [f"line {line}: {problem}" for problem in check_action(action)]
+        keyword = TEMPLATE_ACTION_KEYWORD.match(action)
+        keyword = keyword.group(1) if keyword else None
+        if keyword in TEMPLATE_BLOCK_ACTIONS:
+            blocks.append((keyword, line))
+        elif keyword == "else":
+            if not blocks or blocks[-1][0] not in TEMPLATE_ELSE_BLOCKS:
+                problems.append(f"line {line}: unexpected else")
+        elif keyword == "end":
+            if not blocks:
+                problems.append(f"line {line}: unexpected end")
+            else:
+                blocks.pop()
+
+    problems += [f"line {line}: unclosed {keyword}" for keyword, line in blocks]
+    return problems
+
+
+def find_action_end(template: str, position: int):
+    """Find the closing delimiter of an action, ignoring the delimiters inside strings
+
+    Returns:
+        int -- position of the closing delimiter, -1 if not found
+    """
+    quote = None
+    while position < len(template) - 1:
+        char = template[position]
+        if quote:
+            if char == "\\" and quote != "`":
+                position += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'`":
+            quote = char
+        elif template.startswith("}}", position):
+            return position
+        position += 1
+    return -1
+
+
+def check_action(action: str):
+    """Check the quotes and parentheses of the pipeline of an action
+
+    Returns:
+        list[str] -- problems found, empty if none
+    """
+    if not action:
+        return ["empty action"]
+
+    depth = 0
+    quote = None
+    escaped = False
+    for char in action:
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\" and quote != "`":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'`":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                return ["unexpected closing parenthesis"]
+
+    if quote:
+        return ["unterminated string"]
+    if depth:
+        return ["unclosed parenthesis"]
+    return []
@@ -0,0 +1,272 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import csv
+import json
+import math
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from steps.utils.render import run_render
+from steps.utils.setters import set_resource_param
+from steps.utils.utils import dump_yaml_to_file, get_resource_entry, parse_desired_output
+
+# Exponents tried when fitting the growth curve, from 0 (constant) to 3 (cubic)
+GROWTH_EXPONENTS = [round(0.05 * i, 2) for i in range(0, 61)]
+
+
+@dataclass
+class ProfilePoint:
+    """Measures of the render of the claim for one size of the swept parameter"""
+    size: int
+    wall_time: float
+    output_bytes: int
+    resource_count: int
+
+
+@dataclass
+class GrowthFit:
+    """Growth curve fitted on the measures: value = overhead + coefficient * size ^ exponent"""
+    exponent: float
+    overhead: float
+    coefficient: float
+
+
+@dataclass
+class ProfileResult:
+    """Result of the sweep of a claim parameter"""
+    param: str
+    points: list = field(default_factory=list)
+    fits: dict = field(default_factory=dict)
+
+
+def parse_sizes(sizes: str):
+    """Parse a list of sizes, either comma separated (e.g. "1,10,100") or a range with a factor (e.g. "1..1000 x10")
+
+    Arguments:
+        sizes {str} -- sizes
+
+    Raises:
+        AssertionError: the range does not start above 0, or its factor is not above 1
+
+    Returns:
+        list[int] -- sorted sizes
+    """
+    sizes = sizes.strip()
+    if ".." not in sizes:
+        return sorted({int(size) for size in sizes.split(",")})
+
+    bounds, _, factor = sizes.partition(" x")
+    start, end = (int(bound) for bound in bounds.split(".."))
+    factor = int(factor) if factor else 10
+    assert start > 0 and factor > 1, (f"invalid sizes {sizes}: the range must start above 0 and grow by a factor "
+                                      f"above 1, e.g. 1..1000 x10")
+    result = []
+    size = start
+    while size < end:
+        result.append(size)
+        size *= factor
+    result.append(end)
+    return result
+
+
+def sized_claim(claim: dict, param: str, size: int):
+    """Copy the claim and set the parameter to the given size. If the parameter is an array (or is not set in the
+    claim), it is set to an array of the given size, the items being derived from the first existing item: copies of
+    it if it is an object or an array, the item suffixed with the index otherwise. Otherwise it is set to the size
+    itself.
+
+    Arguments:
+        claim {dict} -- claim
+        param {str} -- parameter to size (e.g. spec.policiesARN)
+        size {int} -- size
+
+    Returns:
+        dict -- claim with the sized parameter
+    """
+    claim = copy.deepcopy(claim)
+    current = get_resource_entry(claim, param)
+    if current is not None and not isinstance(current, list):
+        set_resource_param(claim, param, size)
+        return claim
+
+    if current and isinstance(current[0], (dict, list)):
+        set_resource_param(claim, param, [copy.deepcopy(current[0]) for _ in range(size)])
+        return claim
+
+    prefix = str(current[0]) if current else param.split(".")[-1]
+    set_resource_param(claim, param, [f"{prefix}-{i}" for i in range(size)])
+    return claim
+
+
+def sweep_claim_parameter(claim: dict, param: str, sizes, claims_directory, render_args, claim_arg_index: int,
+                          repeats: int = 1, **render_kwargs):
+    """Render the claim for each size of the parameter and measure the render. The renders run one at a time
+    so that they do not interfere with each other's timing.
+
+    Arguments:
+        claim {dict} -- claim
+        param {str} -- parameter to sweep (e.g. spec.policiesARN)
+        sizes {list[int]} -- sizes of the parameter
+        claims_directory {str} -- directory where the sized claims are dumped
+        render_args {list} -- crossplane render command arguments
+        claim_arg_index {int} -- index of the claim in the render arguments
+
+    Keyword Arguments:
+        repeats {int} -- number of renders per size, the fastest one is kept (default: {1})
+        render_kwargs -- keyword arguments passed to run_render (timeout, retries, backoff, watchdog, metrics)
+
+    Raises:
+        AssertionError: a render failed
+
+    Returns:
+        ProfileResult -- measures of the renders and fitted growth curves
+    """
+    result = ProfileResult(param)
+    for size in sizes:
+        claim_filepath = f"{claims_directory}/claim_{param}_{size}.yaml"
+        dump_yaml_to_file(claim_filepath, sized_claim(claim, param, size))
+        args = list(render_args)
+        args[claim_arg_index] = claim_filepath
+
+        wall_time = math.inf
+        for _ in range(max(1, repeats)):
+            out = run_render(args, **render_kwargs)
+            assert out.returncode == 0, f"error rendering with {param} of size {size}: {out.stderr}"
+            # Only the successful attempt is measured, not the retries and the wait for a render slot
+            wall_time = min(wall_time, out.duration)
+
+        _, desired_resources = parse_desired_output(out.stdout)
+        result.points.append(ProfilePoint(size, wall_time, len(out.stdout.encode()), len(desired_resources)))
+
+    for measure in ("wall_time", "output_bytes", "resource_count"):
+        result.fits[measure] = fit_growth(
+            [point.size for point in result.points], [getattr(point, measure) for point in result.points])
+    return result
+
+
+def fit_growth(sizes, values):
+    """Fit the growth curve value = overhead + coefficient * size ^ exponent with least squares.
+    The overhead absorbs the fixed cost of a render (e.g. functions startup), so that the exponent reflects how
+    the cost grows with the size. The exponent is searched in GROWTH_EXPONENTS.
+
+    Arguments:
+        sizes {list[int]} -- sizes
+        values {list[float]} -- measured values
+
+    Returns:
+        GrowthFit -- fitted growth curve
+    """
+    best, best_error = GrowthFit(0.0, sum(values) / len(values), 0.0), math.inf
+    for exponent in GROWTH_EXPONENTS:
+        xs = [size ** exponent for size in sizes]
+        overhead, coefficient = linear_least_squares(xs, values)
+        if coefficient < 0:
+            continue
+        error = sum((overhead + coefficient * x - v) ** 2 for x, v in zip(xs, values))
+        # Prefer the lowest exponent when the fits are as good (e.g. flat measures)
+        if error < best_error * (1 - 1e-9):
+            best, best_error = GrowthFit(exponent, overhead, coefficient), error
+    return best
+
+
+def linear_least_squares(xs, ys):
+    """Fit y = a + b * x with least squares
+
+    Returns:
+        tuple -- a and b
+    """
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return mean_y, 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+    return mean_y - slope * mean_x, slope
+
+
+def write_profile_report(filepath_prefix, result: ProfileResult):
+    """Write the profile as CSV, JSON and as an SVG chart of the render wall time
+
+    Arguments:
+        filepath_prefix {str} -- path of the report files, without extension
+        result {ProfileResult} -- profile
+
+    Returns:
+        list -- paths of the written files
+    """
+    filepath_prefix = Path(filepath_prefix)
+    filepath_prefix.parent.mkdir(exist_ok=True, parents=True)
+
+    csv_filepath = filepath_prefix.with_suffix(".csv")
+    with open(csv_filepath, mode="w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["size", "wall_time", "output_bytes", "resource_count"])
+        writer.writeheader()
+        writer.writerows(asdict(point) for point in result.points)
+
+    json_filepath = filepath_prefix.with_suffix(".json")
+    with open(json_filepath, mode="w", encoding="utf-8") as file:
+        json.dump(asdict(result), file, indent=2)
+
+    svg_filepath = filepath_prefix.with_suffix(".svg")
+    with open(svg_filepath, mode="w", encoding="utf-8") as file:
+        file.write(render_svg_chart(result))
+
+    return [csv_filepath, json_filepath, svg_filepath]
+
+
+def render_svg_chart(result: ProfileResult, width: int = 640, height: int = 400, margin: int = 50):
+    """Render a log-log chart of the render wall time against the parameter size, with the fitted curve
+
+    Arguments:
+        result {ProfileResult} -- profile
+
+    Returns:
+        str -- SVG document
+    """
+    sizes = [point.size for point in result.points]
+    times = [point.wall_time for point in result.points]
+    fit = result.fits["wall_time"]
+
+    def log(value):
+        return math.log10(max(value, 1e-6))
+
+    min_x, max_x = log(min(sizes)), log(max(sizes))
+    min_y, max_y = log(min(times)) - 0.1, log(max(times)) + 0.1
+
+    def to_svg(size, value):
+        x = margin + (log(size) - min_x) / ((max_x - min_x) or 1) * (width - 2 * margin)
+        y = height - margin - (log(value) - min_y) / ((max_y - min_y) or 1) * (height - 2 * margin)
+        return f"{x:.1f},{y:.1f}"
+
+    measured = " ".join(to_svg(size, value) for size, value in zip(sizes, times))
+    fitted = " ".join(to_svg(size, fit.overhead + fit.coefficient * size ** fit.exponent) for size in sizes)
+    dots = "".join(f'<circle cx="{p.split(",")[0]}" cy="{p.split(",")[1]}" r="3"/>' for p in measured.split())
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="12">'
+        f'<rect width="100%" height="100%" fill="white"/>'
+        f'<text x="{margin}" y="20">render wall time (s) by size of {result.param}, '
+        f'fitted exponent {fit.exponent} (log-log)</text>'
+        f'<line x1="{margin}" y1="{height - margin}" x2="{width - margin}" y2="{height - margin}" stroke="black"/>'
+        f'<line x1="{margin}" y1="{margin}" x2="{margin}" y2="{height - margin}" stroke="black"/>'
+        f'<text x="{margin}" y="{height - margin + 20}">{min(sizes)}</text>'
+        f'<text x="{width - margin}" y="{height - margin + 20}" text-anchor="end">{max(sizes)}</text>'
+        f'<text x="{margin - 5}" y="{height - margin}" text-anchor="end">{min(times):.2f}</text>'
+        f'<text x="{margin - 5}" y="{margin + 10}" text-anchor="end">{max(times):.2f}</text>'
+        f'<polyline points="{fitted}" fill="none" stroke="orange" stroke-dasharray="4"/>'
+        f'<polyline points="{measured}" fill="none" stroke="steelblue"/>'
+        f'<g fill="steelblue">{dots}</g>'
+        f'</svg>'
+    )
@@ -0,0 +1,438 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import os
+import re
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import CLAIM, COMPOSITION, ENVCONFIG, FUNCTIONS, OBSERVED
+from steps.utils.precheck import precheck_composition
+from steps.utils.schema import ClaimValidator
+
+_shared_project_indexes = {}
+
+# Step functions taking an input file, by kind of input. Used to find the input files of the features.
+INPUT_STEPS = {
+    "prepare_claim": CLAIM,
+    "prepare_composition": COMPOSITION,
+    "prepare_functions": FUNCTIONS,
+    "prepare_environment_config": ENVCONFIG,
+    "prepare_observed_state": OBSERVED,
+}
+
+
+@dataclass(frozen=True)
+class FeatureLayout:
+    """Paths of the default inputs of the features of a feature folder.
+
+    By convention, the environment config and functions files are at the same level as the feature folders,
+    and the compositions are in the "pkg" folder at the root of the project, which mirrors the structure of
+    the feature folders.
+
+    Example:
+    ├── composition-tests
+        ├── feature 1
+            ├── resources
+                ├── claim.yaml
+            ├── feature1.feature
+        ├── feature 2
+            ├──
+            ├── feature2.feature
+        ├── envconfig.yaml              # Environment Configuration File
+        ├── functions.yaml              # Default functions File
+        |── functions-ci.yaml           # Version of the functions file to run on CI
+    ├── pkg                             # Compositions directory
+        ├── feature 1
+            ├── composition.yaml
+            ├── definition.yaml
+        ├── feature 2
+            ├── composition.yaml
+            ├── definition.yaml
+    """
+    base_path: Path
+    project_root: Path
+    functions_folder_path: Path
+    functions_filepath: Path
+    envconfig_filepath: Path
+    compositions_directory: Path
+    composition_filepath: Path
+    definition_filepath: Path
+
+
+@dataclass(frozen=True)
+class ProjectFile:
+    """Content of a file of the project, read once. The parsed content is cached and must not be modified,
+    use ProjectIndex.load to get a copy that can be modified.
+    """
+    path: Path
+    text: str
+    # Modification time (ns) and size of the file when it was read
+    signature: tuple = None
+
+    @cached_property
+    def content(self):
+        return yaml.safe_load(self.text)
+
+    @cached_property
+    def documents(self):
+        return list(yaml.safe_load_all(self.text))
+
+
+class ProjectIndex:
+    """Index of the files of the project, built once per test run.
+
+    The layout of each feature folder is computed once, the existence of the files is checked once and
+    their content is read and parsed once, whatever the number of features and scenarios using them. A file
+    rewritten during the run (e.g. a generated claim) is read again.
+    """
+
+    def __init__(self, on_ci: bool = False, ci_functions_file: str = None):
+        self.on_ci = on_ci
+        self.ci_functions_file = ci_functions_file
+        self._layouts = {}
+        self._exists = {}
+        self._files = {}
+        self._prechecks = {}
+        self._claim_validators = {}
+        self._compositions = {}
+
+    def layout(self, feature_filename):
+        """Get the layout of the feature folder of a feature file
+
+        Arguments:
+            feature_filename {str} -- path to the feature file
+
+        Returns:
+            FeatureLayout -- paths of the default inputs of the feature
+        """
+        base_path = Path(feature_filename).parent
+        layout = self._layouts.get(base_path)
+        if layout is not None:
+            return layout
+
+        all_features_directory = base_path.parent
+        project_root = all_features_directory.parent
+        # If running on CI, the default functions file is specified by the environment variable
+        # "COMPOSITION_TESTER_FUNCTIONS_FILE" (e.g. "functions-ci.yaml")
+        functions_file = self.ci_functions_file if self.on_ci else "functions.yaml"
+        envconfig_filepath = all_features_directory / "envconfig.yaml"
+        compositions_directory = project_root / "pkg" / base_path.name
+
+        layout = FeatureLayout(
+            base_path=base_path,
+            project_root=project_root,
+            functions_folder_path=all_features_directory,
+            functions_filepath=all_features_directory / functions_file,
+            envconfig_filepath=envconfig_filepath if self.exists(envconfig_filepath) else None,
+            compositions_directory=compositions_directory,
+            composition_filepath=compositions_directory / "composition.yaml",
+            definition_filepath=compositions_directory / "definition.yaml",
+        )
+        self._layouts[base_path] = layout
+        return layout
+
+    def exists(self, filepath):
+        """Check if a file exists, only once per existing file: a missing file may be written later in the run
+
+        Arguments:
+            filepath {str} -- path to the file
+
+        Returns:
+            bool -- True if the file exists
+        """
+        key = os.path.abspath(filepath)
+        if key in self._exists:
+            return True
+        exists = os.path.exists(key)
+        if exists:
+            self._exists[key] = True
+        return exists
+
+    def file(self, filepath):
+        """Get a file of the project, read only once unless it is modified. Only its modification time and size are
+        checked when it is read again.
+
+        Arguments:
+            filepath {str} -- path to the file
+
+        Returns:
+            ProjectFile -- file
+        """
+        key = os.path.abspath(filepath)
+        signature = file_signature(key)
+        project_file = self._files.get(key)
+        if project_file is not None and project_file.signature != signature:
+            # Rewritten since it was read, e.g. a generated claim
+            self._forget_files([key])
+            project_file = None
+        if project_file is None:
+            with open(key, mode="r", encoding="utf-8") as file:
+                project_file = self._files[key] = ProjectFile(Path(filepath), file.read(), signature)
+        return project_file
+
+    def refresh(self):
+        """Drop what may have changed on disk since it was cached: the files modified since they were read, and the
+        existence of the files. Used when the index is reused by several test runs, e.g. by the tester daemon.
+        """
+        self._forget_files([key for key, project_file in self._files.items()
+                            if not os.path.exists(key) or file_signature(key) != project_file.signature])
+        self._compositions.clear()
+        self._exists.clear()
+        self._layouts.clear()
+
+    def _forget_files(self, keys):
+        """Drop files read before they changed, and what was derived from them"""
+        for key in keys:
+            del self._files[key]
+        if keys:
+            self._prechecks.clear()
+            self._claim_validators.clear()
+            self._compositions.clear()
+
+    def load(self, filepath):
+        """Load the content of a yaml file of the project. The file is parsed only once, the returned
+        content is a copy that can be modified.
+
+        Arguments:
+            filepath {str} -- path to the file
+
+        Returns:
+            object -- parsed content
+        """
+        return copy.deepcopy(self.file(filepath).content)
+
+    def load_all(self, filepath):
+        """Load all the documents of a multi-document yaml file of the project. The file is parsed only once,
+        the returned documents are a copy that can be modified.
+
+        Arguments:
+            filepath {str} -- path to the file
+
+        Returns:
+            list -- parsed documents
+        """
+        return copy.deepcopy(self.file(filepath).documents)
+
+    def precheck(self, composition_filepath, functions_filepath):
+        """Statically check a composition against a functions file and against the composite resource
+        definition (definition.yaml) next to the composition, if any. The check runs only once per composition
+        and functions file.
+
+        Arguments:
+            composition_filepath {str} -- path to the composition
+            functions_filepath {str} -- path to the functions
+
+        Returns:
+            tuple[str] -- problems found, empty if none
+        """
+        key = (os.path.abspath(composition_filepath), os.path.abspath(functions_filepath))
+        problems = self._prechecks.get(key)
+        if problems is not None:
+            return problems
+
+        definition_filepath = Path(composition_filepath).parent / "definition.yaml"
+        try:
+            definition = self.file(definition_filepath).content if self.exists(definition_filepath) else None
+            problems = tuple(precheck_composition(
+                self.file(composition_filepath).content, self.file(functions_filepath).documents, definition))
+        except (OSError, yaml.YAMLError) as e:
+            problems = (f"could not be parsed: {e}",)
+        self._prechecks[key] = problems
+        return problems
+
+    def validate_claim(self, definition_filepath, claim: dict):
+        """Validate a claim against the openAPIV3Schema of its composite resource definition (XRD). The schema is
+        compiled only once per definition, see ClaimValidator.
+
+        Arguments:
+            definition_filepath {str} -- path to the definition
+            claim {dict} -- claim
+
+        Returns:
+            list[str] -- violations, empty if the claim is valid or the definition does not exist
+        """
+        key = os.path.abspath(definition_filepath)
+        validator = self._claim_validators.get(key)
+        if validator is None:
+            if not self.exists(definition_filepath):
+                return []
+            try:
+                validator = ClaimValidator(self.file(definition_filepath).content)
+            except (OSError, yaml.YAMLError, re.error) as e:
+                return [f"definition {definition_filepath} could not be compiled: {e}"]
+            self._claim_validators[key] = validator
+        return validator.validate(claim)
+
+    def compositions(self, project_root):
+        """Index the compositions of the "pkg" folder of a project by their composite type. The folder is scanned
+        only once.
+
+        Arguments:
+            project_root {str} -- root of the project
+
+        Returns:
+            dict -- (apiVersion, kind) of the composite type -> list of (composition, path to the composition file)
+        """
+        key = os.path.abspath(project_root)
+        compositions = self._compositions.get(key)
+        if compositions is not None:
+            return compositions
+
+        compositions = {}
+        for filepath in sorted(Path(project_root, "pkg").rglob("*.yaml")):
+            try:
+                documents = self.file(filepath).documents
+            except (OSError, yaml.YAMLError):
+                continue
+            for document in documents:
+                if not isinstance(document, dict) or document.get("kind") != "Composition":
+                    continue
+                type_ref = (document.get("spec") or {}).get("compositeTypeRef") or {}
+                composite_type = (type_ref.get("apiVersion"), type_ref.get("kind"))
+                compositions.setdefault(composite_type, []).append((document, filepath))
+        self._compositions[key] = compositions
+        return compositions
+
+    def missing_inputs(self, feature, step_registry, config=None):
+        """Find the input files referenced by the steps of a feature that do not exist
+
+        Arguments:
+            feature {behave.model.Feature} -- feature
+            step_registry {behave.step_registry.StepRegistry} -- registry of the steps
+
+        Keyword Arguments:
+            config {behave.configuration.Configuration} -- configuration of the test run, only the scenarios
+                selected by its tags and names are checked (default: {None}, all the scenarios)
+
+        Returns:
+            list[str] -- one message per missing file
+        """
+        background_steps = list(feature.background.steps) if feature.background else []
+        missing = []
+        for scenario in feature.walk_scenarios():
+            if config is not None and not scenario.should_run(config):
+                continue
+            for step, kind, filepath in self.step_inputs(feature, background_steps + list(scenario.steps),
+                                                         step_registry):
+                if not self.exists(filepath):
+                    message = f"{kind} file ({filepath}) does not exist (line {step.line}: {step.keyword} {step.name})"
+                    if message not in missing:
+                        missing.append(message)
+        return missing
+
+    def step_inputs(self, feature, steps, step_registry):
+        """Find the input files referenced by steps of a feature
+
+        Arguments:
+            feature {behave.model.Feature} -- feature
+            steps {list[behave.model.Step]} -- steps, in the order they run
+            step_registry {behave.step_registry.StepRegistry} -- registry of the steps
+
+        Returns:
+            generator -- (step, kind, filepath) for each step taking an input file
+        """
+        layout = self.layout(feature.filename)
+        compositions_directory = layout.compositions_directory
+        for step in steps:
+            match = step_registry.find_match(step)
+            if match is None:
+                continue
+            arguments = {argument.name: argument.value for argument in match.arguments}
+            # The compositions directory can be changed by a step
+            if match.func.__name__ == "prepare_compositions_directory":
+                compositions_directory = arguments["compositions_directory"]
+                continue
+            kind = INPUT_STEPS.get(match.func.__name__)
+            # Skip the steps of scenario outlines that still have placeholders
+            if kind is None or any("<" in str(value) for value in arguments.values()):
+                continue
+            yield step, kind, input_filepath(kind, layout, arguments, compositions_directory, self.on_ci)
+
+
+def shared_project_index(on_ci: bool = False, ci_functions_file: str = None):
+    """Get the project index of the process, refreshed. In a long running process (e.g. the tester daemon), the
+    files that did not change are not read and parsed again by the next test runs.
+
+    Arguments:
+        on_ci {bool} -- running on CI
+        ci_functions_file {str} -- functions file to use on CI
+
+    Returns:
+        ProjectIndex -- project index
+    """
+    key = (on_ci, ci_functions_file)
+    project_index = _shared_project_indexes.get(key)
+    if project_index is None:
+        project_index = _shared_project_indexes[key] = ProjectIndex(on_ci, ci_functions_file)
+    else:
+        project_index.refresh()
+    return project_index
+
+
+def file_signature(filepath):
+    """Get the modification time (ns) and size of a file, which change when the file is rewritten
+
+    Arguments:
+        filepath {str} -- path to the file
+
+    Returns:
+        tuple -- modification time and size
+    """
+    stat = os.stat(filepath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def input_filepath(kind: str, layout: FeatureLayout, arguments: dict, compositions_directory, on_ci: bool):
+    """Get the path of an input file referenced by a step
+
+    Arguments:
+        kind {str} -- kind of input (claim, composition, etc)
+        layout {FeatureLayout} -- layout of the feature folder
+        arguments {dict} -- arguments of the step
+        compositions_directory {str} -- current compositions directory
+        on_ci {bool} -- running on CI
+
+    Returns:
+        Path -- path of the input file
+    """
+    if kind in (CLAIM, OBSERVED):
+        filename = arguments.get("claim_file") or arguments.get("observed_state_file")
+        return layout.base_path / "resources" / filename
+    if kind == COMPOSITION:
+        if "composition_directory" in arguments:
+            return layout.project_root / "pkg" / arguments["composition_directory"] / arguments["composition_file"]
+        return Path(compositions_directory) / arguments["composition_file"]
+    if kind == ENVCONFIG:
+        return layout.base_path.parent / arguments["envconfig_file"]
+    return layout.functions_folder_path / functions_filename(arguments["functions_file"], on_ci)
+
+
+def functions_filename(functions_file: str, on_ci: bool):
+    """Get the name of the functions file to use. If running on CI, the CI version of the functions file is used.
+
+    Arguments:
+        functions_file {str} -- functions filename (e.g. functions.yaml)
+        on_ci {bool} -- running on CI
+
+    Returns:
+        str -- functions filename (e.g. functions-ci.yaml on CI)
+    """
+    if on_ci:
+        return f"{functions_file.split('.yaml')[0]}-ci.yaml"
+    return functions_file
@@ -0,0 +1,260 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import hashlib
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import PIPELINE_PREFIX_RENDERS_CACHE_SIZE
+from steps.utils.render import RenderTimeoutError
+from steps.utils.render_cache import MemoryRenderCache
+from steps.utils.utils import parse_desired_output
+
+# Name of the composite resource in the provenance, like in the checks of the steps
+COMPOSITE = "composite"
+# List indexes separated by dots in the keypaths of the steps, e.g. status.conditions.0.type
+DOTTED_LIST_INDEX = re.compile(r"\.(\d+)(?=\.|\[|$)")
+# Renders of the pipeline prefixes of the process, used when there is no render cache on disk
+prefix_renders = MemoryRenderCache(PIPELINE_PREFIX_RENDERS_CACHE_SIZE)
+
+
+@dataclass
+class PipelineProvenance:
+    """Pipeline steps that set and changed each field of the desired resources and of the composite resource.
+    The composition is rendered with its pipeline truncated after each step, the outputs of consecutive prefixes
+    are compared field by field.
+    """
+    # Pipeline steps, as "step (function)"
+    steps: list
+    # object name (resource name or composite) -> field path -> {"first_set_by", "last_changed_by", "value"},
+    # without value when the field is removed by the last change
+    fields: dict
+    # pipeline step -> render error of the pipeline truncated after that step
+    errors: dict = field(default_factory=dict)
+
+    def blame(self, name: str, key: str):
+        """Describe the pipeline steps responsible for a field, or for the fields under it
+
+        Arguments:
+            name {str} -- resource name, or composite
+            key {str} -- field path, e.g. spec.forProvider.policyArn
+
+        Returns:
+            str -- description
+        """
+        fields = self.fields.get(name) or {}
+        path = normalize_path(key)
+        provenance = fields.get(path)
+        if provenance is None:
+            # The closest field above the key, e.g. a list or a string holding the key, or the fields below it
+            parents = [p for p in fields if path.startswith(f"{p}.") or path.startswith(f"{p}[")]
+            children = [p for p in fields if p.startswith(f"{path}.") or p.startswith(f"{path}[")]
+            if parents:
+                path = max(parents, key=len)
+                provenance = fields[path]
+            elif children:
+                path = max(children, key=lambda p: self.steps.index(fields[p]["last_changed_by"]))
+                provenance = fields[path]
+        if provenance is None:
+            return f"{key} of {name} is not set by any pipeline step"
+        first, last = provenance["first_set_by"], provenance["last_changed_by"]
+        change = "removed" if "value" not in provenance else "last changed"
+        description = f"{path} of {name} was first set by pipeline step {first}"
+        if last != first or change == "removed":
+            description += f" and {change} by pipeline step {last}"
+        return description
+
+    def rows(self):
+        return [(name, path, provenance["first_set_by"], provenance["last_changed_by"])
+                for name, fields in self.fields.items() for path, provenance in fields.items()]
+
+
+def pipeline_steps(composition: dict):
+    """Get the steps of the pipeline of a composition
+
+    Arguments:
+        composition {dict} -- composition
+
+    Returns:
+        list -- steps, as "step (function)"
+    """
+    return [f"{step.get('step')} ({(step.get('functionRef') or {}).get('name')})"
+            for step in (composition.get("spec") or {}).get("pipeline") or []]
+
+
+def truncated_compositions(composition: dict, directory):
+    """Write the composition with its pipeline truncated after each of its steps but the last. The files are named
+    by content, so that the renders of the same prefixes (e.g. from several scenarios) can be found in the render
+    cache.
+
+    Arguments:
+        composition {dict} -- composition
+        directory {str} -- directory of the truncated compositions
+
+    Returns:
+        list -- filepaths of the compositions truncated after the first step, the second step, etc.
+    """
+    directory = Path(directory)
+    directory.mkdir(exist_ok=True, parents=True)
+    pipeline = composition["spec"]["pipeline"]
+    filepaths = []
+    for k in range(1, len(pipeline)):
+        truncated = copy.deepcopy(composition)
+        truncated["spec"]["pipeline"] = pipeline[:k]
+        content = yaml.safe_dump(truncated, sort_keys=False).encode("utf-8")
+        filepath = directory / f"{hashlib.blake2b(content, digest_size=16).hexdigest()}.yaml"
+        if not filepath.exists():
+            fd, tmp_filepath = tempfile.mkstemp(dir=directory, prefix=f".{filepath.name}.", suffix=".tmp")
+            with os.fdopen(fd, mode="wb") as file:
+                file.write(content)
+            os.replace(tmp_filepath, filepath)
+        filepaths.append(filepath)
+    return filepaths
+
+
+def bisect_pipeline(composition_filepath, render, render_output: str, directory, workers: int):
+    """Attribute the fields of a render to the steps of the pipeline of its composition. The composition is rendered
+    with the same inputs and its pipeline truncated after each step, in parallel, and the output of each prefix is
+    compared to the output of the previous one. The full pipeline is not rendered again.
+
+    Arguments:
+        composition_filepath {str} -- composition
+        render {callable} -- renders a composition with the inputs of the render, returns the
+            subprocess.CompletedProcess of the render
+        render_output {str} -- output of the render with the full pipeline
+        directory {str} -- directory of the truncated compositions
+        workers {int} -- maximum number of renders running at the same time
+
+    Returns:
+        PipelineProvenance -- provenance of the fields
+    """
+    with open(composition_filepath, mode="r", encoding="utf-8") as file:
+        composition = yaml.safe_load(file)
+    steps = pipeline_steps(composition)
+    if not steps:
+        return PipelineProvenance(steps, {})
+    filepaths = truncated_compositions(composition, directory)
+
+    def render_prefix(filepath):
+        try:
+            out = render(filepath)
+        except RenderTimeoutError as e:
+            return None, str(e)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit code {out.returncode}"
+        return out.stdout, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(render_prefix, filepaths))
+    results.append((render_output, None))
+
+    fields = {}
+    errors = {}
+    previous = {}
+    for step, (output, error) in zip(steps, results):
+        if error is not None:
+            # The fields changed by a step whose prefix does not render are attributed to the next steps
+            errors[step] = error
+            continue
+        current = flatten_output(output)
+        for name in previous.keys() | current.keys():
+            before, after = previous.get(name) or {}, current.get(name) or {}
+            object_fields = fields.setdefault(name, {})
+            for path in before.keys() | after.keys():
+                if path in before and path in after and before[path] == after[path]:
+                    continue
+                provenance = object_fields.setdefault(path, {"first_set_by": step})
+                provenance["last_changed_by"] = step
+                if path in after:
+                    provenance["value"] = after[path]
+                else:
+                    provenance.pop("value", None)
+        previous = current
+    return PipelineProvenance(steps, {name: dict(sorted(object_fields.items()))
+                                      for name, object_fields in fields.items()}, errors)
+
+
+def flatten_output(render_output: str):
+    desired_xr, desired_resources = parse_desired_output(render_output)
+    return {name: flatten(resource) for name, resource in [(COMPOSITE, desired_xr), *desired_resources.items()]}
+
+
+def flatten(value, path: str = "", fields: dict = None):
+    """Flatten a resource into its leaf fields, e.g. spec.forProvider.policyArn or status.conditions[0].type.
+    Empty dicts and lists are leaves.
+
+    Arguments:
+        value -- resource, or value of a field
+
+    Keyword Arguments:
+        path {str} -- path of the value (default: {""})
+        fields {dict} -- fields already flattened (default: {None})
+
+    Returns:
+        dict -- values of the leaf fields by path
+    """
+    fields = {} if fields is None else fields
+    if isinstance(value, dict) and value:
+        for key, item in value.items():
+            flatten(item, f"{path}.{key}" if path else str(key), fields)
+    elif isinstance(value, list) and value:
+        for index, item in enumerate(value):
+            flatten(item, f"{path}[{index}]", fields)
+    else:
+        fields[path] = value
+    return fields
+
+
+def normalize_path(key: str):
+    return DOTTED_LIST_INDEX.sub(r"[\1]", key)
+
+
+def write_provenance_report(filepath_prefix, provenance: PipelineProvenance):
+    """Write the provenance of the fields as JSON
+
+    Arguments:
+        filepath_prefix {str} -- path of the report file, without extension
+        provenance {PipelineProvenance} -- provenance of the fields
+
+    Returns:
+        Path -- path of the written file
+    """
+    filepath = Path(filepath_prefix).with_suffix(".json")
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, mode="w", encoding="utf-8") as file:
+        json.dump({"steps": provenance.steps, "errors": provenance.errors, "fields": provenance.fields}, file,
+                  indent=2, default=str)
+    return filepath
+
+
+def read_provenance_report(filepath):
+    """Read the provenance of the fields written by write_provenance_report
+
+    Arguments:
+        filepath {str} -- path of the report file
+
+    Returns:
+        PipelineProvenance -- provenance of the fields
+    """
+    with open(filepath, mode="r", encoding="utf-8") as file:
+        report = json.load(file)
+    return PipelineProvenance(report["steps"], report["fields"], report.get("errors") or {})
@@ -0,0 +1,418 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from steps.utils.constants import FUNCTION_PORT, FUNCTION_STARTUP_TIMEOUT_SECONDS, KEEP_CONTAINER_LABEL, RENDER_TRANSIENT_ERRORS
+
+logger = logging.getLogger("xplane-composition-tester logger")
+logger.setLevel(logging.INFO)
+
+
+# Scheduler of the renders of the process, see set_render_scheduler
+_render_scheduler = None
+
+
+class RenderTimeoutError(Exception):
+    """Raised when a render subprocess does not finish within its timeout"""
+
+
+class RenderWatchdog:
+    """Keep track of the render subprocesses and of the function containers they leave behind.
+
+    Every render runs in its own process group so that a hung render can be killed together with
+    the children it spawned. The function images are collected from the functions files used by the
+    renders, so that leftover containers of these images can be reaped at the end of a scenario or
+    of the test suite. Containers that already existed when the watchdog was created are never reaped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._images = set()
+        self._functions_files = set()
+        self._preexisting_containers = set()
+
+    def register(self, process: subprocess.Popen):
+        """Start watching a render subprocess"""
+        with self._lock:
+            self._processes.add(process)
+
+    def unregister(self, process: subprocess.Popen):
+        """Stop watching a render subprocess"""
+        with self._lock:
+            self._processes.discard(process)
+
+    def watch_functions(self, functions_filepath):
+        """Collect the function images from a functions file
+
+        Arguments:
+            functions_filepath {str} -- path to the functions file
+        """
+        functions_filepath = str(functions_filepath)
+        with self._lock:
+            if functions_filepath in self._functions_files:
+                return
+            self._functions_files.add(functions_filepath)
+
+        images = read_function_images(functions_filepath)
+        # Snapshot the containers of the new images before any render of ours creates one
+        preexisting = list_containers(images - self._images)
+        with self._lock:
+            self._images.update(images)
+            self._preexisting_containers.update(preexisting)
+
+    def kill_all(self):
+        """Kill the process groups of all the render subprocesses that are still alive
+
+        Returns:
+            int -- number of killed process groups
+        """
+        with self._lock:
+            processes = list(self._processes)
+            self._processes.clear()
+
+        killed = 0
+        for process in processes:
+            if process.poll() is None:
+                kill_process_group(process)
+                killed += 1
+        return killed
+
+    def reap(self):
+        """Kill leftover render subprocesses and remove the function containers created during the run
+
+        Returns:
+            int -- number of removed containers
+        """
+        killed = self.kill_all()
+        if killed:
+            logger.warning(f"killed {killed} leftover render process(es)")
+
+        with self._lock:
+            images = set(self._images)
+            preexisting = set(self._preexisting_containers)
+
+        # The containers kept for the whole run (e.g. warm functions) are not leftovers
+        preexisting |= list_kept_containers() if images else set()
+        leftovers = [c for c in list_containers(images) if c not in preexisting]
+        if leftovers:
+            remove_containers(leftovers)
+            logger.info(f"reaped {len(leftovers)} leftover function container(s)")
+        return len(leftovers)
+
+
+def read_function_images(functions_filepath):
+    """Read the packages of the functions defined in a functions file
+
+    Arguments:
+        functions_filepath {str} -- path to the functions file
+
+    Returns:
+        set -- function packages (docker images)
+    """
+    try:
+        with open(functions_filepath, mode="r", encoding="utf-8") as file:
+            functions = [f for f in yaml.safe_load_all(file) if f]
+    except (OSError, yaml.YAMLError) as e:
+        logger.warning(f"could not read functions file {functions_filepath}: {e}")
+        return set()
+
+    return {f["spec"]["package"] for f in functions
+            if f.get("kind") == "Function" and f.get("spec", {}).get("package")}
+
+
+def docker_available():
+    return shutil.which("docker") is not None
+
+
+def list_containers(images):
+    """List the ids of all containers (running or stopped) created from the given images
+
+    Arguments:
+        images {set} -- docker images
+
+    Returns:
+        set -- container ids
+    """
+    if not images or not docker_available():
+        return set()
+
+    args = ["docker", "ps", "--all", "--quiet", "--no-trunc"]
+    for image in sorted(images):
+        args += ["--filter", f"ancestor={image}"]
+    try:
+        out = subprocess.run(args, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"could not list function containers: {e}")
+        return set()
+    if out.returncode != 0:
+        logger.warning(f"could not list function containers: {out.stderr}")
+        return set()
+    return set(out.stdout.split())
+
+
+def list_kept_containers():
+    """List the ids of the function containers kept for the whole test run
+
+    Returns:
+        set -- container ids
+    """
+    if not docker_available():
+        return set()
+    try:
+        out = subprocess.run(["docker", "ps", "--all", "--quiet", "--no-trunc", "--filter", f"label={KEEP_CONTAINER_LABEL}"],
+                             capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"could not list kept function containers: {e}")
+        return set()
+    return set(out.stdout.split()) if out.returncode == 0 else set()
+
+
+def start_function_container(image: str):
+    """Start a function as a docker container kept for the whole test run, and wait until it accepts connections
+
+    Arguments:
+        image {str} -- function package (docker image)
+
+    Raises:
+        AssertionError: the function could not be started
+
+    Returns:
+        tuple -- container id, host and port of the function
+    """
+    out = subprocess.run(
+        ["docker", "run", "--rm", "--detach", "--label", f"{KEEP_CONTAINER_LABEL}=true",
+         "--publish", f"127.0.0.1::{FUNCTION_PORT}", image, "--insecure"],
+        capture_output=True, text=True)
+    assert out.returncode == 0, f"error starting function {image}: {out.stderr}"
+    container = out.stdout.strip()
+
+    out = subprocess.run(["docker", "port", container, str(FUNCTION_PORT)], capture_output=True, text=True)
+    if out.returncode != 0:
+        remove_containers([container])
+        assert False, f"error getting the port of function {image}: {out.stderr}"
+    host, port = out.stdout.split()[0].rsplit(":", 1)
+    wait_for_port(host, int(port), FUNCTION_STARTUP_TIMEOUT_SECONDS)
+    return container, host, int(port)
+
+
+def wait_for_port(host: str, port: int, timeout: float):
+    """Wait until a TCP port accepts connections
+
+    Raises:
+        AssertionError: port does not accept connections within the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            assert time.monotonic() < deadline, f"{host}:{port} not reachable after {timeout}s"
+            time.sleep(0.2)
+
+
+def remove_containers(container_ids):
+    """Force remove the given containers
+
+    Arguments:
+        container_ids {list} -- container ids
+    """
+    try:
+        out = subprocess.run(["docker", "rm", "--force", *container_ids],
+                             capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"could not remove function containers: {e}")
+        return
+    if out.returncode != 0:
+        logger.warning(f"could not remove function containers: {out.stderr}")
+
+
+def kill_process_group(process: subprocess.Popen):
+    """Kill a process started in its own session, together with all its children
+
+    Arguments:
+        process {subprocess.Popen} -- process to kill
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        process.kill()
+
+
+def is_transient_error(stderr: str):
+    """Check if a render failure is likely due to a transient issue of the function runtime
+    (e.g. docker daemon not reachable or function not ready yet)
+
+    Arguments:
+        stderr {str} -- standard error of the render
+
+    Returns:
+        bool -- True if the render should be retried
+    """
+    stderr = (stderr or "").lower()
+    return any(pattern in stderr for pattern in RENDER_TRANSIENT_ERRORS)
+
+
+def run_render(args, timeout: float = None, retries: int = 0, backoff: float = 1.0, watchdog: RenderWatchdog = None,
+               metrics=None, cache=None, cache_key: str = None):
+    """Run the crossplane render command. The render is killed, with all its children, if it takes more than
+    the given timeout. Timeouts and transient runtime failures are retried with an exponential backoff.
+    With a render cache, a render with the same inputs as a previous one is not run again, only its successful or
+    deterministically failed results are cached.
+
+    Arguments:
+        args {list} -- crossplane render command arguments
+
+    Keyword Arguments:
+        timeout {float} -- timeout in seconds for one render attempt, no timeout if None (default: {None})
+        retries {int} -- number of retries after a timeout or a transient failure (default: {0})
+        backoff {float} -- delay in seconds before the first retry, doubled at each retry (default: {1.0})
+        watchdog {RenderWatchdog} -- watchdog tracking the render subprocesses (default: {None})
+        metrics {Metrics} -- metrics of the test run, counting the render attempts (default: {None})
+        cache {RenderCache} -- results of the previous renders (default: {None})
+        cache_key {str} -- key of the render in the cache, computed from args if None, e.g. given when the args
+            use a rewritten functions file (default: {None})
+
+    Raises:
+        RenderTimeoutError: last render attempt timed out
+
+    Returns:
+        subprocess.CompletedProcess -- result of the last render attempt. Unless it comes from the cache, its duration
+            attribute is the wall time of that attempt in seconds, without the retries before it and the wait for a
+            render slot
+    """
+    if cache:
+        cache_key = cache_key or cache.key(args)
+        out = cache.get(cache_key, args)
+        if metrics:
+            metrics.inc("cache_lookups", cache="render", result="miss" if out is None else "hit")
+        if out is not None:
+            return out
+
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.monotonic()
+        try:
+            out = _run_scheduled_render(args, timeout, watchdog)
+        except RenderTimeoutError:
+            _record_render_attempt(metrics, start, "timeout")
+            if attempt > retries:
+                raise
+            logger.warning(f"render attempt {attempt} timed out after {timeout}s, retrying")
+        else:
+            _record_render_attempt(metrics, start, "success" if out.returncode == 0 else "failure")
+            transient = out.returncode != 0 and is_transient_error(out.stderr)
+            if cache and not transient:
+                cache.put(cache_key, out)
+            if out.returncode == 0 or attempt > retries or not transient:
+                return out
+            logger.warning(f"render attempt {attempt} failed with a transient error, retrying: {out.stderr}")
+        if metrics:
+            metrics.inc("render_retries")
+
+        time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def run_renders(args_list, workers: int, **kwargs):
+    """Run many crossplane render commands with a bounded pool of workers.
+    A render that times out is reported like a failed render, with a -1 return code.
+
+    Arguments:
+        args_list {list} -- crossplane render command arguments of each render
+        workers {int} -- maximum number of renders running at the same time
+
+    Keyword Arguments:
+        kwargs -- keyword arguments passed to run_render (timeout, retries, backoff, watchdog, metrics)
+
+    Returns:
+        list -- results (subprocess.CompletedProcess) of the renders, in the same order as args_list
+    """
+    def run(args):
+        try:
+            return run_render(args, **kwargs)
+        except RenderTimeoutError as e:
+            return subprocess.CompletedProcess(args, -1, "", str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(run, args_list))
+
+
+def _record_render_attempt(metrics, start, result):
+    if metrics:
+        metrics.observe("render_duration_seconds", time.monotonic() - start)
+        metrics.inc("renders", result=result)
+
+
+def set_render_scheduler(scheduler):
+    """Run the renders of the process, from all the steps and threads, through a scheduler limiting the renders
+    running at the same time
+
+    Arguments:
+        scheduler {RenderScheduler} -- scheduler, None to run the renders right away
+    """
+    global _render_scheduler
+    _render_scheduler = scheduler
+
+
+def _run_scheduled_render(args, timeout, watchdog):
+    scheduler = _render_scheduler
+    if scheduler is None:
+        return _run_render_once(args, timeout, watchdog)
+    with scheduler.slot():
+        start_time, start = time.time(), time.monotonic()
+        try:
+            out = _run_render_once(args, timeout, watchdog)
+        except RenderTimeoutError:
+            scheduler.record(start_time, time.monotonic() - start, overloaded=True)
+            raise
+        duration = time.monotonic() - start
+    scheduler.record(start_time, duration, overloaded=out.returncode != 0 and is_transient_error(out.stderr))
+    return out
+
+
+def _run_render_once(args, timeout, watchdog):
+    start = time.monotonic()
+    # Start the render in a new session so that we can kill its whole process group on timeout
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               start_new_session=True)
+    if watchdog:
+        watchdog.register(process)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        process.communicate()
+        raise RenderTimeoutError(f"render did not finish within {timeout}s: {' '.join(map(str, args))}")
+    finally:
+        if watchdog:
+            watchdog.unregister(process)
+
+    out = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    out.duration = time.monotonic() - start
+    return out
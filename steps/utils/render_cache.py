@@ -0,0 +1,125 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_VERSION = b"render-cache-v1"
+
+
+class RenderCache:
+    """Results of the renders on disk, by content of their inputs (claim, composition, functions, environment
+    config, observed resources). A render whose inputs did not change is not run again, e.g. the first render of
+    the scenarios of a feature, or the renders of the compositions that a mutant did not change. The cache can be
+    shared by several processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def key(self, args):
+        """Get the key of a render, from the content of the files of its arguments
+
+        Arguments:
+            args {list} -- crossplane render command arguments
+
+        Returns:
+            str -- key of the render
+        """
+        digest = hashlib.blake2b(CACHE_VERSION, digest_size=20)
+        for arg in args:
+            arg = str(arg)
+            digest.update(b"\0")
+            if os.path.isfile(arg):
+                digest.update(b"file:" + file_digest(arg))
+            elif os.path.isdir(arg):
+                for filepath in sorted(Path(arg).rglob("*")):
+                    if filepath.is_file():
+                        digest.update(b"dir-file:" + str(filepath.relative_to(arg)).encode() + file_digest(filepath))
+            else:
+                digest.update(b"arg:" + arg.encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, args):
+        """Get the result of a render
+
+        Arguments:
+            key {str} -- key of the render, see key
+            args {list} -- crossplane render command arguments, set in the result
+
+        Returns:
+            subprocess.CompletedProcess -- result of the render, None if it is not in the cache
+        """
+        try:
+            with open(self._filepath(key), mode="r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return subprocess.CompletedProcess(args, entry["returncode"], entry["stdout"], entry["stderr"])
+
+    def put(self, key: str, out: subprocess.CompletedProcess):
+        """Store the result of a render, atomically so that the other processes never read a partial result
+
+        Arguments:
+            key {str} -- key of the render, see key
+            out {subprocess.CompletedProcess} -- result of the render
+        """
+        filepath = self._filepath(key)
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=filepath.parent, prefix=f".{key}.", suffix=".tmp")
+        with os.fdopen(fd, mode="w", encoding="utf-8") as file:
+            json.dump({"returncode": out.returncode, "stdout": out.stdout, "stderr": out.stderr}, file)
+        os.replace(tmp_filepath, filepath)
+
+    def _filepath(self, key: str):
+        return self.directory / key[:2] / f"{key}.json"
+
+
+class MemoryRenderCache(RenderCache):
+    """Results of the last renders in memory, for the renders repeated within a process when there is no render cache
+    on disk, e.g. the pipeline prefixes shared by the scenarios rendering the same claim
+    """
+
+    def __init__(self, max_entries: int):
+        self.directory = None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (returncode, stdout, stderr), least recently used first
+        self._entries = OrderedDict()
+
+    def get(self, key: str, args):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        return subprocess.CompletedProcess(args, *entry)
+
+    def put(self, key: str, out: subprocess.CompletedProcess):
+        with self._lock:
+            self._entries[key] = (out.returncode, out.stdout, out.stderr)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def file_digest(filepath):
+    with open(filepath, mode="rb") as file:
+        return hashlib.blake2b(file.read(), digest_size=20).digest()
@@ -0,0 +1,110 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import FUNCTION_DEVELOPMENT_TARGET_ANNOTATION, FUNCTION_RUNTIME_ANNOTATION
+from steps.utils.render import remove_containers, start_function_container
+
+_shared_function_runtimes = None
+
+
+class FunctionRuntimes:
+    """Keep the composition functions warm: each function package is started once as a docker container, and the
+    functions files are rewritten to use them with the Development runtime, so that the renders do not start
+    (and stop) a container per function and per render.
+
+    The functions that already use the Development runtime are left as they are.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # function package -> development target (host:port)
+        self._targets = {}
+        self._containers = []
+        # original functions file -> (modification time, functions file using the warm functions)
+        self._functions_files = {}
+
+    def functions_filepath(self, functions_filepath, output_directory):
+        """Get a copy of the functions file where all functions use their warm container
+
+        Arguments:
+            functions_filepath {str} -- path to the functions file
+            output_directory {str} -- directory where the rewritten functions file is written
+
+        Returns:
+            Path -- path to the rewritten functions file
+        """
+        functions_filepath = os.path.abspath(functions_filepath)
+        mtime = os.stat(functions_filepath).st_mtime
+        with self._lock:
+            cached = self._functions_files.get(functions_filepath)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            with open(functions_filepath, mode="r", encoding="utf-8") as file:
+                functions = [f for f in yaml.safe_load_all(file) if f]
+            for function in functions:
+                metadata = function.setdefault("metadata", {})
+                annotations = metadata.get("annotations") or {}
+                if function.get("kind") != "Function" or annotations.get(FUNCTION_RUNTIME_ANNOTATION) == "Development":
+                    continue
+                annotations[FUNCTION_RUNTIME_ANNOTATION] = "Development"
+                annotations[FUNCTION_DEVELOPMENT_TARGET_ANNOTATION] = self._target_for(function["spec"]["package"])
+                metadata["annotations"] = annotations
+
+            digest = hashlib.sha256(functions_filepath.encode()).hexdigest()[:12]
+            warm_filepath = Path(output_directory) / f"functions-{digest}.yaml"
+            warm_filepath.parent.mkdir(exist_ok=True, parents=True)
+            with open(warm_filepath, mode="w", encoding="utf-8") as file:
+                yaml.safe_dump_all(functions, file)
+            self._functions_files[functions_filepath] = (mtime, warm_filepath)
+            return warm_filepath
+
+    def close(self):
+        """Remove the function containers"""
+        with self._lock:
+            containers, self._containers = self._containers, []
+            self._targets.clear()
+            self._functions_files.clear()
+        if containers:
+            remove_containers(containers)
+
+    def _target_for(self, image: str):
+        target = self._targets.get(image)
+        if target is None:
+            container, host, port = start_function_container(image)
+            self._containers.append(container)
+            target = self._targets[image] = f"{host}:{port}"
+        return target
+
+
+def shared_function_runtimes():
+    """Get the warm functions of the process. They are started on first use and kept until the process exits,
+    so that a long running process (e.g. the tester daemon) reuses them across test runs.
+
+    Returns:
+        FunctionRuntimes -- warm functions
+    """
+    global _shared_function_runtimes
+    if _shared_function_runtimes is None:
+        _shared_function_runtimes = FunctionRuntimes()
+        atexit.register(_shared_function_runtimes.close)
+    return _shared_function_runtimes
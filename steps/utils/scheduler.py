@@ -0,0 +1,201 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from steps.utils.constants import (
+    ADAPTIVE_CONCURRENCY_BASELINE_DRIFT,
+    ADAPTIVE_CONCURRENCY_DECREASE_FACTOR,
+    ADAPTIVE_CONCURRENCY_INITIAL_LIMIT,
+    ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE,
+    ADAPTIVE_CONCURRENCY_MIN_WINDOW,
+    ADAPTIVE_CONCURRENCY_STALE_WINDOW_SECONDS,
+    ADAPTIVE_CONCURRENCY_THROUGHPUT_TOLERANCE,
+    RENDER_SLOT_POLL_MAX_SECONDS,
+    RENDER_SLOT_POLL_MIN_SECONDS,
+    RENDER_SLOTS_LIMIT_REFRESH_SECONDS,
+)
+
+
+class RenderScheduler:
+    """Limit of the renders running at the same time on the machine, shared by all the processes using the same
+    directory (e.g. the workers of the mutation tester, several test runs, the tester daemon) and by their threads.
+
+    A render holds one of the lock files slot-0 ... slot-<limit - 1> of the directory while it runs. The limit is
+    adjusted from the renders of all the processes, AIMD-style: after each window of renders, it is increased by one
+    while the median render latency stays close to its baseline and the throughput does not drop, and it is
+    multiplied by ADAPTIVE_CONCURRENCY_DECREASE_FACTOR when the latency grows (the renders queue for CPU, memory or
+    the Docker daemon), the throughput drops, or a render times out or fails with a transient error. The learned
+    limit is kept in the directory for the next runs.
+    """
+
+    def __init__(self, directory, max_limit: int, metrics=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.max_limit = max(1, max_limit)
+        self.metrics = metrics
+        self._state_filepath = self.directory / "state.json"
+        self._lock_filepath = self.directory / "state.lock"
+        # Limit read from the state, and when it was read
+        self._limit, self._limit_read = None, 0.0
+        self._lock = threading.Lock()
+        # Limits seen by the renders of this process, and adjustments made by them
+        self.min_limit_seen, self.max_limit_seen = None, None
+        self.increases, self.decreases = 0, 0
+
+        with self._state() as state:
+            if state.get("max_limit") != self.max_limit:
+                state.clear()
+                state.update(max_limit=self.max_limit,
+                             limit=min(self.max_limit, ADAPTIVE_CONCURRENCY_INITIAL_LIMIT))
+            state["limit"] = min(state["limit"], self.max_limit)
+            window = state.get("window")
+            if not window or time.time() - window["start"] > ADAPTIVE_CONCURRENCY_STALE_WINDOW_SECONDS:
+                state["window"] = {"start": time.time(), "durations": []}
+
+    def limit(self):
+        """Get the current limit, read from the state shared by the processes at most every
+        RENDER_SLOTS_LIMIT_REFRESH_SECONDS
+
+        Returns:
+            int -- maximum number of renders running at the same time
+        """
+        with self._lock:
+            if self._limit is None or time.monotonic() - self._limit_read > RENDER_SLOTS_LIMIT_REFRESH_SECONDS:
+                try:
+                    with open(self._state_filepath, mode="r", encoding="utf-8") as file:
+                        self._limit = json.load(file)["limit"]
+                except (OSError, ValueError, KeyError):
+                    self._limit = self._limit or 1
+                self._limit_read = time.monotonic()
+                self.min_limit_seen = min(self.min_limit_seen or self._limit, self._limit)
+                self.max_limit_seen = max(self.max_limit_seen or self._limit, self._limit)
+            return self._limit
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free render slot and hold it. The slots above the limit are not taken, so that the renders
+        drain when the limit decreases.
+        """
+        start = time.monotonic()
+        delay = RENDER_SLOT_POLL_MIN_SECONDS
+        fd = None
+        while fd is None:
+            for index in range(self.limit()):
+                slot_fd = os.open(self.directory / f"slot-{index}", os.O_CREAT | os.O_RDWR, 0o644)
+                try:
+                    fcntl.flock(slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(slot_fd)
+                    continue
+                fd = slot_fd
+                break
+            else:
+                time.sleep(delay)
+                delay = min(delay * 2, RENDER_SLOT_POLL_MAX_SECONDS)
+        if self.metrics:
+            self.metrics.observe("render_slot_wait_seconds", time.monotonic() - start)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def record(self, start: float, duration: float, overloaded: bool = False):
+        """Record a finished render, and adjust the limit at the end of a window of renders, i.e. once twice as many
+        renders as the limit (at least ADAPTIVE_CONCURRENCY_MIN_WINDOW) started and finished with the current limit,
+        or right away when overloaded
+
+        Arguments:
+            start {float} -- time (epoch) the render started
+            duration {float} -- wall time of the render in seconds
+
+        Keyword Arguments:
+            overloaded {bool} -- the render timed out or failed with a transient error (default: {False})
+        """
+        with self._state() as state:
+            window = state["window"]
+            if start < window["start"]:
+                # Started before the last adjustment, its outcome does not reflect the current limit
+                return
+            window["durations"].append(duration)
+            durations = window["durations"]
+            limit = state["limit"]
+            if not overloaded and len(durations) < max(2 * limit, ADAPTIVE_CONCURRENCY_MIN_WINDOW):
+                return
+
+            now = time.time()
+            latency = statistics.median(durations)
+            throughput = len(durations) / max(now - window["start"], 1e-3)
+            baseline = state.get("baseline_latency")
+            previous = state.get("previous_window")
+            # The throughput dropped although the limit did not decrease
+            throughput_dropped = (previous is not None and limit >= previous["limit"] and
+                                  throughput < previous["throughput"] * (1 - ADAPTIVE_CONCURRENCY_THROUGHPUT_TOLERANCE))
+            latency_grew = baseline is not None and latency > baseline * (1 + ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE)
+            if overloaded or latency_grew or throughput_dropped:
+                new_limit = max(1, int(limit * ADAPTIVE_CONCURRENCY_DECREASE_FACTOR))
+            else:
+                new_limit = min(self.max_limit, limit + 1)
+            # The baseline follows the latency down right away, and up slowly, e.g. when the compositions rendered
+            # by the next scenarios are slower
+            state["baseline_latency"] = (latency if baseline is None else
+                                         min(latency, baseline * (1 + ADAPTIVE_CONCURRENCY_BASELINE_DRIFT) ** (
+                                             (now - window["start"]) / 60)))
+            state["previous_window"] = {"limit": limit, "throughput": throughput, "latency": latency}
+            state["window"] = {"start": now, "durations": []}
+            state["limit"] = new_limit
+            if new_limit > limit:
+                self.increases += 1
+            elif new_limit < limit:
+                self.decreases += 1
+
+        with self._lock:
+            self._limit, self._limit_read = new_limit, time.monotonic()
+            self.min_limit_seen = min(self.min_limit_seen or new_limit, new_limit)
+            self.max_limit_seen = max(self.max_limit_seen or new_limit, new_limit)
+
+    def summary(self):
+        limit = self.limit()
+        if self.metrics:
+            self.metrics.set("render_concurrency_limit", limit)
+        return (f"Render concurrency limit: {limit} (between {self.min_limit_seen} and {self.max_limit_seen} during "
+                f"the run, at most {self.max_limit}), {self.increases} increases and {self.decreases} decreases")
+
+    @contextmanager
+    def _state(self):
+        """State shared by the processes, read and written under an exclusive lock"""
+        with open(self._lock_filepath, mode="a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._state_filepath, mode="r", encoding="utf-8") as file:
+                        state = json.load(file)
+                except (OSError, ValueError):
+                    state = {}
+                yield state
+                fd, tmp_filepath = tempfile.mkstemp(dir=self.directory, prefix=".state.", suffix=".tmp")
+                with os.fdopen(fd, mode="w", encoding="utf-8") as file:
+                    json.dump(state, file)
+                os.replace(tmp_filepath, self._state_filepath)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
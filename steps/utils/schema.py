@@ -0,0 +1,335 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from steps.utils.constants import CROSSPLANE_SPEC_FIELDS
+
+# Maximum number of violations reported for a claim
+MAX_REPORTED_VIOLATIONS = 50
+# Accepted rounding error of the quotient of a number by its multipleOf
+MULTIPLE_OF_TOLERANCE = 1e-9
+
+
+def compile_schema(schema: dict):
+    """Compile an openAPIV3Schema (the structural schemas of kubernetes) into a validator, so that the schema is
+    walked and its patterns are compiled only once, whatever the number of values validated.
+
+    The following keywords are checked: type, nullable, enum, properties, required, additionalProperties,
+    x-kubernetes-preserve-unknown-fields, x-kubernetes-int-or-string, items, minItems, maxItems, uniqueItems,
+    minProperties, maxProperties, minimum, maximum, exclusiveMinimum, exclusiveMaximum, multipleOf, minLength,
+    maxLength, pattern, allOf, anyOf, oneOf and not. Formats and CEL validation rules are not checked. The fields
+    not in the properties of an object are reported as unknown, like kubectl does with the strict field validation.
+
+    The values set from the data tables of the steps are strings: a string is accepted for an integer, a number
+    or a boolean if it parses as one.
+
+    Arguments:
+        schema {dict} -- openAPIV3Schema
+
+    Returns:
+        callable -- validate(value, path, violations), appending one message per violation to violations
+    """
+    if not isinstance(schema, dict) or not schema:
+        return _accept
+
+    schema_type = "int-or-string" if schema.get("x-kubernetes-int-or-string") else schema.get("type")
+    nullable = schema.get("nullable", False)
+    checks = []
+    if "enum" in schema:
+        checks.append(_compile_enum(schema["enum"]))
+    if schema_type in ("integer", "number", "int-or-string"):
+        checks += _compile_number_checks(schema)
+    if schema_type in ("string", "int-or-string"):
+        checks += _compile_string_checks(schema)
+    if schema_type == "array" or "items" in schema:
+        checks += _compile_array_checks(schema)
+    if schema_type == "object" or "properties" in schema or "additionalProperties" in schema:
+        checks += _compile_object_checks(schema)
+    checks += _compile_combinators(schema)
+
+    def validate(value, path: str, violations: list):
+        if value is None:
+            if not nullable and schema_type:
+                violations.append(f"{path or '<root>'}: must not be null")
+            return
+        if schema_type:
+            value = _coerce(value, schema_type)
+            if not _has_type(value, schema_type):
+                violations.append(f"{path or '<root>'}: expected {schema_type}, got {_type_name(value)} {value!r}"
+                                  if not isinstance(value, (dict, list)) else
+                                  f"{path or '<root>'}: expected {schema_type}, got {_type_name(value)}")
+                return
+        for check in checks:
+            check(value, path, violations)
+
+    return validate
+
+
+def _accept(value, path: str, violations: list):
+    pass
+
+
+def _compile_enum(enum: list):
+    allowed = list(enum)
+
+    def check(value, path, violations):
+        if value not in allowed and str(value) not in (str(item) for item in allowed):
+            violations.append(f"{path}: {value!r} is not one of {allowed}")
+
+    return check
+
+
+def _compile_number_checks(schema: dict):
+    checks = []
+    minimum, maximum = schema.get("minimum"), schema.get("maximum")
+    exclusive_minimum, exclusive_maximum = schema.get("exclusiveMinimum", False), schema.get("exclusiveMaximum", False)
+    multiple_of = schema.get("multipleOf")
+    if minimum is not None:
+        def check_minimum(value, path, violations):
+            if _is_number(value) and (value <= minimum if exclusive_minimum else value < minimum):
+                violations.append(f"{path}: {value} is {'not greater than' if exclusive_minimum else 'less than'} "
+                                  f"the minimum {minimum}")
+        checks.append(check_minimum)
+    if maximum is not None:
+        def check_maximum(value, path, violations):
+            if _is_number(value) and (value >= maximum if exclusive_maximum else value > maximum):
+                violations.append(f"{path}: {value} is {'not less than' if exclusive_maximum else 'greater than'} "
+                                  f"the maximum {maximum}")
+        checks.append(check_maximum)
+    if multiple_of:
+        def check_multiple_of(value, path, violations):
+            # Decimal multiples are not exact in floating point, e.g. 0.3 / 0.1 = 2.9999999999999996
+            if _is_number(value) and abs(value / multiple_of - round(value / multiple_of)) > MULTIPLE_OF_TOLERANCE:
+                violations.append(f"{path}: {value} is not a multiple of {multiple_of}")
+        checks.append(check_multiple_of)
+    return checks
+
+
+def _compile_string_checks(schema: dict):
+    checks = []
+    min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+    if min_length is not None or max_length is not None:
+        def check_length(value, path, violations):
+            if not isinstance(value, str):
+                return
+            if min_length is not None and len(value) < min_length:
+                violations.append(f"{path}: {value!r} is shorter than {min_length} characters")
+            if max_length is not None and len(value) > max_length:
+                violations.append(f"{path}: {value!r} is longer than {max_length} characters")
+        checks.append(check_length)
+    if schema.get("pattern"):
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(value, path, violations):
+            if isinstance(value, str) and not pattern.search(value):
+                violations.append(f"{path}: {value!r} does not match the pattern {pattern.pattern}")
+        checks.append(check_pattern)
+    return checks
+
+
+def _compile_array_checks(schema: dict):
+    validate_item = compile_schema(schema.get("items"))
+    min_items, max_items = schema.get("minItems"), schema.get("maxItems")
+    unique_items = schema.get("uniqueItems", False)
+
+    def check(value, path, violations):
+        if not isinstance(value, list):
+            return
+        if min_items is not None and len(value) < min_items:
+            violations.append(f"{path}: {len(value)} items, expected at least {min_items}")
+        if max_items is not None and len(value) > max_items:
+            violations.append(f"{path}: {len(value)} items, expected at most {max_items}")
+        if unique_items and len({repr(item) for item in value}) < len(value):
+            violations.append(f"{path}: items are not unique")
+        if validate_item is not _accept:
+            for index, item in enumerate(value):
+                validate_item(item, f"{path}[{index}]", violations)
+
+    return [check]
+
+
+def _compile_object_checks(schema: dict):
+    properties = {name: compile_schema(property_schema)
+                  for name, property_schema in (schema.get("properties") or {}).items()}
+    required = list(schema.get("required") or [])
+    additional_properties = schema.get("additionalProperties")
+    min_properties, max_properties = schema.get("minProperties"), schema.get("maxProperties")
+    if isinstance(additional_properties, dict):
+        validate_additional = compile_schema(additional_properties)
+    elif additional_properties is False or (additional_properties is None and properties and
+                                            not schema.get("x-kubernetes-preserve-unknown-fields")):
+        validate_additional = None
+    else:
+        validate_additional = _accept
+
+    def check(value, path, violations):
+        if not isinstance(value, dict):
+            return
+        for name in required:
+            if name not in value:
+                violations.append(f"{_join(path, name)}: required field is missing")
+        if min_properties is not None and len(value) < min_properties:
+            violations.append(f"{path or '<root>'}: {len(value)} fields, expected at least {min_properties}")
+        if max_properties is not None and len(value) > max_properties:
+            violations.append(f"{path or '<root>'}: {len(value)} fields, expected at most {max_properties}")
+        for name, item in value.items():
+            validate_property = properties.get(name, validate_additional)
+            if validate_property is None:
+                violations.append(f"{_join(path, name)}: unknown field (known: {', '.join(properties)})")
+            else:
+                validate_property(item, _join(path, name), violations)
+
+    return [check]
+
+
+def _compile_combinators(schema: dict):
+    checks = []
+    for keyword in ("allOf", "anyOf", "oneOf"):
+        if schema.get(keyword):
+            checks.append(_compile_combinator(keyword, [compile_schema(sub_schema) for sub_schema in schema[keyword]]))
+    if schema.get("not"):
+        validate_not = compile_schema(schema["not"])
+
+        def check_not(value, path, violations):
+            sub_violations = []
+            validate_not(value, path, sub_violations)
+            if not sub_violations:
+                violations.append(f"{path or '<root>'}: must not match the schema of not")
+        checks.append(check_not)
+    return checks
+
+
+def _compile_combinator(keyword: str, validators: list):
+    def check(value, path, violations):
+        results = []
+        for validate in validators:
+            sub_violations = []
+            validate(value, path, sub_violations)
+            results.append(sub_violations)
+        matches = sum(not sub_violations for sub_violations in results)
+        if keyword == "allOf":
+            for sub_violations in results:
+                violations += sub_violations
+        elif keyword == "anyOf" and not matches:
+            violations.append(f"{path or '<root>'}: does not match any of the schemas of anyOf ("
+                              + "; ".join(sub_violations[0] for sub_violations in results) + ")")
+        elif keyword == "oneOf" and matches != 1:
+            violations.append(f"{path or '<root>'}: matches {matches} of the schemas of oneOf, expected 1")
+
+    return check
+
+
+def _coerce(value, schema_type: str):
+    if not isinstance(value, str):
+        return value
+    try:
+        if schema_type == "integer" and re.fullmatch(r"[-+]?\d+", value.strip()):
+            return int(value)
+        if schema_type == "number":
+            return float(value)
+    except ValueError:
+        return value
+    if schema_type == "boolean" and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return value
+
+
+def _has_type(value, schema_type: str):
+    if schema_type == "object":
+        return isinstance(value, dict)
+    if schema_type == "array":
+        return isinstance(value, list)
+    if schema_type == "string":
+        return isinstance(value, str)
+    if schema_type == "boolean":
+        return isinstance(value, bool)
+    if schema_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if schema_type == "number":
+        return _is_number(value)
+    if schema_type == "int-or-string":
+        return isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool))
+    return True
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _type_name(value):
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return type(value).__name__
+
+
+def _join(path: str, name: str):
+    return f"{path}.{name}" if path else name
+
+
+class ClaimValidator:
+    """Validator of the claims and composite resources of a composite resource definition (XRD). The
+    openAPIV3Schema of each version is compiled once, see compile_schema.
+    """
+
+    def __init__(self, definition: dict):
+        spec = (definition or {}).get("spec") or {}
+        self.group = spec.get("group")
+        self.kinds = [names.get("kind") for names in (spec.get("claimNames"), spec.get("names")) if names]
+        self.served = {version.get("name"): version.get("served", True) for version in spec.get("versions") or []}
+        self.validators = {
+            version.get("name"): compile_schema(((version.get("schema") or {}).get("openAPIV3Schema")) or {})
+            for version in spec.get("versions") or []}
+
+    def validate(self, claim: dict):
+        """Validate a claim (or composite resource) against the version of the definition of its apiVersion. The
+        fields added by crossplane to the spec of the claims (e.g. compositionRef) are not validated.
+
+        Arguments:
+            claim {dict} -- claim
+
+        Returns:
+            list[str] -- violations, empty if the claim is valid
+        """
+        api_version = str(claim.get("apiVersion") or "")
+        group, _, version = api_version.rpartition("/")
+        expected = [f"{self.group}/{name}" for name in self.validators]
+        if group != self.group or version not in self.validators:
+            return [f"apiVersion: {api_version} is not a version of the definition "
+                    f"(expected one of: {', '.join(expected) or 'none'})"]
+
+        violations = []
+        if not self.served[version]:
+            violations.append(f"apiVersion: version {version} of the definition is not served")
+        if claim.get("kind") not in self.kinds:
+            violations.append(f"kind: {claim.get('kind')} is not a kind of the definition "
+                              f"(expected one of: {', '.join(self.kinds)})")
+
+        body = {key: value for key, value in claim.items() if key not in ("apiVersion", "kind", "metadata")}
+        if isinstance(body.get("spec"), dict):
+            body["spec"] = {key: value for key, value in body["spec"].items() if key not in CROSSPLANE_SPEC_FIELDS}
+        self.validators[version](body, "", violations)
+        if len(violations) > MAX_REPORTED_VIOLATIONS:
+            violations[MAX_REPORTED_VIOLATIONS:] = [f"... and {len(violations) - MAX_REPORTED_VIOLATIONS} more"]
+        return violations
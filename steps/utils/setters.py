@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import tempfile
 from pathlib import Path
 
 import allure
@@ -43,30 +44,56 @@ def prepare_file(ctx: Context, kind: str, filepath: str, load_into_context: bool
         AssertionError: file does not exist
     """
     filepath = Path(filepath)
-    assert_that(os.path.exists(filepath),
-                f"{kind} file ({filepath}) does not exist")
+    # The project index, built once per test run, avoids checking and reading the same files in every scenario.
+    # The files written by the steps in the temporary directory (e.g. generated claims) are read from disk.
+    project_index = None if is_temporary_file(filepath) else getattr(ctx, "project_index", None)
+    exists = project_index.exists(filepath) if project_index else os.path.exists(filepath)
+    assert_that(exists, f"{kind} file ({filepath}) does not exist")
 
     # load the filepath to the resource to the context
     setattr(ctx, f"{kind}_filepath", filepath)
 
     if load_into_context:
-        with open(filepath, mode="r", encoding="utf-8") as file:
-            if load_multiple_resources:
-                loaded_input = yaml.safe_load_all(file)
-                # If input is a list, load it as is into context
-                setattr(ctx, kind, loaded_input)
-            else:
-                loaded_input = yaml.safe_load(file)
-                # Else transform it into a benedict dictionary object
-                setattr(ctx, kind, benedict(loaded_input,
-                        keypath_separator=DICT_BENEDICT_SEPARATOR))
+        if project_index:
+            loaded_input = (project_index.load_all(filepath) if load_multiple_resources
+                            else project_index.load(filepath))
+        else:
+            with open(filepath, mode="r", encoding="utf-8") as file:
+                loaded_input = (list(yaml.safe_load_all(file)) if load_multiple_resources
+                                else yaml.safe_load(file))
+        if load_multiple_resources:
+            # If input is a list, load it as is into context
+            setattr(ctx, kind, loaded_input)
+        else:
+            # Else transform it into a benedict dictionary object
+            setattr(ctx, kind, benedict(loaded_input,
+                    keypath_separator=DICT_BENEDICT_SEPARATOR))
 
     if attach_to_allure:
-        allure.attach.file(
-            filepath,
-            name=kind,
-            attachment_type=allure.attachment_type.TEXT
-        )
+        if project_index:
+            allure.attach(
+                project_index.file(filepath).text,
+                name=kind,
+                attachment_type=allure.attachment_type.TEXT
+            )
+        else:
+            allure.attach.file(
+                filepath,
+                name=kind,
+                attachment_type=allure.attachment_type.TEXT
+            )
+
+
+def is_temporary_file(filepath):
+    """Check if a file is in the temporary directory, where the steps write files during the run
+
+    Arguments:
+        filepath {str} -- path to the file
+
+    Returns:
+        bool -- True if the file is in the temporary directory
+    """
+    return os.path.abspath(filepath).startswith(os.path.join(os.path.abspath(tempfile.gettempdir()), ""))
 
 
 def update_resource_params(ctx: Context, resource_name: str, resource_updates):
@@ -0,0 +1,227 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import SNAPSHOT_VOLATILE_FIELDS
+from steps.utils.utils import CompactLoader
+
+# First line of a snapshot file, holding the hash of its content
+SNAPSHOT_HEADER = "# snapshot sha256:{digest}\n"
+SNAPSHOT_HEADER_PATTERN = re.compile(r"^# snapshot sha256:([0-9a-f]{64})$")
+# Maximum number of differences reported when a snapshot does not match
+MAX_REPORTED_DIFFERENCES = 20
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def canonical(value, volatile_fields=SNAPSHOT_VOLATILE_FIELDS):
+    """Get the canonical form of rendered resources: plain dicts and lists of strings, without the volatile fields
+    (e.g. metadata.uid, status.conditions.*.lastTransitionTime). The keys are sorted when serialized.
+
+    Arguments:
+        value {object} -- resources, e.g. the desired resources by name
+
+    Keyword Arguments:
+        volatile_fields {tuple} -- key paths of the fields to strip, relative to a resource, * matches any list item
+            or key (default: {SNAPSHOT_VOLATILE_FIELDS})
+
+    Returns:
+        object -- canonical form
+    """
+    if isinstance(value, dict) and all(isinstance(resource, dict) for resource in value.values()):
+        return {name: strip_volatile_fields(plain(resource), volatile_fields) for name, resource in value.items()}
+    return strip_volatile_fields(plain(value), volatile_fields)
+
+
+def plain(value):
+    if isinstance(value, dict):
+        return {str(key): plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
+
+
+def strip_volatile_fields(resource, volatile_fields):
+    for field in volatile_fields:
+        _strip(resource, field.split("."))
+    return resource
+
+
+def _strip(value, keys):
+    key, rest = keys[0], keys[1:]
+    if isinstance(value, list) and key == "*":
+        children = value
+    elif isinstance(value, dict) and key == "*":
+        children = list(value.values())
+    elif isinstance(value, dict) and key in value:
+        if not rest:
+            del value[key]
+            return
+        children = [value[key]]
+    else:
+        return
+    if not rest:
+        value.clear()
+        return
+    for child in children:
+        _strip(child, rest)
+
+
+def content_hash(canonical_value):
+    """Hash the canonical form of resources
+
+    Arguments:
+        canonical_value {object} -- canonical form, see canonical
+
+    Returns:
+        str -- sha256 of the content
+    """
+    serialized = json.dumps(canonical_value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def read_snapshot_hash(filepath):
+    """Read the hash of a snapshot, from its first line only
+
+    Arguments:
+        filepath {str} -- path to the snapshot file
+
+    Returns:
+        str -- sha256 of the content of the snapshot, None if the file does not exist or has no hash
+    """
+    try:
+        with open(filepath, mode="r", encoding="utf-8") as file:
+            match = SNAPSHOT_HEADER_PATTERN.match(file.readline().rstrip("\n"))
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def read_snapshot(filepath):
+    """Read the content of a snapshot. Like the render output, all the values are read as strings.
+
+    Arguments:
+        filepath {str} -- path to the snapshot file
+
+    Returns:
+        object -- content of the snapshot
+    """
+    with open(filepath, mode="r", encoding="utf-8") as file:
+        return plain(yaml.load(file, Loader=CompactLoader))
+
+
+def write_snapshot(filepath, canonical_value, digest: str = None):
+    """Write a snapshot, with the hash of its content on the first line
+
+    Arguments:
+        filepath {str} -- path to the snapshot file
+        canonical_value {object} -- canonical form of the resources, see canonical
+
+    Keyword Arguments:
+        digest {str} -- hash of the content, computed if not given (default: {None})
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, mode="w", encoding="utf-8") as file:
+        file.write(SNAPSHOT_HEADER.format(digest=digest or content_hash(canonical_value)))
+        yaml.dump(canonical_value, file, Dumper=Dumper, sort_keys=True, default_flow_style=False,
+                  allow_unicode=True)
+
+
+def diff(expected, actual, path: str = ""):
+    """Find the differences between two canonical forms
+
+    Arguments:
+        expected {object} -- expected value (snapshot)
+        actual {object} -- actual value
+
+    Keyword Arguments:
+        path {str} -- key path of the values (default: {""})
+
+    Returns:
+        generator -- one message per difference
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(expected.keys() | actual.keys()):
+            key_path = f"{path}.{key}" if path else key
+            if key not in actual:
+                yield f"- {key_path}: {short(expected[key])}"
+            elif key not in expected:
+                yield f"+ {key_path}: {short(actual[key])}"
+            else:
+                yield from diff(expected[key], actual[key], key_path)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        for index in range(max(len(expected), len(actual))):
+            item_path = f"{path}[{index}]"
+            if index >= len(actual):
+                yield f"- {item_path}: {short(expected[index])}"
+            elif index >= len(expected):
+                yield f"+ {item_path}: {short(actual[index])}"
+            else:
+                yield from diff(expected[index], actual[index], item_path)
+    elif expected != actual:
+        yield f"~ {path}: {short(expected)} -> {short(actual)}"
+
+
+def short(value, max_length: int = 80):
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return text if len(text) <= max_length else f"{text[:max_length - 3]}..."
+
+
+def assert_matches_snapshot(name: str, value, filepath, update: bool = False):
+    """Check that resources match a snapshot. The hash of their canonical form is compared first with the hash
+    stored in the snapshot, the snapshot is only read and compared structurally when the hashes differ.
+
+    Arguments:
+        name {str} -- name of the checked resources, for the messages
+        value {object} -- resources, e.g. the desired resources by name
+        filepath {str} -- path to the snapshot file
+
+    Keyword Arguments:
+        update {bool} -- write the snapshot instead of failing when it is missing or does not match
+            (default: {False})
+
+    Raises:
+        AssertionError: the snapshot is missing or the resources do not match it
+
+    Returns:
+        list[str] -- differences with the previous snapshot, empty if it matched
+    """
+    canonical_value = canonical(value)
+    digest = content_hash(canonical_value)
+    stored_digest = read_snapshot_hash(filepath)
+    if digest == stored_digest:
+        return []
+
+    if stored_digest is None and not Path(filepath).exists():
+        assert update, (f"snapshot {filepath} of {name} does not exist, run with --update-snapshots "
+                        f"(COMPOSITION_TESTER_UPDATE_SNAPSHOTS=true) to create it")
+        write_snapshot(filepath, canonical_value, digest)
+        return [f"+ created {filepath}"]
+
+    differences = list(diff(read_snapshot(filepath), canonical_value))
+    if update:
+        write_snapshot(filepath, canonical_value, digest)
+        return differences
+    # A snapshot edited by hand may have a stale hash and still match
+    assert not differences, (
+        f"{name} do not match snapshot {filepath} ({len(differences)} differences, - snapshot, + actual):\n"
+        + "\n".join(differences[:MAX_REPORTED_DIFFERENCES])
+        + ("\n..." if len(differences) > MAX_REPORTED_DIFFERENCES else ""))
+    return differences
@@ -0,0 +1,359 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import socket
+import statistics
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import yaml
+
+from steps.utils.constants import (
+    FUNCTION_DEVELOPMENT_TARGET_ANNOTATION,
+    FUNCTION_PORT,
+    FUNCTION_RUNTIME_ANNOTATION)
+from steps.utils.render import remove_containers, start_function_container
+
+logger = logging.getLogger("xplane-composition-tester logger")
+logger.setLevel(logging.INFO)
+
+# HTTP/2 connection preface sent by the client (crossplane render) before any frame
+HTTP2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+HTTP2_FRAME_HEADER_LENGTH = 9
+HTTP2_DATA = 0x0
+HTTP2_HEADERS = 0x1
+HTTP2_RST_STREAM = 0x3
+HTTP2_END_STREAM = 0x1
+
+
+@dataclass
+class FunctionCall:
+    """Measures of one RunFunction call"""
+    function: str
+    latency: float
+    request_bytes: int
+    response_bytes: int
+    error: bool = False
+
+
+class Http2FrameParser:
+    """Incremental parser of the HTTP/2 frames of one direction of a connection. Only the frame headers are
+    decoded, the payloads are skipped: it is enough to follow the gRPC calls (streams) and their sizes.
+    """
+
+    def __init__(self, on_frame, expect_preface: bool = False):
+        self._on_frame = on_frame
+        self._preface_remaining = len(HTTP2_PREFACE) if expect_preface else 0
+        self._header = b""
+        self._payload_remaining = 0
+
+    def feed(self, data: bytes):
+        position = 0
+        if self._preface_remaining:
+            skipped = min(self._preface_remaining, len(data))
+            self._preface_remaining -= skipped
+            position = skipped
+
+        while position < len(data):
+            if self._payload_remaining:
+                skipped = min(self._payload_remaining, len(data) - position)
+                self._payload_remaining -= skipped
+                position += skipped
+                continue
+
+            missing = HTTP2_FRAME_HEADER_LENGTH - len(self._header)
+            self._header += data[position:position + missing]
+            position += missing
+            if len(self._header) < HTTP2_FRAME_HEADER_LENGTH:
+                return
+
+            length = int.from_bytes(self._header[0:3], "big")
+            frame_type, flags = self._header[3], self._header[4]
+            stream_id = int.from_bytes(self._header[5:9], "big") & 0x7FFFFFFF
+            self._header = b""
+            self._payload_remaining = length
+            self._on_frame(frame_type, flags, stream_id, length)
+
+
+class FunctionTimingProxy:
+    """TCP proxy in front of a composition function server that measures each gRPC RunFunction call.
+
+    Each gRPC call is an HTTP/2 stream: it starts with the request headers of the client and ends with the
+    trailers (headers with the END_STREAM flag) or a reset of the stream by the server. The calls still running
+    when the connection is closed are measured as failed.
+    """
+
+    def __init__(self, function: str, upstream_host: str, upstream_port: int):
+        self.function = function
+        self.upstream = (upstream_host, upstream_port)
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._lock = threading.Lock()
+        self._calls = []
+        self._closed = False
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def drain(self):
+        """Get the calls measured since the last drain
+
+        Returns:
+            list[FunctionCall] -- measured calls
+        """
+        with self._lock:
+            calls, self._calls = self._calls, []
+        return calls
+
+    def close(self):
+        self._closed = True
+        self._server.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._proxy, args=(client,), daemon=True).start()
+
+    def _proxy(self, client: socket.socket):
+        try:
+            upstream = socket.create_connection(self.upstream)
+        except OSError as e:
+            logger.warning(f"function {self.function} not reachable on {self.upstream}: {e}")
+            client.close()
+            return
+
+        streams = {}
+        streams_lock = threading.Lock()
+
+        def on_request_frame(frame_type, flags, stream_id, length):
+            with streams_lock:
+                if frame_type == HTTP2_HEADERS and stream_id not in streams:
+                    streams[stream_id] = [time.perf_counter(), 0, 0]
+                elif frame_type == HTTP2_DATA and stream_id in streams:
+                    streams[stream_id][1] += length
+
+        def on_response_frame(frame_type, flags, stream_id, length):
+            with streams_lock:
+                stream = streams.get(stream_id)
+                if stream is None:
+                    return
+                if frame_type == HTTP2_DATA:
+                    stream[2] += length
+                    return
+                reset = frame_type == HTTP2_RST_STREAM
+                if reset or (frame_type == HTTP2_HEADERS and flags & HTTP2_END_STREAM):
+                    del streams[stream_id]
+                    call = FunctionCall(self.function, time.perf_counter() - stream[0], stream[1], stream[2], reset)
+                    with self._lock:
+                        self._calls.append(call)
+
+        requests = threading.Thread(
+            target=_pump, args=(client, upstream, Http2FrameParser(on_request_frame, expect_preface=True)),
+            daemon=True)
+        requests.start()
+        _pump(upstream, client, Http2FrameParser(on_response_frame))
+        # Both directions are shut down once one of them ends
+        requests.join()
+        client.close()
+        upstream.close()
+
+        # The calls still running when the connection is closed (e.g. reset by the function) failed
+        with streams_lock:
+            interrupted = [FunctionCall(self.function, time.perf_counter() - start, request_bytes, response_bytes, True)
+                           for start, request_bytes, response_bytes in streams.values()]
+            streams.clear()
+        with self._lock:
+            self._calls.extend(interrupted)
+
+
+def _pump(source: socket.socket, destination: socket.socket, parser: Http2FrameParser):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            parser.feed(data)
+            destination.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for sock in (source, destination):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class FunctionTimings:
+    """Route the functions of the functions files through timing proxies, using the Development runtime.
+
+    The functions that already use the Development runtime are proxied to their target. The other functions
+    are started once per test run as docker containers, and proxied to them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (function name, development target or package) -> proxy, so that the calls are reported per function
+        self._proxies = {}
+        # function package -> host and port of its container, started once for all the functions using it
+        self._package_targets = {}
+        self._containers = []
+        # original functions file -> functions file routed through the proxies
+        self._functions_files = {}
+        self.calls = []
+
+    def proxied_functions_filepath(self, functions_filepath, output_directory):
+        """Get a copy of the functions file where all functions are routed through their timing proxy
+
+        Arguments:
+            functions_filepath {str} -- path to the functions file
+            output_directory {str} -- directory where the proxied functions file is written
+
+        Returns:
+            Path -- path to the proxied functions file
+        """
+        functions_filepath = str(functions_filepath)
+        with self._lock:
+            if functions_filepath in self._functions_files:
+                return self._functions_files[functions_filepath]
+
+            with open(functions_filepath, mode="r", encoding="utf-8") as file:
+                functions = [f for f in yaml.safe_load_all(file) if f]
+            for function in functions:
+                if function.get("kind") != "Function":
+                    continue
+                proxy = self._proxy_for(function)
+                annotations = function.setdefault("metadata", {}).setdefault("annotations", {})
+                annotations[FUNCTION_RUNTIME_ANNOTATION] = "Development"
+                annotations[FUNCTION_DEVELOPMENT_TARGET_ANNOTATION] = f"127.0.0.1:{proxy.port}"
+
+            digest = hashlib.sha256(functions_filepath.encode()).hexdigest()[:12]
+            proxied_filepath = Path(output_directory) / f"functions-{digest}.yaml"
+            proxied_filepath.parent.mkdir(exist_ok=True, parents=True)
+            with open(proxied_filepath, mode="w", encoding="utf-8") as file:
+                yaml.safe_dump_all(functions, file)
+            self._functions_files[functions_filepath] = proxied_filepath
+            return proxied_filepath
+
+    def collect(self):
+        """Collect the calls measured since the last collect and add them to the calls of the run
+
+        Returns:
+            list[FunctionCall] -- measured calls
+        """
+        with self._lock:
+            proxies = list(self._proxies.values())
+        calls = [call for proxy in proxies for call in proxy.drain()]
+        self.calls.extend(calls)
+        return calls
+
+    def close(self):
+        """Stop the proxies and the function containers started for them"""
+        with self._lock:
+            for proxy in self._proxies.values():
+                proxy.close()
+            self._proxies.clear()
+            self._package_targets.clear()
+            containers, self._containers = self._containers, []
+        if containers:
+            remove_containers(containers)
+
+    def _proxy_for(self, function: dict):
+        name = function.get("metadata", {}).get("name")
+        annotations = function.get("metadata", {}).get("annotations") or {}
+        development = annotations.get(FUNCTION_RUNTIME_ANNOTATION) == "Development"
+        if development:
+            target = annotations.get(FUNCTION_DEVELOPMENT_TARGET_ANNOTATION, f"localhost:{FUNCTION_PORT}")
+        else:
+            target = function["spec"]["package"]
+
+        key = (name, target)
+        if key not in self._proxies:
+            host, port = target.rsplit(":", 1) if development else self._start_function(target)
+            self._proxies[key] = FunctionTimingProxy(name, host, int(port))
+        return self._proxies[key]
+
+    def _start_function(self, image: str):
+        if image not in self._package_targets:
+            container, host, port = start_function_container(image)
+            self._containers.append(container)
+            self._package_targets[image] = (host, port)
+        return self._package_targets[image]
+
+
+def summarize_calls(calls):
+    """Summarize the calls per function
+
+    Arguments:
+        calls {list[FunctionCall]} -- measured calls
+
+    Returns:
+        list[dict] -- one summary per function, in order of first call
+    """
+    by_function = {}
+    for call in calls:
+        by_function.setdefault(call.function, []).append(call)
+
+    summaries = []
+    for function, function_calls in by_function.items():
+        latencies = sorted(call.latency for call in function_calls)
+        summaries.append({
+            "function": function,
+            "calls": len(function_calls),
+            "errors": sum(call.error for call in function_calls),
+            "latency_total": sum(latencies),
+            "latency_mean": statistics.mean(latencies),
+            "latency_p50": statistics.median(latencies),
+            "latency_max": latencies[-1],
+            "request_bytes_mean": statistics.mean(call.request_bytes for call in function_calls),
+            "response_bytes_mean": statistics.mean(call.response_bytes for call in function_calls),
+        })
+    return summaries
+
+
+def format_calls_table(summaries):
+    """Format the summaries of the calls as a text table
+
+    Arguments:
+        summaries {list[dict]} -- summaries from summarize_calls
+
+    Returns:
+        str -- table
+    """
+    header = ("function", "calls", "errors", "total (s)", "mean (s)", "p50 (s)", "max (s)", "req (B)", "resp (B)")
+    rows = [(s["function"], s["calls"], s["errors"], f"{s['latency_total']:.3f}", f"{s['latency_mean']:.3f}",
+             f"{s['latency_p50']:.3f}", f"{s['latency_max']:.3f}", f"{s['request_bytes_mean']:.0f}",
+             f"{s['response_bytes_mean']:.0f}") for s in summaries]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    return "\n".join(" | ".join(str(cell).ljust(width) for cell, width in zip(row, widths))
+                     for row in [header] + rows)
+
+
+def write_calls_report(filepath, calls):
+    """Write all the measured calls and their summary per function as JSON
+
+    Arguments:
+        filepath {str} -- path to the report
+        calls {list[FunctionCall]} -- measured calls
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, mode="w", encoding="utf-8") as file:
+        json.dump({"summary": summarize_calls(calls), "calls": [asdict(call) for call in calls]}, file, indent=2)
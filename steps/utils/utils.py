@@ -12,10 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import collections.abc
-import os
 import logging
 import re
+import sys
+import time
+import tracemalloc
 from pathlib import Path
 
 import yaml
@@ -24,17 +25,39 @@ from benedict import benedict
 from hamcrest import assert_that, none, is_not
 
 from steps.utils.constants import (
+    CLAIM,
     DICT_BENEDICT_SEPARATOR,
-    TMP_OBSERVED_FILE_PATH,
+    INTERN_MAX_LENGTH,
     OBSERVED,
     ENVCONFIG,
     CTX_DESIRED_RESOURCES,
-    CTX_DESIRED_COMPOSITE)
+    CTX_DESIRED_RESOURCES_INDEX,
+    CTX_DESIRED_COMPOSITE,
+    CTX_DESIRED_FINGERPRINTS,
+    CTX_NESTED_RESOURCES)
+from steps.utils.indexes import DesiredResourcesIndex
+# deep_update is re-exported for the step modules importing it from here
+from steps.utils.observed import ObservedState, deep_update, fingerprint, split_documents  # noqa: F401
+from steps.utils.project import ProjectIndex
 
 logger = logging.getLogger("xplane-composition-tester logger")
 logger.setLevel(logging.INFO)
 
 
+class CompactLoader(getattr(yaml, "CBaseLoader", yaml.BaseLoader)):
+    """YAML loader that parses only strings, dicts & lists (like the BaseLoader) and interns the keys and short strings.
+
+    Keys like apiVersion, kind, metadata or the annotation names repeat in every resource of the render output,
+    so interning them keeps a single copy of each in memory. The C parser is used when libyaml is available.
+    """
+
+    def construct_scalar(self, node):
+        value = super().construct_scalar(node)
+        if len(value) <= INTERN_MAX_LENGTH:
+            value = sys.intern(value)
+        return value
+
+
 def create_fake_status_conditions(ready=False, synced=True):
     """Create fake status conditions
 
@@ -61,7 +84,7 @@ def create_fake_status_conditions(ready=False, synced=True):
     return [ready_condition, synced_condition]
 
 
-def prepare_render_args(ctx: Context, log_input: bool = False):
+def prepare_render_args(ctx: Context, log_input: bool = False, keep_observed_file: bool = False):
     """Prepare crossplane render command arguments.
 
     We identify 3 cases:
@@ -74,6 +97,8 @@ def prepare_render_args(ctx: Context, log_input: bool = False):
 
     Keyword Arguments:
         log_input {bool} -- log the input (the observed resources)  to render (default: {False})
+        keep_observed_file {bool} -- keep the observed file given by a step for the next render, e.g. for renders
+            of other claims (default: {False})
 
     Returns:
         list -- crossplane render command arguments
@@ -93,48 +118,96 @@ def prepare_render_args(ctx: Context, log_input: bool = False):
 
     # Check if we need to run render without an observed state
     if not observed_file and not observed_resources:
-        return ["crossplane", "render", ctx.claim_filepath,
-                ctx.composition_filepath, ctx.functions_filepath, "-e", envconfig_arg]
+        return build_render_args(ctx.claim_filepath, ctx.composition_filepath, ctx.functions_filepath, envconfig_arg)
         
     if observed_file:
         # use the observed file for one render round
-        delattr(ctx, f"{OBSERVED}_filepath")
+        if not keep_observed_file:
+            delattr(ctx, f"{OBSERVED}_filepath")
 
     else:
         # prepare observed file from the desired resources
-
-        if os.path.exists(TMP_OBSERVED_FILE_PATH):
-            # Cleanup current temp file
-            os.remove(TMP_OBSERVED_FILE_PATH)
-
         # First get the desired resources that will act as observed resources to the next render round
         assert observed_resources is not None, f"No resources found in context"
+        # The resources of the nested composite resources are observed by their own renders
+        nested_resources = getattr(ctx, CTX_NESTED_RESOURCES, None)
+        if nested_resources:
+            observed_resources = {name: resource for name, resource in observed_resources.items()
+                                  if name not in nested_resources}
 
         if log_input:
             dump_yaml_to_file(f"dump/{iteration_id}-in-observed-from-previous-desired.yaml", observed_resources)
 
-        # Merge the observed with the updates accumulated so far
+        # The updates accumulated so far are overlaid on the observed resources
         updates = getattr(ctx, "updates", None)
-        if updates:
-            if log_input:
-                dump_yaml_to_file(f"dump/{iteration_id}-in-changes-from-steps.yaml", updates)
+        if updates and log_input:
+            dump_yaml_to_file(f"dump/{iteration_id}-in-changes-from-steps.yaml", updates)
+
+        # Then write the observed state onto the observed file of the scenario
+        observed_state = getattr(ctx, "observed_state", None)
+        if observed_state is None:
+            observed_state = ctx.observed_state = ObservedState(metrics=getattr(ctx, "metrics", None))
+            ctx.add_cleanup(observed_state.close)
+        content = observed_state.write(observed_resources, getattr(ctx, CTX_DESIRED_FINGERPRINTS, None) or {},
+                                       updates)
+        if log_input and updates:
+            dump_string_to_file(f"dump/{iteration_id}-in-observed.yaml", content.decode("utf-8"))
+        observed_file = observed_state.filepath
 
-            for resource in ctx.updates:
-                if resource in observed_resources:
-                    deep_update(observed_resources[resource], ctx.updates[resource])
+    # run the renderer with the observed file as input
+    return build_render_args(ctx.claim_filepath, ctx.composition_filepath, ctx.functions_filepath, envconfig_arg,
+                             observed_filepath=observed_file)
 
-            if log_input:
-                dump_yaml_to_file(f"dump/{iteration_id}-in-observed.yaml", observed_resources)
 
-        # Then dump the observed onto a temp file
-        # logger.info(f"running with observed resources {observed_resources}")
-        dump_yaml_to_file(TMP_OBSERVED_FILE_PATH,
-                          observed_resources.values(), dump_multiple_resources=True)
-        observed_file = TMP_OBSERVED_FILE_PATH
+def precheck_render_inputs(ctx: Context):
+    """Statically check the composition and functions of the context before rendering, so that a doomed render
+    fails before any function container is started. The check runs once per composition and functions file.
+    The claim is then validated against the schema of the definition (XRD) of the composition, unless disabled
+    with the environment variable COMPOSITION_TESTER_VALIDATE_CLAIMS.
 
-    # run the renderer with the observed file as input
-    return ["crossplane", "render", ctx.claim_filepath,
-            ctx.composition_filepath, ctx.functions_filepath, "-e", envconfig_arg, "-o", observed_file]
+    Arguments:
+        ctx {Context} -- behave context
+
+    Raises:
+        AssertionError: problems found in the composition, all of them are reported
+        AssertionError: violations of the schema found in the claim, all of them are reported
+    """
+    project_index = getattr(ctx, "project_index", None)
+    if project_index is None:
+        project_index = ctx.project_index = ProjectIndex()
+    problems = project_index.precheck(ctx.composition_filepath, ctx.functions_filepath)
+    assert not problems, (f"composition {ctx.composition_filepath} will not render with functions "
+                          f"{ctx.functions_filepath}:\n" + "\n".join(problems))
+
+    # The claim is validated against the schema of the definition (XRD), as the API server would do
+    claim = getattr(ctx, CLAIM, None)
+    definition_filepath = getattr(ctx, "definition_filepath", None)
+    if claim is not None and definition_filepath and getattr(ctx, "validate_claims", True):
+        violations = project_index.validate_claim(definition_filepath, claim)
+        assert not violations, (f"claim {ctx.claim_filepath} is not valid against the definition "
+                                f"{definition_filepath}:\n" + "\n".join(violations))
+
+
+def build_render_args(claim_filepath, composition_filepath, functions_filepath, envconfig_filepath,
+                      observed_filepath=None):
+    """Build the crossplane render command arguments
+
+    Arguments:
+        claim_filepath {str} -- path to the claim (or xr)
+        composition_filepath {str} -- path to the composition
+        functions_filepath {str} -- path to the functions
+        envconfig_filepath {str} -- path to the environment config
+
+    Keyword Arguments:
+        observed_filepath {str} -- path to the observed resources (default: {None})
+
+    Returns:
+        list -- crossplane render command arguments
+    """
+    args = ["crossplane", "render", claim_filepath, composition_filepath, functions_filepath, "-e", envconfig_filepath]
+    if observed_filepath:
+        args += ["-o", observed_filepath]
+    return args
 
 
 def get_from_context(ctx: Context, attr: str, assert_exists: bool = True):
@@ -213,40 +286,93 @@ def save_rendered_output(ctx: Context, render_output: str):
     dump_string_to_file(f"dump/{iteration_id}-out-desired.yaml", render_output)    
     
     
-def read_desired_output_into_context(ctx: Context, render_output: str):
-    """Read the desired state from the render output and save it into context
+def parse_desired_output(render_output: str, fingerprints: dict = None):
+    """Parse the desired state from the render output.
+    The documents are parsed one at a time so that the parsed state is never held twice in memory.
 
     Arguments:
-        ctx {Context} -- behave context
         render_ouput {str} -- render output
 
+    Keyword Arguments:
+        fingerprints {dict} -- filled with the fingerprints of the documents of the desired resources, by resource
+            name, see steps.utils.observed.fingerprint (default: {None})
+
     Raises:
         AssertionError: no desired state found in render output
+
+    Returns:
+        tuple -- desired xr and dict from the desired resources names to their payload
     """
-    desired_state = []
+    desired_xr = None
+    desired_resources = {}
     try:
         # Parse only strings, dicts & lists. Ignore auxiliary types like booleans, integers, floats, etc.
-        desired_state = list(yaml.load_all(
-            render_output, Loader=yaml.BaseLoader))
+        for source in split_documents(render_output):
+            documents = [document for document in yaml.load_all(source, Loader=CompactLoader) if document]
+            for document in documents:
+                # The first resource from the crossplane render output is always the xr
+                if desired_xr is None:
+                    desired_xr = benedict(document, keypath_separator=DICT_BENEDICT_SEPARATOR)
+                    continue
+                # Create dict from resource names to their payload
+                resource_name = document["metadata"]["annotations"]["crossplane.io/composition-resource-name"]
+                desired_resources[resource_name] = benedict(document, keypath_separator=DICT_BENEDICT_SEPARATOR)
+                # A text holding several documents (e.g. --- with a tag) does not identify a single resource
+                if fingerprints is not None and len(documents) == 1:
+                    fingerprints[resource_name] = fingerprint(source)
     except yaml.YAMLError as e:
         assert_that(False, f"error parsing render output: {e}")
 
-    assert_that(len(desired_state), is_not(
-        0), f"render: no desired state output")
+    assert_that(desired_xr, is_not(none()), f"render: no desired state output")
+    return desired_xr, desired_resources
 
-    # The first resource from the crossplane render output is always the xr
-    desired_xr = desired_state[0]
-    setattr(ctx, CTX_DESIRED_COMPOSITE, benedict(
-        desired_xr, keypath_separator=DICT_BENEDICT_SEPARATOR))
 
-    desired_resources = desired_state[1:]
-    # Create dict from resource names to their payload
-    desired_resources = dict(
-        [(dr["metadata"]["annotations"]["crossplane.io/composition-resource-name"],
-          benedict(dr, keypath_separator=DICT_BENEDICT_SEPARATOR)) for dr in desired_resources]
-    )
+def read_desired_output_into_context(ctx: Context, render_output: str):
+    """Read the desired state from the render output and save it into context
+
+    Arguments:
+        ctx {Context} -- behave context
+        render_ouput {str} -- render output
 
+    Raises:
+        AssertionError: no desired state found in render output
+    """
+    fingerprints = {}
+    start = time.monotonic()
+    desired_xr, desired_resources = parse_desired_output(render_output, fingerprints=fingerprints)
+    metrics = getattr(ctx, "metrics", None)
+    if metrics:
+        metrics.observe("render_parse_duration_seconds", time.monotonic() - start)
+        metrics.inc("render_output_bytes", len(render_output.encode("utf-8")))
+        metrics.inc("desired_resources", len(desired_resources))
+
+    setattr(ctx, CTX_DESIRED_COMPOSITE, desired_xr)
+    setattr(ctx, CTX_DESIRED_FINGERPRINTS, fingerprints)
     setattr(ctx, CTX_DESIRED_RESOURCES, desired_resources)
+    setattr(ctx, CTX_DESIRED_RESOURCES_INDEX, DesiredResourcesIndex(desired_resources))
+
+
+def measure_peak_memory(func, *args, **kwargs):
+    """Run a function and measure the peak of the memory allocated while it runs
+
+    Arguments:
+        func {callable} -- function to run
+
+    Returns:
+        tuple -- result of the function and peak memory in bytes
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+    return result, peak - start
 
 
 def parse_value_cmd(value: str):
@@ -270,24 +396,6 @@ def parse_value_cmd(value: str):
     return value
 
 
-def deep_update(d, u):
-    """Deep update dictionaries
-
-    Arguments:
-        d {dict} -- dictionary to update
-        u {dict} -- dictionary to update from
-
-    Returns:
-        dict -- updated dictionary
-    """
-    for k, v in u.items():
-        if isinstance(v, collections.abc.Mapping):
-            d[k] = deep_update(d.get(k, {}), v)
-        else:
-            d[k] = v
-    return d
-
-
 def dump_yaml_to_file(filepath, content: str, dump_multiple_resources: bool = False):
     """
     Dump content to file. Creates file if not exists.
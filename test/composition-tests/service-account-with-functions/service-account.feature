@@ -30,9 +30,14 @@ Feature: Service Account composition
     When crossplane renders the composition
     Then check that 2 resources are provisioning
     And check that resource role has parameters
-      | param name    | param value   |
-      | metadata.name | green-demo-sa |
-    # | spec.forProvider.permissionsBoundary | {regexp}*/sc-policy-cdk-pipeline-permission-boundary |
+      | param name                           | param value                                                            |
+      | metadata.name                        | green-demo-sa                                                          |
+      | spec.forProvider.permissionsBoundary | {glob}*/sc-policy-cdk-pipeline-permission-boundary                     |
+      | spec.forProvider.permissionsBoundary | {regexp}arn:aws:iam::\d+:policy/sc-policy-cdk-pipeline-permission-boundary |
+      | spec.providerConfigRef               | {subset}{"name": "providerconfig-aws"}                                 |
+      | metadata.ownerReferences             | {subset}[{"controller": true, "blockOwnerDeletion": true}]             |
+      | spec.forProvider.path                | \absent                                                                |
+    And the last render took less than 2m
 
     # render 2
     Given change observed resource role with status NOT READY and parameters
@@ -65,6 +70,7 @@ Feature: Service Account composition
     Given change observed resource green-demo-sa-rpa-default-policy with status READY
     And change observed resource green-demo-sa with status READY
     When crossplane renders the composition
+    Then all renders took less than 2m
     
   
   @normal
@@ -134,6 +140,7 @@ Feature: Service Account composition
       | green-demo-sa-rpa-0              |
       | green-demo-sa-rpa-1              |
       | green-demo-sa                    |
+    And check that 3 resources of kind RolePolicyAttachment are provisioning
     And check that resource green-demo-sa-rpa-0 has parameters
       | param name                 | param value   |
       | spec.forProvider.roleName  | green-demo-sa |
@@ -148,3 +155,38 @@ Feature: Service Account composition
     Given change all observed resources with status NOT READY
     When crossplane renders the composition
     Then log desired resources
+
+
+  @minor
+  Scenario: service accounts generated from the definition
+    When crossplane renders 5 claims generated from the definition with seed 1
+    Then all generated claims render without errors
+    And all generated claims provision between 2 and 2 resources
+    And all resources of the generated claims have parameters
+      | param name                  | param value        |
+      | spec.providerConfigRef.name | providerconfig-aws |
+
+    # reproduce one of the generated claims
+    Given input claim generated from the definition with seed 3
+    When crossplane renders the composition
+    Then check that 2 resources are provisioning and they are
+      | resource-name  |
+      | role           |
+      | default-policy |
+
+
+  @minor
+  Scenario: service account render time with the number of policies
+    When crossplane renders the composition
+    Given change observed resource role with status READY and parameters
+      | param name            | param value |
+      | status.atProvider.arn | arn::role   |
+    When crossplane renders the composition with spec.policiesARN of sizes 1..1000 x10
+
+    # the profiled claims do not change the claim nor the observed state of the scenario
+    When crossplane renders the composition
+    Then check that 3 resources are provisioning and they are
+      | resource-name  |
+      | role           |
+      | default-policy |
+      | green-demo-sa  |
@@ -0,0 +1,117 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fake crossplane CLI rendering the service account composition of the test project like its functions would,
+without docker, to run the test scenarios in the unit tests.
+
+Environment variables:
+- FAKE_CROSSPLANE_LOG: file where a line is appended for every render
+- FAKE_CROSSPLANE_FAIL_RENDER: number of the render (in the log) that fails
+"""
+
+import os
+import sys
+
+import yaml
+
+READY = {"type": "Ready", "status": "True"}
+
+
+def observed_resources(path: str):
+    """Observed resources by composition resource name, from a file or a directory of files"""
+    filepaths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    resources = {}
+    for filepath in filepaths:
+        with open(filepath, mode="r", encoding="utf-8") as file:
+            for resource in yaml.safe_load_all(file):
+                if resource:
+                    resources[resource["metadata"]["annotations"]["crossplane.io/composition-resource-name"]] = resource
+    return resources
+
+
+def render(claim: dict, composition: dict, observed: dict):
+    composite = {
+        "apiVersion": composition["spec"]["compositeTypeRef"]["apiVersion"],
+        "kind": composition["spec"]["compositeTypeRef"]["kind"],
+        "metadata": {"name": claim["metadata"]["name"], "labels": claim["metadata"].get("labels", {})},
+        "spec": claim.get("spec", {}),
+        "status": {"conditions": [{"type": "Ready", "status": "False", "reason": "Creating"}]},
+    }
+    claim_name = claim["metadata"]["labels"]["crossplane.io/claim-name"]
+
+    def ready(name):
+        conditions = ((observed.get(name) or {}).get("status") or {}).get("conditions") or []
+        return any(condition.get("type") == "Ready" and condition.get("status") == "True" for condition in conditions)
+
+    def resource(name: str, kind: str, spec: dict, api_version: str = "iam.aws.crossplane.io/v1beta1"):
+        return {
+            "apiVersion": api_version,
+            "kind": kind,
+            "metadata": {
+                "annotations": {"crossplane.io/composition-resource-name": name},
+                "generateName": f"{claim['metadata']['name']}-",
+                "labels": {"crossplane.io/composite": claim["metadata"]["name"]},
+                "ownerReferences": [{"apiVersion": composite["apiVersion"], "kind": composite["kind"],
+                                     "name": composite["metadata"]["name"], "controller": True,
+                                     "blockOwnerDeletion": True, "uid": ""}],
+            },
+            "spec": spec,
+        }
+
+    provider_config = {"name": "providerconfig-aws"}
+    role = resource("role", "Role", {"forProvider": {
+        "permissionsBoundary": "arn:aws:iam::1234:policy/sc-policy-cdk-pipeline-permission-boundary"},
+        "providerConfigRef": provider_config})
+    role["metadata"]["name"] = claim_name
+    resources = [role, resource("default-policy", "Policy", {
+        "forProvider": {"name": f"{claim_name}-default-policy"}, "providerConfigRef": provider_config})]
+    if ready("role"):
+        for index, policy_arn in enumerate(claim.get("spec", {}).get("policiesARN") or []):
+            resources.append(resource(f"{claim_name}-rpa-{index}", "RolePolicyAttachment", {
+                "forProvider": {"policyArn": policy_arn, "roleName": claim_name}}))
+        if ready("default-policy"):
+            resources.append(resource(f"{claim_name}-rpa-default-policy", "RolePolicyAttachment", {"forProvider": {
+                "policyArn": observed["default-policy"]["status"]["atProvider"]["arn"], "roleName": claim_name}}))
+        resources.append(resource(claim_name, "Object", {"forProvider": {"manifest": {"kind": "ServiceAccount"}}},
+                                  api_version="kubernetes.crossplane.io/v1alpha1"))
+    return [composite] + resources
+
+
+def main(args):
+    if args[:2] == ["version", "--client"]:
+        print("Client Version: v1.17.3")
+        return 0
+    assert args[0] == "render", f"unsupported command {args}"
+
+    renders = 0
+    if os.environ.get("FAKE_CROSSPLANE_LOG"):
+        with open(os.environ["FAKE_CROSSPLANE_LOG"], mode="a+", encoding="utf-8") as log:
+            log.write(" ".join(args) + "\n")
+            log.seek(0)
+            renders = len(log.readlines())
+    if str(renders) == os.environ.get("FAKE_CROSSPLANE_FAIL_RENDER"):
+        print("crossplane: error: cannot render composite resource: fake failure", file=sys.stderr)
+        return 1
+
+    with open(args[1], mode="r", encoding="utf-8") as file:
+        claim = yaml.safe_load(file)
+    with open(args[2], mode="r", encoding="utf-8") as file:
+        composition = yaml.safe_load(file)
+    observed = observed_resources(args[args.index("-o") + 1]) if "-o" in args else {}
+    print(yaml.safe_dump_all(render(claim, composition, observed)), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
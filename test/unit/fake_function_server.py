@@ -0,0 +1,135 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import socket
+import struct
+import threading
+import time
+
+HTTP2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+DATA, HEADERS, RST_STREAM, SETTINGS = 0x0, 0x1, 0x3, 0x4
+END_STREAM, END_HEADERS = 0x1, 0x4
+# HPACK of ":status: 200", and of the gRPC trailers (not decoded by the proxy)
+RESPONSE_HEADERS = b"\x88"
+TRAILERS = b"grpc-status: 0"
+
+
+def frame(frame_type: int, flags: int, stream_id: int, payload: bytes = b""):
+    """Encode an HTTP/2 frame"""
+    return len(payload).to_bytes(3, "big") + bytes([frame_type, flags]) + stream_id.to_bytes(4, "big") + payload
+
+
+def request_frames(stream_id: int, command: dict):
+    """Encode a gRPC call of the fake function: request headers, and a data frame holding the command of the call
+
+    Arguments:
+        stream_id {int} -- stream of the call (odd)
+        command {dict} -- what the fake function does, see FakeFunctionServer
+
+    Returns:
+        tuple -- headers frame, data frame
+    """
+    return (frame(HEADERS, END_HEADERS, stream_id, b"\x83\x86"),
+            frame(DATA, END_STREAM, stream_id, json.dumps(command).encode()))
+
+
+def read_exactly(sock: socket.socket, length: int):
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def read_frame(sock: socket.socket):
+    """Read an HTTP/2 frame
+
+    Returns:
+        tuple -- type, flags, stream id and payload of the frame
+    """
+    header = read_exactly(sock, 9)
+    length = int.from_bytes(header[0:3], "big")
+    stream_id = int.from_bytes(header[5:9], "big") & 0x7FFFFFFF
+    return header[3], header[4], stream_id, read_exactly(sock, length)
+
+
+class FakeFunctionServer:
+    """Fake composition function server speaking just enough HTTP/2 to look like a gRPC server to a proxy: the
+    frames are not HPACK encoded nor flow controlled. The data frame of each call holds a JSON command:
+
+    - delay {float} -- seconds before the response (default: 0)
+    - response_bytes {int} -- size of the response message (default: 16)
+    - reply {str} -- "ok" to answer with headers, data and trailers, "rst_stream" to reset the stream, or
+      "reset_connection" to abort the connection (default: "ok")
+    - split {bool} -- send the header of the response data frame in two writes (default: false)
+    """
+
+    def __init__(self):
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection: socket.socket):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        write_lock = threading.Lock()
+        try:
+            assert read_exactly(connection, len(HTTP2_PREFACE)) == HTTP2_PREFACE
+            connection.sendall(frame(SETTINGS, 0, 0))
+            while True:
+                frame_type, flags, stream_id, payload = read_frame(connection)
+                if frame_type == DATA and flags & END_STREAM:
+                    threading.Thread(target=self._respond, args=(connection, write_lock, stream_id,
+                                                                 json.loads(payload)), daemon=True).start()
+        except (ConnectionError, OSError):
+            connection.close()
+
+    @staticmethod
+    def _respond(connection: socket.socket, write_lock: threading.Lock, stream_id: int, command: dict):
+        time.sleep(command.get("delay", 0))
+        reply = command.get("reply", "ok")
+        try:
+            with write_lock:
+                if reply == "reset_connection":
+                    # Abort the connection: the reading thread wakes up and closes it, and the peer gets a TCP reset
+                    # instead of a clean close
+                    connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    connection.shutdown(socket.SHUT_RD)
+                    return
+                if reply == "rst_stream":
+                    connection.sendall(frame(RST_STREAM, 0, stream_id, (8).to_bytes(4, "big")))
+                    return
+                data = frame(DATA, 0, stream_id, b"\x00" * command.get("response_bytes", 16))
+                connection.sendall(frame(HEADERS, END_HEADERS, stream_id, RESPONSE_HEADERS))
+                if command.get("split"):
+                    connection.sendall(data[:4])
+                    time.sleep(0.05)
+                    data = data[4:]
+                connection.sendall(data)
+                connection.sendall(frame(HEADERS, END_HEADERS | END_STREAM, stream_id, TRAILERS))
+        except OSError:
+            pass
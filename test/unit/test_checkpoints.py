@@ -0,0 +1,92 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+UNIT_TESTS_DIRECTORY = Path(__file__).resolve().parent
+REPOSITORY = UNIT_TESTS_DIRECTORY.parent.parent
+FEATURES_DIRECTORY = REPOSITORY / "test" / "composition-tests"
+# Renders 3 times, the second render provisions 5 resources
+SCENARIO = "service account with 1 policyARN"
+
+
+class ResumeFailedScenarioTest(unittest.TestCase):
+    """Runs of a test scenario with the fake crossplane CLI: a render fails, and the next run resumes the scenario
+    from the checkpoint of the last successful render"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.working_directory = Path(self.directory.name)
+        bin_directory = self.working_directory / "bin"
+        bin_directory.mkdir()
+        crossplane = bin_directory / "crossplane"
+        crossplane.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{UNIT_TESTS_DIRECTORY / "fake_crossplane.py"}" '
+                              f'"$@"\n', encoding="utf-8")
+        crossplane.chmod(crossplane.stat().st_mode | stat.S_IEXEC)
+        self.log = self.working_directory / "renders.log"
+        self.env = {key: value for key, value in os.environ.items()
+                    if not key.startswith(("COMPOSITION_TESTER_", "ALLURE_", "FAKE_CROSSPLANE_"))}
+        self.env.update(PATH=f"{bin_directory}{os.pathsep}{os.environ.get('PATH', '')}", PYTHONPATH=str(REPOSITORY),
+                        FAKE_CROSSPLANE_LOG=str(self.log), COMPOSITION_TESTER_RENDER_RETRIES="0",
+                        COMPOSITION_TESTER_GHERKIN_CACHE="false")
+
+    def run_scenario(self, **env):
+        """Run the scenario in the working directory, where the checkpoints are saved
+
+        Returns:
+            tuple -- exit code of behave, number of renders, output of behave
+        """
+        self.log.unlink(missing_ok=True)
+        out = subprocess.run([sys.executable, "-m", "behave", "-f", "plain", "--no-capture", "-n", SCENARIO,
+                              str(FEATURES_DIRECTORY)], cwd=self.working_directory, env={**self.env, **env},
+                             capture_output=True, text=True, timeout=120)
+        renders = len(self.log.read_text(encoding="utf-8").splitlines()) if self.log.exists() else 0
+        return out.returncode, renders, out.stdout + out.stderr
+
+    def checkpoints(self):
+        checkpoints_directory = self.working_directory / "checkpoints"
+        return sorted(path.name for path in checkpoints_directory.iterdir()) if checkpoints_directory.exists() else []
+
+    def test_resume_from_last_successful_render(self):
+        returncode, renders, output = self.run_scenario(FAKE_CROSSPLANE_FAIL_RENDER="3")
+        self.assertNotEqual(returncode, 0, output)
+        self.assertEqual(renders, 3, output)
+        self.assertEqual(len(self.checkpoints()), 1, output)
+
+        # The first two renders and the steps before them are restored, the checks of the second render run again
+        returncode, renders, output = self.run_scenario(COMPOSITION_TESTER_RESUME_FAILED="true")
+        self.assertEqual(returncode, 0, output)
+        self.assertEqual(renders, 1, output)
+        self.assertIn("Then check that 5 resources are provisioning and they are ... passed", output)
+        # The checkpoint is removed once the scenario passed
+        self.assertEqual(self.checkpoints(), [], output)
+
+    def test_failed_scenario_without_resume(self):
+        returncode, renders, output = self.run_scenario(FAKE_CROSSPLANE_FAIL_RENDER="3")
+        self.assertNotEqual(returncode, 0, output)
+        returncode, renders, output = self.run_scenario()
+        self.assertEqual(returncode, 0, output)
+        self.assertEqual(renders, 3, output)
+        self.assertEqual(self.checkpoints(), [], output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import unittest
+from pathlib import Path
+
+import yaml
+
+from steps.utils.fuzzing import generate_claim, generate_value, load_definition_schema
+from steps.utils.schema import ClaimValidator, compile_schema
+
+TEST_DIRECTORY = Path(__file__).resolve().parent.parent
+DEFINITION_FILEPATH = TEST_DIRECTORY / "pkg" / "service-account-with-functions" / "definition.yaml"
+CLAIM_FILEPATH = TEST_DIRECTORY / "composition-tests" / "service-account-with-functions" / "resources" / "claim.yaml"
+SEEDS = range(200)
+
+SPEC_SCHEMA = {
+    "type": "object",
+    "required": ["name", "replicas", "tags"],
+    "properties": {
+        "name": {"type": "string", "minLength": 3, "maxLength": 10, "pattern": "^[a-z0-9]+$"},
+        "replicas": {"type": "integer", "minimum": 1, "maximum": 9, "multipleOf": 3},
+        "offset": {"type": "integer", "maximum": -5},
+        "above": {"type": "integer", "minimum": 1000, "exclusiveMinimum": True},
+        "ratio": {"type": "number", "minimum": 0, "maximum": 1, "exclusiveMinimum": True, "exclusiveMaximum": True},
+        "step": {"type": "number", "minimum": 0.05, "maximum": 2, "multipleOf": 0.25},
+        "enabled": {"type": "boolean"},
+        "tier": {"type": "string", "enum": ["small", "large"]},
+        "port": {"x-kubernetes-int-or-string": True},
+        "tags": {"type": "array", "minItems": 2, "maxItems": 4, "uniqueItems": True,
+                 "items": {"type": "string", "enum": ["a", "b", "c"]}},
+        "labels": {"type": "object", "additionalProperties": {"type": "string", "maxLength": 5}},
+        "rules": {"type": "array", "items": {"type": "object", "required": ["action"], "properties": {
+            "action": {"type": "string", "enum": ["allow", "deny"]},
+            "priority": {"type": "integer", "minimum": 0}}}},
+    },
+}
+
+
+def violations(schema: dict, value):
+    found = []
+    compile_schema(schema)(value, "spec", found)
+    return found
+
+
+class GenerateValueTest(unittest.TestCase):
+
+    def test_values_valid_against_the_schema(self):
+        for seed in SEEDS:
+            value = generate_value(SPEC_SCHEMA, random.Random(seed))
+            self.assertEqual(violations(SPEC_SCHEMA, value), [], f"seed {seed}: {value}")
+
+    def test_same_seed_same_value(self):
+        self.assertEqual(generate_value(SPEC_SCHEMA, random.Random(7)), generate_value(SPEC_SCHEMA, random.Random(7)))
+
+    def test_boundaries(self):
+        schema = {"type": "integer", "minimum": 1, "maximum": 5}
+        values = {generate_value(schema, random.Random(seed)) for seed in SEEDS}
+        self.assertTrue({1, 5} <= values <= {1, 2, 3, 4, 5}, values)
+
+    def test_missing_bound_derived_from_the_other(self):
+        values = [generate_value({"type": "integer", "maximum": -5}, random.Random(seed)) for seed in SEEDS]
+        self.assertEqual((min(values), max(values)), (-105, -5))
+        values = [generate_value({"type": "number", "minimum": 10}, random.Random(seed)) for seed in SEEDS]
+        self.assertEqual((min(values), max(values)), (10, 110))
+
+    def test_empty_range(self):
+        with self.assertRaisesRegex(AssertionError, "no value between 3 and 2"):
+            generate_value({"type": "integer", "minimum": 2, "maximum": 3, "exclusiveMinimum": True,
+                            "exclusiveMaximum": True}, random.Random(0))
+        with self.assertRaisesRegex(AssertionError, "no multiple of 5 between 1 and 4"):
+            generate_value({"type": "integer", "minimum": 1, "maximum": 4, "multipleOf": 5}, random.Random(0))
+
+    def test_unique_items_below_minimum(self):
+        schema = {"type": "array", "minItems": 3, "uniqueItems": True, "items": {"type": "boolean"}}
+        with self.assertRaisesRegex(AssertionError, "no 3 unique items generated"):
+            generate_value(schema, random.Random(0))
+
+    def test_pattern_fallback(self):
+        schema = {"type": "string", "pattern": "^arn:aws:iam::[0-9]{12}:policy/.+$"}
+        with self.assertRaisesRegex(AssertionError, "add a default or an example to the schema"):
+            generate_value(schema, random.Random(0))
+        example = "arn:aws:iam::123456789012:policy/example"
+        self.assertEqual(generate_value({**schema, "example": example}, random.Random(0)), example)
+
+
+class GenerateClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(CLAIM_FILEPATH, mode="r", encoding="utf-8") as file:
+            self.claim = yaml.safe_load(file)
+        with open(DEFINITION_FILEPATH, mode="r", encoding="utf-8") as file:
+            self.validator = ClaimValidator(yaml.safe_load(file))
+        self.schema = load_definition_schema(DEFINITION_FILEPATH, self.claim["apiVersion"])
+
+    def test_claims_valid_against_the_definition(self):
+        for seed in SEEDS:
+            claim = generate_claim(self.claim, self.schema, seed, validate=self.validator.validate)
+            self.assertEqual({key: claim[key] for key in ("apiVersion", "kind", "metadata")},
+                             {key: self.claim[key] for key in ("apiVersion", "kind", "metadata")})
+            self.assertIn("serviceAccountName", claim["spec"])
+
+    def test_invalid_claim_is_a_generator_bug(self):
+        with self.assertRaisesRegex(AssertionError, "bug in the claim generator: the claim generated with seed 3"):
+            generate_claim(self.claim, self.schema, 3, validate=lambda claim: ["spec.name: invalid"])
+
+
+if __name__ == "__main__":
+    unittest.main()
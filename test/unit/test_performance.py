@@ -0,0 +1,95 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from steps.utils.performance import PerformanceBaseline, parse_duration, scenario_key
+
+SCENARIO = "features/service-account.feature: service account with default policies"
+
+
+class PerformanceBaselineTest(unittest.TestCase):
+
+    def test_no_samples(self):
+        self.assertIsNone(PerformanceBaseline().check(SCENARIO, 100, 20))
+
+    def test_within_threshold(self):
+        baseline = PerformanceBaseline({SCENARIO: [1.0, 1.0, 1.0]})
+        self.assertIsNone(baseline.check(SCENARIO, 1.2, 20))
+
+    def test_regression(self):
+        baseline = PerformanceBaseline({SCENARIO: [1.0, 1.0, 1.0]})
+        regression = baseline.check(SCENARIO, 1.25, 20)
+        self.assertIn("renders took 1.250s, 25% more than the baseline median 1.000s of 3 runs", regression)
+        self.assertIn("limit 1.200s", regression)
+
+    def test_within_noise(self):
+        # Scaled median absolute deviation of 0.2s: up to 1.0 + 3 * 1.4826 * 0.2 = 1.89s is noise
+        baseline = PerformanceBaseline({SCENARIO: [0.8, 1.0, 1.2, 0.8, 1.2]})
+        self.assertIsNone(baseline.check(SCENARIO, 1.8, 20))
+        self.assertIsNotNone(baseline.check(SCENARIO, 1.9, 20))
+
+    def test_within_minimum_regression(self):
+        # A slowdown of a few milliseconds of fast renders is noise
+        baseline = PerformanceBaseline({SCENARIO: [0.01, 0.01, 0.01]})
+        self.assertIsNone(baseline.check(SCENARIO, 0.05, 20))
+        self.assertIsNotNone(baseline.check(SCENARIO, 0.07, 20))
+
+    def test_record_keeps_last_samples(self):
+        baseline = PerformanceBaseline(max_samples=3)
+        for seconds in (1, 2, 3, 4.1234567):
+            baseline.record(SCENARIO, seconds)
+        self.assertEqual(baseline.scenarios, {SCENARIO: [2, 3, 4.123457]})
+
+    def test_write_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory, "perf", "baseline.json")
+            self.assertEqual(PerformanceBaseline.load(filepath).scenarios, {})
+            baseline = PerformanceBaseline()
+            baseline.record(SCENARIO, 1.5)
+            baseline.write(filepath)
+            with open(filepath, mode="r", encoding="utf-8") as file:
+                self.assertEqual(json.load(file), {"version": 1, "scenarios": {SCENARIO: [1.5]}})
+            self.assertEqual(PerformanceBaseline.load(filepath).scenarios, {SCENARIO: [1.5]})
+            self.assertEqual([path.name for path in filepath.parent.iterdir()], ["baseline.json"])
+
+
+class ParseDurationTest(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_duration("500ms"), 0.5)
+        self.assertEqual(parse_duration("2s"), 2)
+        self.assertEqual(parse_duration("1.5 m"), 90)
+        self.assertEqual(parse_duration("3"), 3)
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, "invalid duration 2h"):
+            parse_duration("2h")
+
+
+class ScenarioKeyTest(unittest.TestCase):
+
+    def test_relative_to_project(self):
+        self.assertEqual(scenario_key("/project/features/a.feature", "/project", "scenario"),
+                         "features/a.feature: scenario")
+
+    def test_outside_project(self):
+        self.assertEqual(scenario_key("features/a.feature", "/project", "scenario"), "features/a.feature: scenario")
+
+
+if __name__ == "__main__":
+    unittest.main()
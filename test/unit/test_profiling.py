@@ -0,0 +1,146 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import yaml
+from benedict import benedict
+
+from steps.utils.checkers import check_render_growth
+from steps.utils.constants import DICT_BENEDICT_SEPARATOR
+from steps.utils.profiling import (GrowthFit, ProfilePoint, ProfileResult, fit_growth, parse_sizes, sized_claim,
+                                   sweep_claim_parameter)
+
+UNIT_TESTS_DIRECTORY = Path(__file__).resolve().parent
+TEST_DIRECTORY = UNIT_TESTS_DIRECTORY.parent
+COMPOSITION_FILEPATH = TEST_DIRECTORY / "pkg" / "service-account-with-functions" / "composition.yaml"
+CLAIM_FILEPATH = TEST_DIRECTORY / "composition-tests" / "service-account-with-functions" / "resources" / "claim.yaml"
+SIZES = [1, 10, 100, 1000]
+
+
+def claim(spec: dict):
+    return benedict({"metadata": {"name": "demo"}, "spec": spec}, keypath_separator=DICT_BENEDICT_SEPARATOR)
+
+
+def profile(overhead: float, coefficient: float, exponent: float, noise=(0, 0, 0, 0)):
+    """Profile of render times following the growth curve, with the given noise added to each measure"""
+    times = [overhead + coefficient * size ** exponent + delta for size, delta in zip(SIZES, noise)]
+    return ProfileResult("spec.policiesARN", [ProfilePoint(size, time, 0, 0) for size, time in zip(SIZES, times)],
+                         {"wall_time": fit_growth(SIZES, times)})
+
+
+class ParseSizesTest(unittest.TestCase):
+
+    def test_list(self):
+        self.assertEqual(parse_sizes("100, 1,10,10"), [1, 10, 100])
+
+    def test_range(self):
+        self.assertEqual(parse_sizes("1..1000 x10"), [1, 10, 100, 1000])
+        self.assertEqual(parse_sizes("1..100"), [1, 10, 100])
+        self.assertEqual(parse_sizes("2..50 x3"), [2, 6, 18, 50])
+
+    def test_invalid_range(self):
+        with self.assertRaisesRegex(AssertionError, "invalid sizes 0..100"):
+            parse_sizes("0..100")
+        with self.assertRaisesRegex(AssertionError, "invalid sizes 1..100 x1"):
+            parse_sizes("1..100 x1")
+
+
+class SizedClaimTest(unittest.TestCase):
+
+    def test_scalar_items(self):
+        original = claim({"policiesARN": ["arn:policy"]})
+        sized = sized_claim(original, "spec.policiesARN", 3)
+        self.assertEqual(sized["spec"]["policiesARN"], ["arn:policy-0", "arn:policy-1", "arn:policy-2"])
+        self.assertEqual(original["spec"]["policiesARN"], ["arn:policy"])
+
+    def test_object_items(self):
+        original = claim({"rules": [{"action": "allow", "ports": [80]}]})
+        sized = sized_claim(original, "spec.rules", 2)
+        self.assertEqual(sized["spec"]["rules"], [{"action": "allow", "ports": [80]}] * 2)
+        sized["spec"]["rules"][0]["ports"].append(443)
+        self.assertEqual(sized["spec"]["rules"][1]["ports"], [80])
+        self.assertEqual(original["spec"]["rules"], [{"action": "allow", "ports": [80]}])
+
+    def test_missing_param(self):
+        sized = sized_claim(claim({}), "spec.policiesARN", 2)
+        self.assertEqual(sized["spec"]["policiesARN"], ["policiesARN-0", "policiesARN-1"])
+
+    def test_scalar_param(self):
+        sized = sized_claim(claim({"replicas": 1}), "spec.replicas", 5)
+        self.assertEqual(sized["spec"]["replicas"], 5)
+
+
+class FitGrowthTest(unittest.TestCase):
+
+    def test_exponents(self):
+        for exponent in (0.5, 1, 2):
+            fit = fit_growth(SIZES, [0.1 + 0.001 * size ** exponent for size in SIZES])
+            self.assertEqual(fit.exponent, exponent)
+            self.assertAlmostEqual(fit.overhead, 0.1)
+            self.assertAlmostEqual(fit.coefficient, 0.001)
+
+    def test_flat_measures(self):
+        self.assertEqual(fit_growth(SIZES, [0.5] * len(SIZES)), GrowthFit(0.0, 0.5, 0.0))
+
+    def test_decreasing_measures(self):
+        self.assertEqual(fit_growth(SIZES, [0.4, 0.3, 0.2, 0.1]).coefficient, 0.0)
+
+
+class CheckRenderGrowthTest(unittest.TestCase):
+
+    def test_linear_growth(self):
+        check_render_growth(profile(0.1, 0.001, 1), max_exponent=1)
+        check_render_growth(profile(0.1, 0.001, 1.2), max_exponent=1)
+
+    def test_quadratic_growth(self):
+        with self.assertRaisesRegex(AssertionError, r"fitted exponent is 2.0 \(render times by size: 1: 0.101s, "):
+            check_render_growth(profile(0.1, 0.001, 2), max_exponent=1)
+
+    def test_growth_hidden_by_the_overhead(self):
+        # The growth is less than the noise of the render times
+        check_render_growth(profile(10, 1e-9, 2, noise=(0.01, -0.01, 0.02, 0)), max_exponent=1)
+
+
+class SweepClaimParameterTest(unittest.TestCase):
+    """Sweep with the fake crossplane CLI, rendering one role policy attachment per policy once the role is ready"""
+
+    def test_sweep(self):
+        with tempfile.TemporaryDirectory() as directory:
+            observed_filepath = Path(directory) / "observed.yaml"
+            observed_filepath.write_text(yaml.safe_dump({
+                "metadata": {"annotations": {"crossplane.io/composition-resource-name": "role"}},
+                "status": {"conditions": [{"type": "Ready", "status": "True"}]},
+            }), encoding="utf-8")
+            with open(CLAIM_FILEPATH, mode="r", encoding="utf-8") as file:
+                original = benedict(yaml.safe_load(file), keypath_separator=DICT_BENEDICT_SEPARATOR)
+            args = [sys.executable, str(UNIT_TESTS_DIRECTORY / "fake_crossplane.py"), "render", str(CLAIM_FILEPATH),
+                    str(COMPOSITION_FILEPATH), "functions.yaml", "-o", str(observed_filepath)]
+
+            result = sweep_claim_parameter(original, "spec.policiesARN", [1, 5, 20], directory, args, 3, repeats=2)
+
+            self.assertEqual([(point.size, point.resource_count) for point in result.points],
+                             [(1, 4), (5, 8), (20, 23)])
+            self.assertTrue(all(point.wall_time > 0 for point in result.points))
+            self.assertEqual(result.fits["resource_count"], GrowthFit(1.0, 3.0, 1.0))
+            self.assertEqual(result.fits["output_bytes"].exponent, 1.0)
+            with open(Path(directory) / "claim_spec.policiesARN_20.yaml", mode="r", encoding="utf-8") as file:
+                self.assertEqual(len(yaml.safe_load(file)["spec"]["policiesARN"]), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
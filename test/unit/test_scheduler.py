@@ -0,0 +1,138 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from steps.utils.constants import ADAPTIVE_CONCURRENCY_INITIAL_LIMIT
+from steps.utils.scheduler import RenderScheduler
+
+
+class Clock:
+    """Wall clock of the scheduler, advanced by the tests"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+class RenderSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.clock = Clock()
+        patcher = mock.patch("steps.utils.scheduler.time", wraps=time)
+        self.addCleanup(patcher.stop)
+        patcher.start().time.side_effect = self.clock.time
+
+    def scheduler(self, max_limit: int = 8):
+        return RenderScheduler(self.directory.name, max_limit)
+
+    def window(self, scheduler: RenderScheduler, latency: float, renders: int = None, seconds: float = 10):
+        """Record a window of renders of the same latency, spread over the given seconds"""
+        renders = renders or max(2 * scheduler.limit(), 4)
+        for _ in range(renders):
+            start = self.clock.now
+            self.clock.now += seconds / renders
+            scheduler.record(start, latency)
+
+    def test_initial_limit(self):
+        self.assertEqual(self.scheduler().limit(), ADAPTIVE_CONCURRENCY_INITIAL_LIMIT)
+        self.assertEqual(self.scheduler(max_limit=1).limit(), 1)
+
+    def test_increase_while_latency_is_stable(self):
+        scheduler = self.scheduler(max_limit=4)
+        self.window(scheduler, 1.0)
+        self.assertEqual(scheduler.limit(), 3)
+        # Twice as many renders as the limit make a window
+        self.window(scheduler, 1.0, renders=5, seconds=5)
+        self.assertEqual(scheduler.limit(), 3)
+        self.window(scheduler, 1.0, renders=1, seconds=1)
+        self.assertEqual(scheduler.limit(), 4)
+        self.window(scheduler, 1.0, seconds=5)
+        self.assertEqual(scheduler.limit(), 4)
+        self.assertEqual((scheduler.increases, scheduler.decreases), (2, 0))
+
+    def test_decrease_when_latency_grows(self):
+        scheduler = self.scheduler()
+        self.window(scheduler, 1.0)
+        self.window(scheduler, 1.0, seconds=5)
+        self.assertEqual(scheduler.limit(), 4)
+        self.window(scheduler, 2.0, seconds=5)
+        self.assertEqual(scheduler.limit(), 2)
+        self.assertEqual((scheduler.increases, scheduler.decreases), (2, 1))
+
+    def test_decrease_when_throughput_drops(self):
+        scheduler = self.scheduler()
+        self.window(scheduler, 1.0, seconds=10)
+        self.assertEqual(scheduler.limit(), 3)
+        # 6 renders in 40s instead of 4 in 10s
+        self.window(scheduler, 1.0, seconds=40)
+        self.assertEqual(scheduler.limit(), 1)
+
+    def test_decrease_when_overloaded(self):
+        scheduler = self.scheduler()
+        scheduler.record(self.clock.now, 1.0, overloaded=True)
+        self.assertEqual(scheduler.limit(), 1)
+        scheduler.record(self.clock.now, 1.0, overloaded=True)
+        self.assertEqual(scheduler.limit(), 1)
+
+    def test_renders_started_before_an_adjustment_are_ignored(self):
+        scheduler = self.scheduler()
+        start = self.clock.now
+        self.clock.now += 1
+        scheduler.record(self.clock.now, 1.0, overloaded=True)
+        for _ in range(4):
+            scheduler.record(start, 1.0, overloaded=True)
+        self.assertEqual(scheduler.limit(), 1)
+        self.assertEqual(scheduler.decreases, 1)
+
+    def test_limit_shared_by_the_processes(self):
+        scheduler = self.scheduler()
+        self.window(scheduler, 1.0)
+        self.assertEqual(self.scheduler().limit(), 3)
+        # A different maximum starts over
+        self.assertEqual(self.scheduler(max_limit=16).limit(), ADAPTIVE_CONCURRENCY_INITIAL_LIMIT)
+
+    def test_slots(self):
+        scheduler = self.scheduler()
+        running, max_running = [], []
+        lock = threading.Lock()
+
+        def render():
+            with scheduler.slot():
+                with lock:
+                    running.append(1)
+                    max_running.append(len(running))
+                time.sleep(0.05)
+                with lock:
+                    running.pop()
+
+        threads = [threading.Thread(target=render) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(max_running), 6)
+        self.assertLessEqual(max(max_running), ADAPTIVE_CONCURRENCY_INITIAL_LIMIT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import unittest
+from pathlib import Path
+
+import yaml
+
+from steps.utils.schema import ClaimValidator, compile_schema
+
+TEST_DIRECTORY = Path(__file__).resolve().parent.parent
+DEFINITION_FILEPATH = TEST_DIRECTORY / "pkg" / "service-account-with-functions" / "definition.yaml"
+CLAIM_FILEPATH = TEST_DIRECTORY / "composition-tests" / "service-account-with-functions" / "resources" / "claim.yaml"
+
+
+def violations(schema: dict, value):
+    found = []
+    compile_schema(schema)(value, "spec", found)
+    return found
+
+
+class CompileSchemaTest(unittest.TestCase):
+
+    def test_types(self):
+        self.assertEqual(violations({"type": "string"}, 3), ["spec: expected string, got integer 3"])
+        self.assertEqual(violations({"type": "integer"}, True), ["spec: expected integer, got boolean True"])
+        self.assertEqual(violations({"type": "object"}, ["a"]), ["spec: expected object, got array"])
+        self.assertEqual(violations({"type": "string"}, None), ["spec: must not be null"])
+        self.assertEqual(violations({"type": "string", "nullable": True}, None), [])
+
+    def test_strings_of_data_tables(self):
+        # The values set from the data tables are strings
+        self.assertEqual(violations({"type": "integer", "minimum": 1}, "3"), [])
+        self.assertEqual(violations({"type": "number"}, "1.5"), [])
+        self.assertEqual(violations({"type": "boolean"}, "True"), [])
+        self.assertEqual(violations({"type": "integer"}, "1.5"), ["spec: expected integer, got string '1.5'"])
+        self.assertEqual(violations({"type": "integer", "minimum": 1}, "0"), ["spec: 0 is less than the minimum 1"])
+
+    def test_numbers(self):
+        schema = {"type": "integer", "minimum": 0, "maximum": 10, "exclusiveMaximum": True, "multipleOf": 2}
+        self.assertEqual(violations(schema, 4), [])
+        self.assertEqual(violations(schema, -2), ["spec: -2 is less than the minimum 0"])
+        self.assertEqual(violations(schema, 10), ["spec: 10 is not less than the maximum 10"])
+        self.assertEqual(violations(schema, 3), ["spec: 3 is not a multiple of 2"])
+        self.assertEqual(violations({"type": "number", "multipleOf": 0.1}, 0.3), [])
+        self.assertEqual(violations({"type": "number", "multipleOf": 0.1}, 0.35),
+                         ["spec: 0.35 is not a multiple of 0.1"])
+
+    def test_strings(self):
+        schema = {"type": "string", "minLength": 2, "maxLength": 4, "pattern": "^[a-z]+$"}
+        self.assertEqual(violations(schema, "abc"), [])
+        self.assertEqual(violations(schema, "a"), ["spec: 'a' is shorter than 2 characters"])
+        self.assertEqual(violations(schema, "abcde"), ["spec: 'abcde' is longer than 4 characters"])
+        self.assertEqual(violations(schema, "AB"), ["spec: 'AB' does not match the pattern ^[a-z]+$"])
+        self.assertEqual(violations({"enum": ["a", "b"]}, "c"), ["spec: 'c' is not one of ['a', 'b']"])
+        self.assertEqual(violations({"type": "integer", "enum": [1, 2]}, "2"), [])
+
+    def test_arrays(self):
+        schema = {"type": "array", "minItems": 1, "maxItems": 2, "uniqueItems": True, "items": {"type": "string"}}
+        self.assertEqual(violations(schema, ["a", "b"]), [])
+        self.assertEqual(violations(schema, []), ["spec: 0 items, expected at least 1"])
+        self.assertEqual(violations(schema, ["a", "b", "c"]), ["spec: 3 items, expected at most 2"])
+        self.assertEqual(violations(schema, ["a", "a"]), ["spec: items are not unique"])
+        self.assertEqual(violations(schema, ["a", {}]), ["spec[1]: expected string, got object"])
+
+    def test_objects(self):
+        schema = {"type": "object", "required": ["name"], "properties": {"name": {"type": "string"}}}
+        self.assertEqual(violations(schema, {"name": "a"}), [])
+        self.assertEqual(violations(schema, {}), ["spec.name: required field is missing"])
+        self.assertEqual(violations(schema, {"name": "a", "size": 1}), ["spec.size: unknown field (known: name)"])
+        preserved = {**schema, "x-kubernetes-preserve-unknown-fields": True}
+        self.assertEqual(violations(preserved, {"name": "a", "size": 1}), [])
+        self.assertEqual(violations({"type": "object", "additionalProperties": {"type": "integer"}}, {"a": "b"}),
+                         ["spec.a: expected integer, got string 'b'"])
+
+    def test_all_violations_at_once(self):
+        schema = {"type": "object", "required": ["a", "b"], "properties": {
+            "a": {"type": "string"}, "b": {"type": "string"}, "c": {"type": "integer"}}}
+        self.assertEqual(violations(schema, {"c": "x"}), [
+            "spec.a: required field is missing",
+            "spec.b: required field is missing",
+            "spec.c: expected integer, got string 'x'",
+        ])
+
+    def test_combinators(self):
+        any_of = {"anyOf": [{"type": "string"}, {"type": "integer"}]}
+        self.assertEqual(violations(any_of, 1), [])
+        self.assertEqual(violations(any_of, [1]), ["spec: does not match any of the schemas of anyOf "
+                                                   "(spec: expected string, got array; "
+                                                   "spec: expected integer, got array)"])
+        one_of = {"oneOf": [{"type": "integer"}, {"type": "integer", "minimum": 0}]}
+        self.assertEqual(violations(one_of, -1), [])
+        self.assertEqual(violations(one_of, 1), ["spec: matches 2 of the schemas of oneOf, expected 1"])
+        self.assertEqual(violations({"not": {"type": "string"}}, "a"), ["spec: must not match the schema of not"])
+        self.assertEqual(violations({"x-kubernetes-int-or-string": True}, 1.5),
+                         ["spec: expected int-or-string, got number 1.5"])
+
+
+class ClaimValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(DEFINITION_FILEPATH, mode="r", encoding="utf-8") as file:
+            self.validator = ClaimValidator(yaml.safe_load(file))
+        with open(CLAIM_FILEPATH, mode="r", encoding="utf-8") as file:
+            self.claim = yaml.safe_load(file)
+
+    def test_valid_claim(self):
+        self.assertEqual(self.validator.validate(self.claim), [])
+
+    def test_invalid_claim(self):
+        claim = copy.deepcopy(self.claim)
+        del claim["spec"]["serviceAccountName"]
+        claim["spec"]["policiesARN"] = "policyArn1"
+        claim["spec"]["serviceAcountNamespace"] = "demo"
+        self.assertEqual(self.validator.validate(claim), [
+            "spec.serviceAccountName: required field is missing",
+            "spec.policiesARN: expected array, got string 'policyArn1'",
+            "spec.serviceAcountNamespace: unknown field (known: serviceAccountName, serviceAccountNamespace, "
+            "policiesARN)",
+        ])
+
+    def test_crossplane_fields(self):
+        claim = copy.deepcopy(self.claim)
+        claim["spec"]["compositionRef"] = {"name": "xsrvaccounts.aws.srvaccount.example.com"}
+        self.assertEqual(self.validator.validate(claim), [])
+
+    def test_api_version_and_kind(self):
+        claim = {**self.claim, "apiVersion": "srvaccount.example.com/v1", "kind": "SrvAccount"}
+        self.assertEqual(self.validator.validate(claim), [
+            "apiVersion: srvaccount.example.com/v1 is not a version of the definition "
+            "(expected one of: srvaccount.example.com/v1alpha1)"])
+        claim = {**self.claim, "kind": "ServiceAccount"}
+        self.assertEqual(self.validator.validate(claim), [
+            "kind: ServiceAccount is not a kind of the definition (expected one of: SrvAccount, XSrvAccount)"])
+
+
+if __name__ == "__main__":
+    unittest.main()
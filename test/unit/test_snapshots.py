@@ -0,0 +1,154 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from benedict import benedict
+
+from steps.utils.constants import DICT_BENEDICT_SEPARATOR
+from steps.utils.snapshots import (
+    SNAPSHOT_HEADER,
+    assert_matches_snapshot,
+    canonical,
+    content_hash,
+    diff,
+    read_snapshot,
+    read_snapshot_hash,
+)
+
+
+def role(**spec):
+    """Desired role as parsed from the render output: string scalars, volatile metadata and conditions"""
+    return {
+        "apiVersion": "iam.aws.crossplane.io/v1beta1",
+        "kind": "Role",
+        "metadata": {"name": "green-demo-sa", "uid": "1234", "creationTimestamp": "2023-01-01T00:00:00Z"},
+        "spec": {"forProvider": {"path": "/", **spec}},
+        "status": {"conditions": [{"type": "Ready", "status": "True", "lastTransitionTime": "2023-01-01T00:00:00Z"}]},
+    }
+
+
+class CanonicalTest(unittest.TestCase):
+
+    def test_strips_volatile_fields(self):
+        self.assertEqual(canonical({"role": role()}), {"role": {
+            "apiVersion": "iam.aws.crossplane.io/v1beta1",
+            "kind": "Role",
+            "metadata": {"name": "green-demo-sa"},
+            "spec": {"forProvider": {"path": "/"}},
+            "status": {"conditions": [{"type": "Ready", "status": "True"}]},
+        }})
+
+    def test_single_resource(self):
+        self.assertEqual(canonical(role())["metadata"], {"name": "green-demo-sa"})
+
+    def test_plain_dicts(self):
+        resources = benedict({"role": role()}, keypath_separator=DICT_BENEDICT_SEPARATOR)
+        value = canonical(resources)
+        self.assertIs(type(value), dict)
+        self.assertIs(type(value["role"]["spec"]), dict)
+        self.assertEqual(value, canonical({"role": role()}))
+
+    def test_does_not_change_the_resources(self):
+        resource = role()
+        canonical({"role": resource})
+        self.assertEqual(resource, role())
+
+    def test_hash_independent_of_key_order(self):
+        resource = role(maxSessionDuration="3600")
+        reordered = dict(reversed(list(resource.items())))
+        self.assertEqual(content_hash(canonical(resource)), content_hash(canonical(reordered)))
+        self.assertNotEqual(content_hash(canonical(resource)), content_hash(canonical(role())))
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_no_differences(self):
+        self.assertEqual(list(diff(canonical(role()), canonical(role()))), [])
+
+    def test_added_removed_and_changed_fields(self):
+        expected = {"role": {"spec": {"path": "/", "tags": ["a", "b"], "name": "old"}}}
+        actual = {"role": {"spec": {"tags": ["a"], "name": "new", "boundary": "arn"}}}
+        self.assertEqual(list(diff(expected, actual)), [
+            '+ role.spec.boundary: "arn"',
+            '~ role.spec.name: "old" -> "new"',
+            '- role.spec.path: "/"',
+            '- role.spec.tags[1]: "b"',
+        ])
+
+    def test_changed_type(self):
+        self.assertEqual(list(diff({"a": {"b": "1"}}, {"a": ["1"]})), ['~ a: {"b": "1"} -> ["1"]'])
+
+    def test_long_values_are_shortened(self):
+        [difference] = diff({"a": "x" * 200}, {})
+        self.assertLess(len(difference), 100)
+        self.assertTrue(difference.endswith("..."))
+
+
+class AssertMatchesSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.filepath = Path(self.directory.name, "snapshots", "role.yaml")
+
+    def test_missing_snapshot(self):
+        with self.assertRaisesRegex(AssertionError, "does not exist, run with --update-snapshots"):
+            assert_matches_snapshot("desired resources", {"role": role()}, self.filepath)
+        self.assertFalse(self.filepath.exists())
+
+    def test_create_and_match(self):
+        self.assertEqual(assert_matches_snapshot("desired resources", {"role": role()}, self.filepath, update=True),
+                         [f"+ created {self.filepath}"])
+        self.assertEqual(read_snapshot_hash(self.filepath), content_hash(canonical({"role": role()})))
+        self.assertEqual(read_snapshot(self.filepath), canonical({"role": role()}))
+        # The volatile fields may change
+        changed = role()
+        changed["metadata"]["uid"] = "5678"
+        self.assertEqual(assert_matches_snapshot("desired resources", {"role": changed}, self.filepath), [])
+
+    def test_mismatch(self):
+        assert_matches_snapshot("desired resources", {"role": role()}, self.filepath, update=True)
+        with self.assertRaises(AssertionError) as raised:
+            assert_matches_snapshot("desired resources", {"role": role(path="/sa/")}, self.filepath)
+        self.assertIn("1 differences", str(raised.exception))
+        self.assertIn('~ role.spec.forProvider.path: "/" -> "/sa/"', str(raised.exception))
+
+    def test_update(self):
+        assert_matches_snapshot("desired resources", {"role": role()}, self.filepath, update=True)
+        differences = assert_matches_snapshot("desired resources", {"role": role(path="/sa/")}, self.filepath,
+                                              update=True)
+        self.assertEqual(differences, ['~ role.spec.forProvider.path: "/" -> "/sa/"'])
+        self.assertEqual(assert_matches_snapshot("desired resources", {"role": role(path="/sa/")}, self.filepath), [])
+
+    def test_matching_hash_skips_the_content(self):
+        # The content is only read when the hashes differ
+        self.filepath.parent.mkdir(parents=True)
+        self.filepath.write_text(SNAPSHOT_HEADER.format(digest=content_hash(canonical({"role": role()}))) +
+                                 "not: [valid", encoding="utf-8")
+        self.assertEqual(assert_matches_snapshot("desired resources", {"role": role()}, self.filepath), [])
+
+    def test_snapshot_edited_by_hand(self):
+        # A stale or missing hash does not fail a snapshot with the same content
+        assert_matches_snapshot("desired resources", {"role": role()}, self.filepath, update=True)
+        content = self.filepath.read_text(encoding="utf-8").split("\n", 1)[1]
+        self.filepath.write_text(content, encoding="utf-8")
+        self.assertIsNone(read_snapshot_hash(self.filepath))
+        self.assertEqual(assert_matches_snapshot("desired resources", {"role": role()}, self.filepath), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
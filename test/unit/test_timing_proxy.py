@@ -0,0 +1,267 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import yaml
+
+from fake_function_server import (
+    DATA,
+    END_STREAM,
+    HEADERS,
+    HTTP2_PREFACE,
+    RST_STREAM,
+    SETTINGS,
+    FakeFunctionServer,
+    frame,
+    read_frame,
+    request_frames,
+)
+from steps.utils.constants import FUNCTION_DEVELOPMENT_TARGET_ANNOTATION, FUNCTION_RUNTIME_ANNOTATION
+from steps.utils.timing_proxy import FunctionTimings, Http2FrameParser
+
+FUNCTION = "function-fake"
+
+
+class FunctionTimingsTest(unittest.TestCase):
+    """Calls to a fake function server through the timing proxy of FunctionTimings"""
+
+    def setUp(self):
+        self.server = FakeFunctionServer()
+        self.timings = FunctionTimings()
+        self.directory = tempfile.TemporaryDirectory()
+        functions_filepath = Path(self.directory.name) / "functions.yaml"
+        with open(functions_filepath, mode="w", encoding="utf-8") as file:
+            yaml.safe_dump({
+                "apiVersion": "pkg.crossplane.io/v1beta1",
+                "kind": "Function",
+                "metadata": {"name": FUNCTION, "annotations": {
+                    FUNCTION_RUNTIME_ANNOTATION: "Development",
+                    FUNCTION_DEVELOPMENT_TARGET_ANNOTATION: f"127.0.0.1:{self.server.port}"}},
+                "spec": {"package": "xpkg.upbound.io/fake/function-fake:v0.1.0"},
+            }, file)
+        proxied_filepath = self.timings.proxied_functions_filepath(functions_filepath, self.directory.name)
+        with open(proxied_filepath, mode="r", encoding="utf-8") as file:
+            target = yaml.safe_load(file)["metadata"]["annotations"][FUNCTION_DEVELOPMENT_TARGET_ANNOTATION]
+        self.proxy_port = int(target.rsplit(":", 1)[1])
+
+    def tearDown(self):
+        self.timings.close()
+        self.server.close()
+        self.directory.cleanup()
+
+    def connect(self):
+        client = socket.create_connection(("127.0.0.1", self.proxy_port))
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.settimeout(5)
+        self.addCleanup(client.close)
+        return client
+
+    def wait_for_calls(self, count: int):
+        calls = []
+        deadline = time.monotonic() + 5
+        while len(calls) < count and time.monotonic() < deadline:
+            calls.extend(self.timings.collect())
+            time.sleep(0.01)
+        self.assertEqual(len(calls), count, f"calls measured: {calls}")
+        return calls
+
+    def test_one_call(self):
+        client = self.connect()
+        headers, data = request_frames(1, {"delay": 0.2, "response_bytes": 100})
+        client.sendall(HTTP2_PREFACE + frame(SETTINGS, 0, 0) + headers + data)
+        self.assertEqual(read_until_ended(client, {1}), {1: HEADERS})
+
+        [call] = self.wait_for_calls(1)
+        self.assertEqual(call.function, FUNCTION)
+        self.assertGreaterEqual(call.latency, 0.2)
+        self.assertLess(call.latency, 2)
+        self.assertEqual(call.request_bytes, len(data) - 9)
+        self.assertEqual(call.response_bytes, 100)
+        self.assertFalse(call.error)
+        self.assertEqual(self.timings.calls, [call])
+
+    def test_concurrent_streams(self):
+        client = self.connect()
+        delays = {1: 0.3, 3: 0.1, 5: 0.2}
+        frames = [request_frames(stream_id, {"delay": delay, "response_bytes": stream_id * 10})
+                  for stream_id, delay in delays.items()]
+        # The requests are interleaved: all the headers, then all the data
+        client.sendall(HTTP2_PREFACE + frame(SETTINGS, 0, 0) + b"".join(headers for headers, _ in frames) +
+                       b"".join(data for _, data in frames))
+        self.assertEqual(read_until_ended(client, set(delays)), {1: HEADERS, 3: HEADERS, 5: HEADERS})
+
+        calls = {call.response_bytes // 10: call for call in self.wait_for_calls(3)}
+        self.assertEqual(set(calls), set(delays))
+        for stream_id, delay in delays.items():
+            self.assertGreaterEqual(calls[stream_id].latency, delay)
+            self.assertFalse(calls[stream_id].error)
+        self.assertLess(calls[3].latency, calls[5].latency)
+        self.assertLess(calls[5].latency, calls[1].latency)
+
+    def test_split_frame_header(self):
+        client = self.connect()
+        headers, data = request_frames(1, {"response_bytes": 50, "split": True})
+        # The preface and the frames are sent in pieces cutting through the frame headers
+        stream = HTTP2_PREFACE + frame(SETTINGS, 0, 0) + headers + data
+        for cut in range(0, len(stream), 5):
+            client.sendall(stream[cut:cut + 5])
+            time.sleep(0.005)
+        self.assertEqual(read_until_ended(client, {1}), {1: HEADERS})
+
+        [call] = self.wait_for_calls(1)
+        self.assertEqual(call.request_bytes, len(data) - 9)
+        self.assertEqual(call.response_bytes, 50)
+        self.assertFalse(call.error)
+
+    def test_reset_stream(self):
+        client = self.connect()
+        headers, data = request_frames(1, {"reply": "rst_stream"})
+        client.sendall(HTTP2_PREFACE + frame(SETTINGS, 0, 0) + headers + data)
+        self.assertEqual(read_until_ended(client, {1}), {1: RST_STREAM})
+
+        [call] = self.wait_for_calls(1)
+        self.assertTrue(call.error)
+        self.assertEqual(call.response_bytes, 0)
+
+    def test_connection_reset(self):
+        client = self.connect()
+        ok_headers, ok_data = request_frames(1, {"response_bytes": 20})
+        reset_headers, reset_data = request_frames(3, {"delay": 0.2, "reply": "reset_connection"})
+        client.sendall(HTTP2_PREFACE + frame(SETTINGS, 0, 0) + ok_headers + ok_data + reset_headers + reset_data)
+        # The proxy closes the connection of the client when the function resets its own
+        self.assertEqual(read_until_ended(client, {1, 3}), {1: HEADERS})
+
+        calls = sorted(self.wait_for_calls(2), key=lambda call: call.error)
+        self.assertFalse(calls[0].error)
+        self.assertEqual(calls[0].response_bytes, 20)
+        self.assertTrue(calls[1].error)
+        self.assertGreaterEqual(calls[1].latency, 0.2)
+
+
+class SharedFunctionTargetsTest(unittest.TestCase):
+    """Functions sharing a development target or a package through the timing proxies of FunctionTimings"""
+
+    def setUp(self):
+        self.server = FakeFunctionServer()
+        self.timings = FunctionTimings()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.timings.close)
+
+    def proxy_ports(self, functions: list):
+        functions_filepath = Path(self.directory.name) / "functions.yaml"
+        with open(functions_filepath, mode="w", encoding="utf-8") as file:
+            yaml.safe_dump_all(functions, file)
+        proxied_filepath = self.timings.proxied_functions_filepath(functions_filepath, self.directory.name)
+        with open(proxied_filepath, mode="r", encoding="utf-8") as file:
+            return {function["metadata"]["name"]: int(function["metadata"]["annotations"][
+                FUNCTION_DEVELOPMENT_TARGET_ANNOTATION].rsplit(":", 1)[1]) for function in yaml.safe_load_all(file)}
+
+    def call(self, port: int):
+        client = socket.create_connection(("127.0.0.1", port))
+        client.settimeout(5)
+        self.addCleanup(client.close)
+        headers, data = request_frames(1, {})
+        client.sendall(HTTP2_PREFACE + frame(SETTINGS, 0, 0) + headers + data)
+        self.assertEqual(read_until_ended(client, {1}), {1: HEADERS})
+
+    def collect_functions(self, count: int):
+        calls = []
+        deadline = time.monotonic() + 5
+        while len(calls) < count and time.monotonic() < deadline:
+            calls.extend(self.timings.collect())
+            time.sleep(0.01)
+        return sorted(call.function for call in calls)
+
+    def test_same_development_target(self):
+        target = f"127.0.0.1:{self.server.port}"
+        ports = self.proxy_ports([function(name, "xpkg.upbound.io/fake/function-fake:v0.1.0", target)
+                                  for name in ("function-a", "function-b")])
+        self.assertNotEqual(ports["function-a"], ports["function-b"])
+        self.call(ports["function-b"])
+        self.call(ports["function-a"])
+        self.assertEqual(self.collect_functions(2), ["function-a", "function-b"])
+
+    def test_same_package(self):
+        package = "xpkg.upbound.io/fake/function-fake:v0.1.0"
+        with mock.patch("steps.utils.timing_proxy.start_function_container",
+                        return_value=("container", "127.0.0.1", self.server.port)) as start, \
+                mock.patch("steps.utils.timing_proxy.remove_containers") as remove:
+            ports = self.proxy_ports([function(name, package) for name in ("function-a", "function-b")])
+            self.call(ports["function-a"])
+            self.call(ports["function-b"])
+            self.assertEqual(self.collect_functions(2), ["function-a", "function-b"])
+            self.timings.close()
+        # One container for both functions
+        start.assert_called_once_with(package)
+        remove.assert_called_once_with(["container"])
+
+
+class Http2FrameParserTest(unittest.TestCase):
+
+    def test_byte_by_byte(self):
+        frames = []
+        parser = Http2FrameParser(lambda *args: frames.append(args), expect_preface=True)
+        stream = (HTTP2_PREFACE + frame(SETTINGS, 0, 0) + frame(HEADERS, 0x4, 1, b"\x83") +
+                  frame(DATA, END_STREAM, 1, b"x" * 300) + frame(RST_STREAM, 0, 1, b"\x00" * 4))
+        for index in range(len(stream)):
+            parser.feed(stream[index:index + 1])
+        self.assertEqual(frames, [(SETTINGS, 0, 0, 0), (HEADERS, 0x4, 1, 1), (DATA, END_STREAM, 1, 300),
+                                  (RST_STREAM, 0, 1, 4)])
+
+    def test_frames_in_one_chunk(self):
+        frames = []
+        parser = Http2FrameParser(lambda *args: frames.append(args))
+        parser.feed(frame(HEADERS, 0x4, 3, b"\x88") + frame(DATA, 0, 3, b"y" * 10) + frame(HEADERS, 0x5, 3)[:5])
+        parser.feed(frame(HEADERS, 0x5, 3)[5:])
+        self.assertEqual(frames, [(HEADERS, 0x4, 3, 1), (DATA, 0, 3, 10), (HEADERS, 0x5, 3, 0)])
+
+
+def function(name: str, package: str, development_target: str = None):
+    """Function of a functions file, using the Development runtime if it has a target"""
+    annotations = {}
+    if development_target:
+        annotations = {FUNCTION_RUNTIME_ANNOTATION: "Development",
+                       FUNCTION_DEVELOPMENT_TARGET_ANNOTATION: development_target}
+    return {"apiVersion": "pkg.crossplane.io/v1beta1", "kind": "Function",
+            "metadata": {"name": name, "annotations": annotations}, "spec": {"package": package}}
+
+
+def read_until_ended(client: socket.socket, stream_ids: set):
+    """Read the frames sent back by the proxy until the given streams ended or the connection is closed
+
+    Returns:
+        dict -- stream id -> type of the frame that ended it (trailers or reset)
+    """
+    ended = {}
+    try:
+        while set(ended) != stream_ids:
+            frame_type, flags, stream_id, _ = read_frame(client)
+            if stream_id in stream_ids and (frame_type == RST_STREAM or
+                                            (frame_type == HEADERS and flags & END_STREAM)):
+                ended[stream_id] = frame_type
+    except (ConnectionError, OSError):
+        pass
+    return ended
+
+
+if __name__ == "__main__":
+    unittest.main()
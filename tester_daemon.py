@@ -0,0 +1,340 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tester daemon: keeps python, behave, the step definitions, the parsed features and project files and the
+composition functions warm, and runs the tests sent by a thin client over a Unix socket.
+
+Usage:
+    python tester_daemon.py serve                       # start the daemon in the foreground
+    python tester_daemon.py run [behave arguments]      # run the tests with the daemon, started if needed
+    python tester_daemon.py stop                        # stop the daemon
+
+The client only imports the standard library modules it needs, so that its own startup stays short.
+"""
+
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# Unix socket of the daemon, can be changed with the environment variable COMPOSITION_TESTER_DAEMON_SOCKET
+DAEMON_SOCKET_PATH = "/tmp/xplane-composition-tester.sock"
+DAEMON_STARTUP_TIMEOUT_SECONDS = 30
+# Prefixes of the environment variables sent by the client to configure a test run
+FORWARDED_ENVIRONMENT = ("COMPOSITION_TESTER_", "ALLURE_")
+# Defaults of the test runs of the daemon, unless set by the client
+DAEMON_ENVIRONMENT = {"COMPOSITION_TESTER_WARM_FUNCTIONS": "true"}
+
+
+def socket_path():
+    return os.environ.get("COMPOSITION_TESTER_DAEMON_SOCKET", DAEMON_SOCKET_PATH)
+
+
+def send_message(stream, message: dict):
+    stream.write((json.dumps(message) + "\n").encode("utf-8"))
+    stream.flush()
+
+
+# -----------------------------------------------------------------------------
+# CLIENT
+# -----------------------------------------------------------------------------
+def connect(start: bool = True):
+    """Connect to the daemon, and start it if it is not running
+
+    Keyword Arguments:
+        start {bool} -- start the daemon if it is not running (default: {True})
+
+    Returns:
+        socket.socket -- connection to the daemon, None if it is not running and not started
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path())
+        return client
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not start:
+            client.close()
+            return None
+
+    print(f"Starting the tester daemon on {socket_path()}", file=sys.stderr)
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve"], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + DAEMON_STARTUP_TIMEOUT_SECONDS
+    while True:
+        try:
+            client.connect(socket_path())
+            return client
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                sys.exit(f"the tester daemon did not start within {DAEMON_STARTUP_TIMEOUT_SECONDS}s")
+            time.sleep(0.05)
+
+
+def request(message: dict):
+    """Send a request to the daemon and print the output it streams back
+
+    Arguments:
+        message {dict} -- request
+
+    Returns:
+        int -- exit code of the test run
+    """
+    while True:
+        client = connect(start=message["command"] != "stop")
+        if client is None:
+            return 0
+        with client, client.makefile("rwb") as stream:
+            send_message(stream, message)
+            restart = False
+            for line in stream:
+                response = json.loads(line)
+                if "stdout" in response:
+                    sys.stdout.write(response["stdout"])
+                    sys.stdout.flush()
+                elif "stderr" in response:
+                    sys.stderr.write(response["stderr"])
+                    sys.stderr.flush()
+                elif "restart" in response:
+                    restart = True
+                elif "exit" in response:
+                    return response["exit"]
+        if not restart:
+            return 1
+        # The daemon restarts to load the changed step definitions: send the request again
+        time.sleep(0.1)
+
+
+def client_main(command: str, args):
+    message = {
+        "command": command,
+        "cwd": os.getcwd(),
+        "args": list(args),
+        "env": {key: value for key, value in os.environ.items() if key.startswith(FORWARDED_ENVIRONMENT)},
+    }
+    return request(message)
+
+
+# -----------------------------------------------------------------------------
+# DAEMON
+# -----------------------------------------------------------------------------
+class SocketOutput:
+    """Text stream sending what is written to the client"""
+
+    def __init__(self, stream, name: str):
+        self.stream = stream
+        self.name = name
+        self.encoding = "utf-8"
+
+    def write(self, text):
+        if text:
+            send_message(self.stream, {self.name: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class WarmBehave:
+    """Run behave many times in the same process. The step definitions are loaded once, the feature files are
+    parsed once and parsed again only when they change. Also used by the workers of the mutation tester.
+    """
+
+    def __init__(self):
+        # Imported here so that the client does not pay for them
+        from behave import runner as behave_runner
+        from behave.model import reset_model
+        from behave.runner import Runner
+
+        self.features = {}
+        daemon = self
+
+        class WarmRunner(Runner):
+            def load_step_definitions(self, extra_step_paths=None):
+                # The step definitions of the first run stay in the step registry
+                if not daemon.step_definitions_loaded:
+                    super().load_step_definitions(extra_step_paths)
+                    daemon.step_definitions_loaded = True
+
+            def run_with_paths(self):
+                # Kept to look at the results of the run, e.g. by the mutation tester
+                daemon.last_runner = self
+                # The runner calls the parse_features it imported
+                behave_runner.parse_features = daemon.parse_features
+                try:
+                    return super().run_with_paths()
+                finally:
+                    behave_runner.parse_features = daemon.parse_features_original
+
+        self.runner_class = WarmRunner
+        self.last_runner = None
+        self.step_definitions_loaded = False
+        self.parse_features_original = behave_runner.parse_features
+        self.reset_model = reset_model
+
+    def parse_features(self, feature_locations, language=None):
+        """Parse the feature files, reusing the features parsed by previous test runs if the files did not change.
+        The locations of single scenarios (e.g. file.feature:10) are parsed again, together with the other scenarios
+        of the same file so that the feature runs once."""
+        features = []
+        for filename, locations in itertools.groupby(feature_locations,
+                                                     key=lambda location: getattr(location, "filename", location)):
+            locations = list(locations)
+            if any(getattr(location, "line", None) for location in locations) or not os.path.exists(filename):
+                features += self.parse_features_original(locations, language=language)
+                continue
+            key = (os.path.abspath(filename), language)
+            mtime = os.stat(filename).st_mtime
+            cached = self.features.get(key)
+            if cached is None or cached[0] != mtime:
+                parsed = self.parse_features_original(locations[:1], language=language)
+                cached = self.features[key] = (mtime, parsed)
+            self.reset_model(cached[1])
+            features += cached[1]
+        return features
+
+    def run_behave(self, args, cwd, env: dict, stdout, stderr, replace_forwarded: bool = False):
+        """Run behave with arguments, in a working directory and environment
+
+        Arguments:
+            args {list} -- behave arguments
+            cwd {str} -- working directory
+            env {dict} -- environment variables added to the environment of the process
+            stdout {TextIO} -- standard output of the run
+            stderr {TextIO} -- standard error of the run
+
+        Keyword Arguments:
+            replace_forwarded {bool} -- remove the variables of the process with a FORWARDED_ENVIRONMENT prefix
+                before adding env, e.g. those of the environment the daemon was started in (default: {False})
+
+        Returns:
+            int -- exit code
+        """
+        from behave.__main__ import run_behave
+        from behave.configuration import Configuration, ConfigError
+
+        saved_cwd, environ, path = os.getcwd(), dict(os.environ), list(sys.path)
+        saved_stdout, saved_stderr = sys.stdout, sys.stderr
+        os.chdir(cwd)
+        if replace_forwarded:
+            for key in [key for key in os.environ if key.startswith(FORWARDED_ENVIRONMENT)]:
+                del os.environ[key]
+        os.environ.update(env)
+        sys.path.insert(0, cwd)
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            config = Configuration(args)
+            return run_behave(config, runner_class=self.runner_class)
+        except ConfigError as e:
+            print(f"ConfigError: {e}", file=sys.stderr)
+            return 1
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        finally:
+            sys.stdout, sys.stderr = saved_stdout, saved_stderr
+            sys.path[:] = path
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(saved_cwd)
+
+
+class TesterDaemon(WarmBehave):
+    """Run the test runs sent by the clients, one at a time, in the same process.
+
+    If the step definitions change, the daemon restarts itself before the next test run.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.sources_signature = sources_signature()
+
+    def serve(self):
+        check_crossplane_version()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        print(f"Tester daemon listening on {self.path}")
+        try:
+            while True:
+                connection, _ = server.accept()
+                with connection, connection.makefile("rwb") as stream:
+                    message = json.loads(stream.readline())
+                    if message["command"] == "stop":
+                        send_message(stream, {"exit": 0})
+                        return
+                    if sources_signature() != self.sources_signature:
+                        # The step definitions cannot be reloaded in the same step registry
+                        send_message(stream, {"stderr": "Step definitions changed, restarting the tester daemon\n"})
+                        send_message(stream, {"restart": True})
+                        break
+                    send_message(stream, {"exit": self.run(message, stream)})
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+        # Restart with the changed step definitions
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), "serve"])
+
+    def run(self, message: dict, stream):
+        """Run behave with the arguments of the client, in its working directory and environment: the forwarded
+        variables of the daemon do not leak into the run
+
+        Returns:
+            int -- exit code
+        """
+        return self.run_behave(message["args"], message["cwd"], {**DAEMON_ENVIRONMENT, **message["env"]},
+                               SocketOutput(stream, "stdout"), SocketOutput(stream, "stderr"), replace_forwarded=True)
+
+
+def sources_signature():
+    """Modification times of the python sources loaded by the test runs (step definitions, hooks, formatters)"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    filepaths = [os.path.join(base, f) for f in os.listdir(base) if f.endswith(".py")]
+    for root, _, files in os.walk(os.path.join(base, "steps")):
+        filepaths += [os.path.join(root, f) for f in files if f.endswith(".py")]
+    return sorted((filepath, os.stat(filepath).st_mtime) for filepath in filepaths)
+
+
+def check_crossplane_version():
+    """Check once that the crossplane CLI is installed, like tests_runner.sh does before each run"""
+    out = subprocess.run(["crossplane", "version", "--client"], capture_output=True, text=True)
+    if out.returncode != 0:
+        sys.exit(f"crossplane CLI not available: {out.stderr}")
+    print(out.stdout.strip())
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ("serve", "run", "stop"):
+        print(__doc__)
+        return 2
+    command = argv[1]
+    if command == "serve":
+        # The steps are imported from the working directory of the daemon, e.g. steps.utils
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        TesterDaemon(socket_path()).serve()
+        return 0
+    return client_main(command, argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
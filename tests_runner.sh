@@ -5,6 +5,10 @@
 #
 # ARG_OPTIONAL_REPEATED([tags],[t],[tags to filter the scenarios to run from the feature files; multiple tags can be provided and they are combined with 'AND'])
 # ARG_OPTIONAL_BOOLEAN([debug],[d],[enable debug mode],[off])
+# ARG_OPTIONAL_SINGLE([render-timeout],[],[timeout in seconds of a single render; 0 disables the timeout],[])
+# ARG_OPTIONAL_BOOLEAN([resume-failed],[],[resume the failed scenarios from their last successful render],[off])
+# ARG_OPTIONAL_BOOLEAN([update-snapshots],[],[rewrite the snapshots of the snapshot steps instead of checking them],[off])
+# ARG_OPTIONAL_BOOLEAN([daemon],[],[run the tests with the tester daemon, started if it is not running],[off])
 # ARG_POSITIONAL_SINGLE([composition-project-dir],[directory of crossplane compositions project that contains a pkg folder],[])
 # ARG_POSITIONAL_SINGLE([tests-dir],[directory where the BDD feature files are placed],[composition-tests])
 # ARG_HELP([Runner of crossplane composition tests])
@@ -38,16 +42,24 @@ _arg_tests_dir="composition-tests"
 # THE DEFAULTS INITIALIZATION - OPTIONALS
 _arg_tags=()
 _arg_debug="off"
+_arg_render_timeout=
+_arg_resume_failed="off"
+_arg_update_snapshots="off"
+_arg_daemon="off"
 
 
 print_help()
 {
 	printf '%s\n' "Runner of crossplane composition tests"
-	printf 'Usage: %s [-t|--tags <arg>] [-d|--(no-)debug] [-h|--help] <composition-project-dir> [<tests-dir>]\n' "$0"
+	printf 'Usage: %s [-t|--tags <arg>] [-d|--(no-)debug] [--render-timeout <arg>] [--(no-)resume-failed] [--(no-)update-snapshots] [--(no-)daemon] [-h|--help] <composition-project-dir> [<tests-dir>]\n' "$0"
 	printf '\t%s\n' "<composition-project-dir>: directory of crossplane compositions project that contains a pkg folder"
 	printf '\t%s\n' "<tests-dir>: directory where the BDD feature files are placed (default: 'composition-tests')"
 	printf '\t%s\n' "-t, --tags: tags to filter the scenarios to run from the feature files; multiple tags can be provided and they are combined with 'AND' (empty by default)"
 	printf '\t%s\n' "-d, --debug, --no-debug: enable debug mode (off by default)"
+	printf '\t%s\n' "--render-timeout: timeout in seconds of a single render; 0 disables the timeout (no default)"
+	printf '\t%s\n' "--resume-failed, --no-resume-failed: resume the failed scenarios from their last successful render (off by default)"
+	printf '\t%s\n' "--update-snapshots, --no-update-snapshots: rewrite the snapshots of the snapshot steps instead of checking them (off by default)"
+	printf '\t%s\n' "--daemon, --no-daemon: run the tests with the tester daemon, started if it is not running (off by default)"
 	printf '\t%s\n' "-h, --help: Prints help"
 }
 
@@ -82,6 +94,26 @@ parse_commandline()
 					{ begins_with_short_option "$_next" && shift && set -- "-d" "-${_next}" "$@"; } || die "The short option '$_key' can't be decomposed to ${_key:0:2} and -${_key:2}, because ${_key:0:2} doesn't accept value and '-${_key:2:1}' doesn't correspond to a short option."
 				fi
 				;;
+			--render-timeout)
+				test $# -lt 2 && die "Missing value for the optional argument '$_key'." 1
+				_arg_render_timeout="$2"
+				shift
+				;;
+			--render-timeout=*)
+				_arg_render_timeout="${_key##--render-timeout=}"
+				;;
+			--no-resume-failed|--resume-failed)
+				_arg_resume_failed="on"
+				test "${1:0:5}" = "--no-" && _arg_resume_failed="off"
+				;;
+			--no-update-snapshots|--update-snapshots)
+				_arg_update_snapshots="on"
+				test "${1:0:5}" = "--no-" && _arg_update_snapshots="off"
+				;;
+			--no-daemon|--daemon)
+				_arg_daemon="on"
+				test "${1:0:5}" = "--no-" && _arg_daemon="off"
+				;;
 			-h|--help)
 				print_help
 				exit 0
@@ -163,6 +195,21 @@ then
     export COMPOSITION_TESTER_DEBUG_MODE="true"
 fi
 
+if [ -n "$_arg_render_timeout" ]
+then
+    export COMPOSITION_TESTER_RENDER_TIMEOUT="$_arg_render_timeout"
+fi
+
+if [ "$_arg_resume_failed" = on ]
+then
+    export COMPOSITION_TESTER_RESUME_FAILED="true"
+fi
+
+if [ "$_arg_update_snapshots" = on ]
+then
+    export COMPOSITION_TESTER_UPDATE_SNAPSHOTS="true"
+fi
+
 if [ -z "$_arg_tags" ]; then
     echo "Running all tests"
 else
@@ -178,12 +225,21 @@ fi
 [ -L $LINK_TARGET_PROJECT_DIR ] && rm $LINK_TARGET_PROJECT_DIR
 ln -sv $TARGET_PROJECT_DIR $LINK_TARGET_PROJECT_DIR
 
-# Set the PYTHONPATH to the current directory to be able to import cucumber_json.py
+# Set the PYTHONPATH to the current directory to be able to import unified_reporter.py and cucumber_json.py
 export PYTHONPATH=.
 
-behave --junit \
-    -f allure_behave.formatter:AllureFormatter -o allure_reports \
-    -f cucumber_json:PrettyCucumberJSONFormatter -o cucumber_reports/cucumber_report.json \
+# The tester daemon keeps behave, the steps and the composition functions warm between runs
+BEHAVE="behave"
+if [ "$_arg_daemon" = on ]
+then
+    BEHAVE="python tester_daemon.py run"
+fi
+
+# The unified formatter writes the allure results (allure_reports), the JUnit reports (reports)
+# and the cucumber report (cucumber_reports/cucumber_report.json) in a single pass
+$BEHAVE \
+    -f unified_reporter:UnifiedFormatter -o allure_reports \
+    -D cucumber_report=cucumber_reports/cucumber_report.json \
     -f pretty \
     $PARAM_TAGS \
     $LINK_TARGET_PROJECT_DIR/$TESTS_SUB_DIR
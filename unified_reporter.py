@@ -0,0 +1,277 @@
+# Copyright 2023 Swisscom (Schweiz) AG
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from socket import gethostname
+
+import allure_commons
+from allure_behave.formatter import AllureFormatter
+from allure_behave.listener import AllureListener
+from allure_commons.logger import AllureFileLogger, INDENT
+from allure_commons.utils import get_testplan
+from attr import asdict
+from behave.formatter.base import Formatter, StreamOpener
+from behave.model import ScenarioOutline
+from behave.model_core import Status
+from behave.reporter.junit import ElementTreeWithCDATA, ElementTree, FeatureReportData, JUnitReporter, _text
+
+from cucumber_json import PrettyCucumberJSONFormatter
+
+# Default path of the cucumber report, can be changed with: -D cucumber_report=<path>
+DEFAULT_CUCUMBER_REPORT = "cucumber_reports/cucumber_report.json"
+# Maximum number of pending writes handled in one batch by the writer thread
+WRITE_BATCH_SIZE = 64
+
+
+class ReportWriter:
+    """Write the report files from a background thread, in batches, so that the test run does not wait on disk.
+
+    The writes are done in the order they are submitted, so that the files written in several parts (e.g. the
+    cucumber report) stay consistent. Errors are raised when the writer is closed.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._streams = {}
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, filepath, data, append: bool = False):
+        """Submit a write
+
+        Arguments:
+            filepath {str} -- path of the file
+            data {bytes} -- content to write
+
+        Keyword Arguments:
+            append {bool} -- append to the file, kept open until the writer is closed (default: {False})
+        """
+        self._queue.put((Path(filepath), data, append))
+
+    def close(self):
+        """Wait for the pending writes and close the files
+
+        Raises:
+            OSError: a write failed
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:
+                    for stream in self._streams.values():
+                        stream.close()
+                    return
+                try:
+                    self._write(*item)
+                except OSError as e:
+                    self._error = self._error or e
+            for stream in self._streams.values():
+                stream.flush()
+
+    def _write(self, filepath, data, append):
+        if not append:
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            with open(filepath, "wb") as file:
+                file.write(data)
+            return
+
+        stream = self._streams.get(filepath)
+        if stream is None:
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            stream = self._streams[filepath] = open(filepath, "wb")
+        stream.write(data)
+
+
+class WriterStream:
+    """Text stream forwarding what is written to a report writer"""
+
+    def __init__(self, writer: ReportWriter, filepath):
+        self.writer = writer
+        self.name = filepath
+
+    def write(self, text):
+        self.writer.write(self.name, text.encode("utf-8"), append=True)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BatchedAllureFileLogger(AllureFileLogger):
+    """Allure file logger handing the results and attachments to the report writer. The results are serialized
+    exactly like AllureFileLogger does, so that the allure results stay the same."""
+
+    def __init__(self, report_dir, writer: ReportWriter):
+        super().__init__(report_dir)
+        self.writer = writer
+
+    def _report_item(self, item):
+        indent = INDENT if os.environ.get("ALLURE_INDENT_OUTPUT") else None
+        filename = item.file_pattern.format(prefix=uuid.uuid4())
+        data = asdict(item, filter=lambda _, v: v or v is False)
+        with io.StringIO() as json_file:
+            json.dump(data, json_file, indent=indent, ensure_ascii=False)
+            self.writer.write(self._report_dir / filename, json_file.getvalue().encode("utf-8"))
+
+    @allure_commons.hookimpl
+    def report_attached_file(self, source, file_name):
+        # The source is read right away, it may change before the write
+        with open(source, "rb") as file:
+            self.writer.write(self._report_dir / file_name, file.read())
+
+    @allure_commons.hookimpl
+    def report_attached_data(self, body, file_name):
+        self.writer.write(self._report_dir / file_name, body.encode("utf-8") if isinstance(body, str) else body)
+
+
+class BatchedJUnitReporter(JUnitReporter):
+    """JUnit reporter handing the XML report of each feature to the report writer. The XML is built exactly like
+    JUnitReporter does, so that the JUnit reports stay the same."""
+
+    def __init__(self, config, writer: ReportWriter):
+        super().__init__(config)
+        self.writer = writer
+
+    def feature(self, feature):
+        if feature.status == Status.skipped and not self.show_skipped:
+            return
+
+        feature_filename = self.make_feature_filename(feature)
+        classname = feature_filename
+        report = FeatureReportData(feature, feature_filename)
+        now = datetime.now()
+
+        suite = ElementTree.Element(u'testsuite')
+        feature_name = feature.name or feature_filename
+        suite.set(u'name', u'%s.%s' % (classname, feature_name))
+
+        for scenario in feature:
+            if isinstance(scenario, ScenarioOutline):
+                self._process_scenario_outline(scenario, report)
+            else:
+                self._process_scenario(scenario, report)
+
+        for testcase in report.testcases:
+            suite.append(testcase)
+
+        suite.set(u'tests', _text(report.counts_tests))
+        suite.set(u'errors', _text(report.counts_errors))
+        suite.set(u'failures', _text(report.counts_failed))
+        suite.set(u'skipped', _text(report.counts_skipped))
+        suite.set(u'time', _text(round(feature.duration, 6)))
+        if self.show_timestamp:
+            suite.set(u'timestamp', _text(now.isoformat()))
+        if self.show_hostname:
+            suite.set(u'hostname', _text(gethostname()))
+
+        with io.BytesIO() as xml_file:
+            ElementTreeWithCDATA(suite).write(xml_file, "UTF-8")
+            self.writer.write(os.path.join(self.config.junit_directory, u'TESTS-%s.xml' % feature_filename),
+                              xml_file.getvalue())
+
+
+class UnifiedFormatter(AllureFormatter):
+    """Single formatter writing the allure results, the JUnit XML reports and the cucumber JSON report of a test
+    run. It replaces running behave with --junit, the allure formatter and the cucumber formatter at the same time:
+    the behave events are handled once, and all the files are written in batches by one background writer.
+
+    Usage:
+        behave -f unified_reporter:UnifiedFormatter -o allure_reports [--junit-directory reports]
+            [-D cucumber_report=cucumber_reports/cucumber_report.json]
+    """
+    name = "unified"
+    description = "Allure results, JUnit XML and cucumber JSON reports"
+
+    def __init__(self, stream_opener, config):
+        Formatter.__init__(self, stream_opener, config)
+        self.writer = ReportWriter()
+        # Same as --junit, which must not be given too: keep the captured output of the scenarios for the JUnit reports
+        config.junit = True
+        config.stdout_capture = config.stderr_capture = config.log_capture = True
+
+        self.listener = AllureListener(config)
+        self.file_logger = BatchedAllureFileLogger(self.stream_opener.name, self.writer)
+        allure_commons.plugin_manager.register(self.listener)
+        allure_commons.plugin_manager.register(self.file_logger)
+        self.testplan = get_testplan()
+
+        cucumber_report = config.userdata.get("cucumber_report", DEFAULT_CUCUMBER_REPORT)
+        self.cucumber = PrettyCucumberJSONFormatter(
+            StreamOpener(stream=WriterStream(self.writer, cucumber_report)), config)
+        self.junit = BatchedJUnitReporter(config, self.writer)
+        self.current_feature = None
+
+    def uri(self, uri):
+        super().uri(uri)
+        self.cucumber.uri(uri)
+
+    def feature(self, feature):
+        super().feature(feature)
+        self.cucumber.feature(feature)
+        self.current_feature = feature
+
+    def background(self, background):
+        self.cucumber.background(background)
+
+    def scenario(self, scenario):
+        self.cucumber.scenario(scenario)
+
+    def step(self, step):
+        super().step(step)
+        self.cucumber.step(step)
+
+    def match(self, match):
+        super().match(match)
+        self.cucumber.match(match)
+
+    def result(self, result):
+        super().result(result)
+        self.cucumber.result(result)
+
+    def eof(self):
+        super().eof()
+        self.cucumber.eof()
+        if self.current_feature is not None:
+            self.junit.feature(self.current_feature)
+            self.current_feature = None
+
+    def close_stream(self):
+        super().close_stream()
+        self.cucumber.close()
+        # Unregistered so that a next test run in the same process (e.g. the tester daemon) does not report twice
+        allure_commons.plugin_manager.unregister(self.listener)
+        allure_commons.plugin_manager.unregister(self.file_logger)
+        self.writer.close()